@@ -99,8 +99,9 @@ from collections import defaultdict
 import argparse
 import warnings
 import scripts.utils_vis as vis
+from scripts.utils_fcd import load_fcd_columns
 import matplotlib.pyplot as plt
-import dill
+import pickle
 from bisect import bisect_right
 import json
 import hashlib
@@ -296,6 +297,30 @@ class LaneSelector:
 
         return True
 
+    def allow_mask(self, lane_ids: List[str], lane: np.ndarray, pos: np.ndarray,
+                   x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Vectorized allow() over columnar samples: `lane` holds indices into `lane_ids`.
+        ID rules only depend on the lane, so they are evaluated once per lane ID.
+        """
+        keep = np.array([self.allow(ln) for ln in lane_ids], dtype=bool)[lane]
+        edge_ids = [self.edge_from_lane(ln) for ln in lane_ids]
+
+        # position windows (drop if inside any)
+        for ids, rules in ((lane_ids, self._lane_pos_rules), (edge_ids, self._edge_pos_rules)):
+            for rex, exact, windows in rules:
+                hit = np.array([bool(rex.search(s)) if rex else (s == exact) for s in ids], dtype=bool)[lane]
+                for a, b in windows:
+                    keep &= ~(hit & (a <= pos) & (pos <= b))
+
+        # XY regions (drop if inside)
+        for (x0, y0, x1, y1) in self._rects:
+            keep &= ~((x0 <= x) & (x <= x1) & (y0 <= y) & (y <= y1))
+        for (cx, cy, r) in self._circles:
+            keep &= ~((x - cx)**2 + (y - cy)**2 <= r*r)
+
+        return keep
+
     # ---------- cache signature ----------
     def to_signature_dict(self) -> Dict[str, Any]:
         """Options for cache invalidation (order-insensitive)."""
@@ -416,6 +441,252 @@ def _selector_signature(lane_selector) -> dict | None:
     }
     return sig
 
+# ===== Metrics cache: one array file per metric family =====
+# Version of the metrics cache layout - bump when a family or codec changes
+METRICS_CACHE_VERSION = 1
+
+# Metric families: {family: {attribute: codec}}. Attributes not listed here and not in
+# METRICS_CACHE_SKIP are stored in the "summary" family.
+METRIC_FAMILIES = {
+    "distributions": {
+        "speeds": "lists", "accelerations": "lists", "space_gaps": "lists", "time_headways": "lists",
+        "ttc_values": "lists", "drac_values": "lists", "pet_list": "lists", "accepted_gaps": "lists",
+        "per_trip_fuel_consumption": "lists", "lane_change_frequency": "lists", "lane_change_frequency_raw": "lists",
+        "speeds_vis": "lists", "accel_vis": "lists", "travel_times": "keyed", "first_seen": "keyed",
+    },
+    "trajectories": {
+        "positions": "ragged", "speed_traj": "ragged", "xy_traj": "ragged", "vehicle_lane_history": "ragged",
+        "current_lane": "pickle",
+    },
+    "raw": {
+        "positions_all": "ragged", "vehicle_lane_history_all": "ragged", "timestep_lane_positions_all": "grid",
+        "vehicle_info": "pickle", "_prev_lane_raw": "pickle",
+    },
+    "lane_grid": {
+        "timestep_lane_occupancy": "grid", "timestep_lane_positions": "grid",
+    },
+    "urban": {
+        "detector_data": "pickle", "detector_by_lane": "pickle", "detector_mapping": "pickle", "det2lane": "pickle",
+        "lane_map": "pickle", "tls_time_states": "pickle", "tls_programs": "pickle", "tls_intervals": "pickle",
+        "tls_interval_index": "pickle", "paog_by_detector": "pickle", "gor_values": "pickle", "gor_type": "pickle",
+        "approach_delay_values": "pickle", "time_to_service_values": "pickle", "time_to_service_split": "pickle",
+        "spillback_events": "pickle", "spillback_summary": "pickle",
+    },
+    "summary": {},
+}
+METRICS_CACHE_SKIP = ("fcd", "lane_selector", "_cache_dir", "_cache_attrs")
+
+# Families computed by TrafficMetrics.compute_fcd_metrics in one pass over the FCD
+FCD_METRIC_FAMILIES = ("raw", "distributions", "trajectories", "lane_grid")
+
+def _offsets(lengths):
+    out = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=out[1:])
+    return out
+
+def _column(values, kinds="biuf"):
+    """Array of a list of scalars; raise TypeError when they do not form a numeric (or `kinds`) array."""
+    if not len(values):
+        return np.zeros(0)
+    arr = np.asarray(values)
+    if arr.ndim != 1 or arr.dtype.kind not in kinds:
+        raise TypeError(f"not a flat array of kind {kinds}")
+    return arr
+
+def _plain(value):
+    """Copy of nested dicts with defaultdicts turned into dicts (lambda factories do not pickle)."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+def _encode_metric(value, codec):
+    """Encode one attribute into {part: array} with the given codec."""
+    if codec == "lists":
+        # {key: [number]}
+        keys = list(value)
+        cols = [_column(list(value[k])) for k in keys]
+        return {
+            "keys": np.array(keys, dtype=str),
+            "offsets": _offsets([len(c) for c in cols]),
+            "values": np.concatenate(cols) if cols else np.zeros(0),
+        }
+
+    if codec == "keyed":
+        # {key: {id: number}}
+        keys = list(value)
+        ids = [i for k in keys for i in value[k]]
+        return {
+            "keys": np.array(keys, dtype=str),
+            "offsets": _offsets([len(value[k]) for k in keys]),
+            "ids": _column(ids, "U"),
+            "values": _column([x for k in keys for x in value[k].values()]),
+        }
+
+    if codec == "ragged":
+        # {key: {id: [(scalar, ...)]}}, one array per tuple field
+        keys = list(value)
+        ids = [i for k in keys for i in value[k]]
+        seqs = [s for k in keys for s in value[k].values()]
+        rows = [r for s in seqs for r in s]
+        width = len(rows[0]) if rows else 0
+        if any(not isinstance(r, tuple) or len(r) != width for r in rows):
+            raise TypeError("rows are not tuples of one width")
+        parts = {
+            "keys": np.array(keys, dtype=str),
+            "offsets": _offsets([len(value[k]) for k in keys]),
+            "ids": _column(ids, "U"),
+            "row_offsets": _offsets([len(s) for s in seqs]),
+        }
+        for j, field in enumerate(zip(*rows)):
+            parts[f"field{j}"] = _column(field, "biufU")
+        return parts
+
+    if codec == "grid":
+        # {time: {lane: {id: pos}}} or {time: {lane: {id}}}
+        times = list(value)
+        cells = [(i, lane, ids) for i, t in enumerate(times) for lane, ids in value[t].items()]
+        is_set = any(isinstance(ids, (set, frozenset)) for _, _, ids in cells)
+        return {
+            "times": _column(times),
+            "cell_time": _column([i for i, _, _ in cells], "i"),
+            "cell_lane": _column([lane for _, lane, _ in cells], "U"),
+            "offsets": _offsets([len(ids) for _, _, ids in cells]),
+            "ids": _column([i for _, _, ids in cells for i in ids], "U"),
+            "pos": np.zeros(0) if is_set else _column([p for _, _, ids in cells for p in ids.values()]),
+            "is_set": np.array(is_set),
+        }
+
+    if codec == "pickle":
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            blob = pickle.dumps(_plain(value), protocol=pickle.HIGHEST_PROTOCOL)
+        return {"blob": np.frombuffer(blob, dtype=np.uint8)}
+
+    raise ValueError(f"Unknown metrics codec: {codec}")
+
+def _decode_metric(parts, codec):
+    """Inverse of _encode_metric: rebuild the attribute from its {part: array}."""
+    if codec == "pickle":
+        return pickle.loads(parts["blob"].tobytes())
+
+    if codec == "grid":
+        times = parts["times"].tolist()
+        offsets = parts["offsets"].tolist()
+        ids = parts["ids"].tolist()
+        pos = parts["pos"].tolist()
+        is_set = bool(parts["is_set"])
+
+        # Nested defaultdicts like the containers TrafficMetrics builds, so lookups of missing cells work alike
+        cell = set if is_set else dict
+        out = defaultdict(lambda: defaultdict(cell))
+        for t in times:
+            out[t] = defaultdict(cell)
+        for c, (i, lane) in enumerate(zip(parts["cell_time"].tolist(), parts["cell_lane"].tolist())):
+            i0, i1 = offsets[c], offsets[c+1]
+            out[times[i]][lane] = set(ids[i0:i1]) if is_set else dict(zip(ids[i0:i1], pos[i0:i1]))
+        return out
+
+    keys = parts["keys"].tolist()
+    offsets = parts["offsets"].tolist()
+
+    if codec == "lists":
+        values = parts["values"].tolist()
+        return {k: values[offsets[j]:offsets[j+1]] for j, k in enumerate(keys)}
+
+    ids = parts["ids"].tolist()
+
+    if codec == "keyed":
+        values = parts["values"].tolist()
+        return {k: dict(zip(ids[offsets[j]:offsets[j+1]], values[offsets[j]:offsets[j+1]])) for j, k in enumerate(keys)}
+
+    if codec == "ragged":
+        row_offsets = parts["row_offsets"].tolist()
+        fields = []
+        while f"field{len(fields)}" in parts:
+            fields.append(parts[f"field{len(fields)}"].tolist())
+        rows = list(zip(*fields)) if fields else []
+
+        out = {}
+        for j, k in enumerate(keys):
+            out[k] = defaultdict(list)
+            for s in range(offsets[j], offsets[j+1]):
+                out[k][ids[s]] = rows[row_offsets[s]:row_offsets[s+1]]
+        return out
+
+    raise ValueError(f"Unknown metrics codec: {codec}")
+
+def _metric_family_attrs(m):
+    """Return {family: {attribute: codec}} of the attributes a TrafficMetrics object holds, decoded or not."""
+    names = dict.fromkeys(list(vars(m)) + list(getattr(m, "_cache_attrs", ())))
+    listed = {attr for attrs in METRIC_FAMILIES.values() for attr in attrs}
+    families = {family: {attr: codec for attr, codec in attrs.items() if attr in names}
+                for family, attrs in METRIC_FAMILIES.items()}
+    families["summary"] = {attr: "pickle" for attr in names if attr not in listed and attr not in METRICS_CACHE_SKIP}
+    return families
+
+def _read_metrics_index(cache_dir):
+    """Return the index of a metrics cache directory, or an empty index if missing or of another version."""
+    try:
+        with open(os.path.join(cache_dir, "index.json"), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = None
+
+    if not isinstance(index, dict) or index.get("version") != METRICS_CACHE_VERSION:
+        index = {"version": METRICS_CACHE_VERSION, "families": {}}
+    return index
+
+def _write_metric_families(cache_dir, m, sigs, index):
+    """
+    Save the families in `sigs` ({family: signature}) of a TrafficMetrics object as uncompressed
+    <family>.npz files and record them in the index. Other families in the index are kept.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_file = os.path.join(cache_dir, "index.json")
+    families = _metric_family_attrs(m)
+
+    # Drop the families from the index first so a partially written file is never loaded
+    for family in sigs:
+        index["families"].pop(family, None)
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_file + ".tmp", index_file)
+
+    for family, sig in sigs.items():
+        parts, attrs = {}, {}
+        for attr, codec in families[family].items():
+            value = getattr(m, attr)
+            try:
+                encoded = _encode_metric(value, codec)
+            except (TypeError, ValueError):
+                # Shape not supported by the codec (e.g. None or mixed types)
+                codec = "pickle"
+                encoded = _encode_metric(value, codec)
+
+            attrs[attr] = codec
+            parts.update({f"{attr}.{name}": arr for name, arr in encoded.items()})
+
+        path = os.path.join(cache_dir, f"{family}.npz")
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **parts)
+        os.replace(path + ".tmp", path)
+        index["families"][family] = {"sig": sig, "attrs": attrs}
+
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_file + ".tmp", index_file)
+
+def _read_metric(cache_dir, family, attr, codec):
+    """Decode one attribute from its family file, reading only that attribute's arrays."""
+    prefix = attr + "."
+    with np.load(os.path.join(cache_dir, f"{family}.npz"), allow_pickle=False) as npz:
+        parts = {name[len(prefix):]: npz[name] for name in npz.files if name.startswith(prefix)}
+    return _decode_metric(parts, codec)
+
+def _hash_sig(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
 def load_or_build_metrics(
     file_dir: str,
     urban_mode: bool = True,
@@ -426,11 +697,20 @@ def load_or_build_metrics(
     """
     Load metrics cache if present and valid; otherwise build from scratch.
 
-    Cache invalidation (signature) is based on:
-      - Input files' mtime + size (FCD, and detector/TLS files when urban_mode=True)
-      - Urban mode flag
-      - LaneSelector filtering rules
-      - strict_vehicle_filter mode (e.g., 'sample')
+    The cache is a directory `metrics_<tag>.cache/` holding one uncompressed .npz file per metric
+    family (see METRIC_FAMILIES) and an index.json with the cache version and, per family, its
+    signature and attributes. Each family has its own signature, based on:
+      - Input files' mtime + size: FCD for all families, stats for the summary, and detector/TLS
+        files for the urban and summary families when urban_mode=True
+      - Urban mode flag (urban and summary families)
+      - LaneSelector filtering rules and strict_vehicle_filter mode (all but the raw family)
+
+    When every family is up to date, a CachedMetrics object is returned that decodes each attribute
+    on first access, so callers only pay for the metrics they use. Otherwise only the stages of the
+    out-of-date families are recomputed and rewritten: the FCD families (FCD_METRIC_FAMILIES) are
+    computed together in one pass, so any of them being stale rebuilds all metrics, while a stale
+    urban or summary family alone reruns the urban metrics or the stats parsing on top of the
+    cached FCD families and summary.
 
     Parameters
     ----------
@@ -451,63 +731,79 @@ def load_or_build_metrics(
     # Build penetration tag for filenames (default kept for backward compatibility)
     pen_tag = penetration_tag if penetration_tag is not None else "p0"
 
-    # Cache file name (use penetration tag so caches for different penetrations don't collide)
-    pkl = os.path.join(file_dir, f"metrics_{pen_tag}.pkl")
+    # Cache directory name (use penetration tag so caches for different penetrations don't collide)
+    cache_dir = os.path.join(file_dir, f"metrics_{pen_tag}.cache")
 
-    # ---- Build file list for signature (only existing files affect the hash) ----
+    # ---- Build file lists for signatures (only existing files affect the hash) ----
     # FCD path (change to your actual file name if different)
     fcd_path = os.path.join(file_dir, f"fcd_{pen_tag}.xml")
-    files_for_sig = [fcd_path]
+    stats_path = os.path.join(file_dir, f"stats_{pen_tag}.xml")
+    urban_files = []
 
     if urban_mode:
         # Use absolute paths as-is; join relative ones to file_dir.
         det_path = _abs_or_join(file_dir, "sumo_scenarios/roosevelt/detector_output.xml")
         tls_path = _abs_or_join(file_dir, "sumo_scenarios/roosevelt/tls.xml")
-        files_for_sig.extend([det_path, tls_path])
+        urban_files.extend([det_path, tls_path])
 
-    # File signature (mtime + size)
-    file_sig, _ = _file_sig(files_for_sig)
+    # File signatures (mtime + size)
+    fcd_sig, _ = _file_sig([fcd_path])
+    stats_sig, _ = _file_sig([stats_path])
+    urban_sig, _ = _file_sig(urban_files)
 
-    # Config signature (urban flag + filtering configuration)
-    cfg = {
-        "urban_mode": bool(urban_mode),
+    # Config signatures (filtering configuration, urban flag)
+    gate_cfg = {
         "strict_vehicle_filter": str(strict_vehicle_filter or "sample"),
         "lane_selector": _selector_signature(lane_selector),
     }
-    cfg_json = json.dumps(cfg, sort_keys=True, ensure_ascii=False, default=str)
-    cfg_sig = hashlib.sha1(cfg_json.encode("utf-8")).hexdigest()
-
-    # Final signature combines files + config
-    cur_sig = f"{file_sig}|{cfg_sig}"
+    urban_cfg = {"urban_mode": bool(urban_mode), "files": urban_sig}
+
+    sigs = {
+        "raw": _hash_sig(fcd_sig),
+        "distributions": _hash_sig(fcd_sig, gate_cfg),
+        "trajectories": _hash_sig(fcd_sig, gate_cfg),
+        "lane_grid": _hash_sig(fcd_sig, gate_cfg),
+        "urban": _hash_sig(fcd_sig, gate_cfg, urban_cfg),
+        "summary": _hash_sig(fcd_sig, stats_sig, gate_cfg, urban_cfg),
+    }
+    cur_sig = sigs["summary"]
 
     # ---- Try loading cache ----
-    if os.path.isfile(pkl):
-        try:
-            with open(pkl, "rb") as f:
-                obj = dill.load(f)
-            old_sig = getattr(obj, "cache_sig", None)
-            if old_sig == cur_sig:
-                print("[CACHE] Loaded metrics.pkl (inputs & filters unchanged).")
-                return obj
-            else:
-                print("[CACHE] metrics.pkl found but signature changed -> rebuild.")
-        except Exception as e:
-            print(f"[CACHE] Failed to load metrics.pkl, rebuilding. Reason: {e}")
-
-    # ---- Rebuild metrics from scratch ----
-    # NOTE: TrafficMetrics __init__ should accept lane_selector and strict_vehicle_filter.
-    m = TrafficMetrics(
-        file_dir=file_dir,
-        save_metrics=False,
-        urban_mode=urban_mode,
-        lane_selector=lane_selector,
-        strict_vehicle_filter=strict_vehicle_filter,
-        cache_sig=cur_sig,
-        penetration_tag=pen_tag,
-    )
-    with open(pkl, "wb") as f:
-        dill.dump(m, f)
-    print(f"[CACHE] Built metrics and saved {os.path.basename(pkl)}")
+    index = _read_metrics_index(cache_dir)
+    stale = [family for family in METRIC_FAMILIES if index["families"].get(family, {}).get("sig") != sigs[family]]
+    if not stale:
+        print(f"[CACHE] Loaded {os.path.basename(cache_dir)} (inputs & filters unchanged).")
+        return CachedMetrics(cache_dir, index, lane_selector=lane_selector)
+    elif index["families"]:
+        print(f"[CACHE] {os.path.basename(cache_dir)} found but signature changed for {', '.join(stale)} -> rebuild.")
+
+    if any(family in stale for family in FCD_METRIC_FAMILIES) or "summary" not in index["families"]:
+        # ---- Rebuild metrics from scratch ----
+        # NOTE: TrafficMetrics __init__ should accept lane_selector and strict_vehicle_filter.
+        m = TrafficMetrics(
+            file_dir=file_dir,
+            save_metrics=False,
+            urban_mode=urban_mode,
+            lane_selector=lane_selector,
+            strict_vehicle_filter=strict_vehicle_filter,
+            cache_sig=cur_sig,
+            penetration_tag=pen_tag,
+        )
+    else:
+        # ---- Recompute the stale stages on top of the cached FCD families and previous summary ----
+        fresh = {"version": index["version"],
+                 "families": {family: entry for family, entry in index["families"].items() if family not in stale or family == "summary"}}
+        m = CachedMetrics(cache_dir, fresh, lane_selector=lane_selector)
+        m.file_dir, m.penetration_tag, m.cache_sig = file_dir, pen_tag, cur_sig
+        m.compute_stats()
+        if "urban" in stale:
+            m.compute_urban_metrics(urban_mode)
+
+    try:
+        _write_metric_families(cache_dir, m, {family: sigs[family] for family in stale}, index)
+        print(f"[CACHE] Built metrics and saved {', '.join(stale)} to {os.path.basename(cache_dir)}")
+    except OSError as e:
+        print(f"[CACHE] Could not write {os.path.basename(cache_dir)}: {e}")
 
     return m
 
@@ -590,7 +886,8 @@ class TrafficMetrics:
           and compute signal-related urban metrics.
         - If `urban_mode=False`: skip urban signal metrics.
 
-        Only comments/docstrings were updated for clarity; runtime behavior is unchanged.
+        The metrics are computed in stages: `compute_stats`, `compute_fcd_metrics` and
+        `compute_urban_metrics`, so a metrics cache can recompute only the stages of its stale families.
         """
         self.file_dir = file_dir
         self.save_metrics = save_metrics
@@ -604,17 +901,6 @@ class TrafficMetrics:
         self.STORE_SPEED_TRAJ  = True  # Default does not store the entire speed track
         self.WRITE_FUEL_IN_FCD = False  # Do not write back to FCD to avoid whole tree memory
 
-        # --- AUDIT counters ---
-        from collections import defaultdict as _dd
-        self._audit = _dd(int)   # keys: samples_total, samples_drop_selector, safety_kept, safety_skip, ...
-
-        # --- raw (ungated) lane-change for PET ---
-        self.positions_all = {"hdv": _dd(list), "cav": _dd(list)}
-        self.timestep_lane_positions_all = defaultdict(lambda: defaultdict(dict))
-        self.vehicle_lane_history_all = {"hdv": _dd(list), "cav": _dd(list)}
-        self._prev_lane_raw = {}  # veh_id -> last seen lane (raw)
-        self.xy_traj = {"hdv": defaultdict(list), "cav": defaultdict(list)}
-
         # --- PET tunables (highway-friendly defaults) ---
         self.PET_EPS       = getattr(self, "PET_EPS", 0.10)   # s
         self.PET_T_WINDOW  = getattr(self, "PET_T_WINDOW", 25.0)
@@ -629,16 +915,13 @@ class TrafficMetrics:
         # Default to 'p0.1' for backward compatibility with loader defaults.
         self.penetration_tag = penetration_tag if penetration_tag is not None else "p0.1"
         fcd_path = os.path.join(file_dir, f"fcd_{self.penetration_tag}.xml")
-        stats_path = os.path.join(file_dir, f"stats_{self.penetration_tag}.xml")
 
         if os.path.isfile(fcd_path):
             self.fcd_file = fcd_path
         else:
             raise FileNotFoundError(f"FCD file not found at {fcd_path}")
 
-        if os.path.isfile(stats_path):
-            self.stats_path = stats_path
-            self.parse_stats(stats_path)
+        self.compute_stats()
 
         # Analysis gates and defaults (overridable by setting same-named attributes)
         self.POS_MIN_ANALYSIS    = getattr(self, "POS_MIN_ANALYSIS", 100.0)
@@ -651,6 +934,47 @@ class TrafficMetrics:
         self.ACC_MIN, self.ACC_MAX = -8.0, 8.0
         self.HW_V_EPS = 0.1  # protection for headway denominator
 
+        self.compute_fcd_metrics()
+        self.compute_urban_metrics(urban_mode)
+
+        # ----------- Cache signature -----------
+        if cache_sig is None:
+            cur_sig, _ = _file_sig([self.fcd_file, getattr(self, "detector_file", None), getattr(self, "tls_file", None)])
+            self.cache_sig = cur_sig
+        else:
+            self.cache_sig = cache_sig
+
+    def compute_stats(self):
+        """
+        Parse the SUMO statistics output of the run when present (summary family). The fuel and
+        delay entries that `compute_fcd_metrics` adds to `self.simulation_stats` are kept.
+        """
+        derived = {key: value for key, value in getattr(self, "simulation_stats", {}).items() if key in ("fuel", "delay")}
+
+        stats_path = os.path.join(self.file_dir, f"stats_{self.penetration_tag}.xml")
+        if os.path.isfile(stats_path):
+            self.stats_path = stats_path
+            self.parse_stats(stats_path)
+            self.simulation_stats.update(derived)
+        elif hasattr(self, "simulation_stats"):
+            self.simulation_stats = derived
+
+    def compute_fcd_metrics(self):
+        """
+        Compute the metrics of the FCD in one pass: the raw, distributions, trajectories and
+        lane_grid families, and the FCD-derived attributes of the summary family.
+        """
+        # --- AUDIT counters ---
+        from collections import defaultdict as _dd
+        self._audit = _dd(int)   # keys: samples_total, samples_drop_selector, safety_kept, safety_skip, ...
+
+        # --- raw (ungated) lane-change for PET ---
+        self.positions_all = {"hdv": _dd(list), "cav": _dd(list)}
+        self.timestep_lane_positions_all = defaultdict(lambda: defaultdict(dict))
+        self.vehicle_lane_history_all = {"hdv": _dd(list), "cav": _dd(list)}
+        self._prev_lane_raw = {}  # veh_id -> last seen lane (raw)
+        self.xy_traj = {"hdv": defaultdict(list), "cav": defaultdict(list)}
+
         # Containers
         self.speeds = {"hdv": [], "cav": []}
         self.accelerations = {"hdv": [], "cav": []}
@@ -696,6 +1020,13 @@ class TrafficMetrics:
         self._finalize_lane_change_frequency()
         self._build_delay_stats(free_flow_speed_hdv=30.0, free_flow_speed_cav=30.0)
 
+    def compute_urban_metrics(self, urban_mode):
+        """
+        Compute the signal metrics of the urban family from the detector/TLS outputs when
+        `urban_mode=True`. Reads the lane grid and summary attributes of `compute_fcd_metrics`.
+        """
+        file_dir = self.file_dir
+
         # ----------- Urban‑mode specific -----------
         if urban_mode:
             mapping_file = os.path.join(file_dir, "sumo_scenarios/roosevelt/detector_mapping.json")
@@ -724,13 +1055,6 @@ class TrafficMetrics:
         else:
             print("[Init] Urban mode disabled, skipping detector/tls/add files.")
             self.detector_file, self.tls_file, self.add_file = None, None, None
-   
-        # ----------- Cache signature -----------
-        if cache_sig is None:
-            cur_sig, _ = _file_sig([self.fcd_file, getattr(self, "detector_file", None), getattr(self, "tls_file", None)])
-            self.cache_sig = cur_sig
-        else:
-            self.cache_sig = cache_sig
 
     def _cap_large_values(self):
 
@@ -751,13 +1075,12 @@ class TrafficMetrics:
      
     def parse_xml(self):
         """
-        Low-memory streaming parsing of FCD:
-        - Iterate over <timestep>/<vehicle> with ElementTree.iterparse
-        - Keep only small per-step structures in memory
+        Columnar parsing of FCD:
+        - Load the FCD as typed NumPy arrays (scripts.utils_fcd.load_fcd_columns, from its sidecar once built), kept in self.fcd
+        - Compute gates, distributions, lane changes, fuel and travel times with vectorized group-bys
         - Store BOTH raw(*_all) and gated containers (after LaneSelector)
         """
 
-        import xml.etree.ElementTree as ET
         import numpy as np
         from collections import defaultdict
 
@@ -777,19 +1100,113 @@ class TrafficMetrics:
         STORE_SPEED_TRAJ  = bool(getattr(self, "STORE_SPEED_TRAJ", True))
         STORE_XY_TRAJ     = bool(getattr(self, "STORE_XY_TRAJ", True))
         WRITE_FUEL_IN_FCD = bool(getattr(self, "WRITE_FUEL_IN_FCD", False))
+        USE_FCD_SIDECAR   = bool(getattr(self, "USE_FCD_SIDECAR", True))
+        FCD_WORKERS       = getattr(self, "FCD_WORKERS", None)  # processes parsing the XML; None = all cores
+
+        # ==== columnar decode ====
+        fcd = load_fcd_columns(self.fcd_file, use_sidecar=USE_FCD_SIDECAR, workers=FCD_WORKERS)
+
+        # Samples missing an attribute the metrics need are skipped
+        complete = fcd.has("pos", "x", "speed", "accel")
+        if not complete.all():
+            fcd = fcd.subset(np.flatnonzero(complete))
+        self.fcd = fcd
+
+        times    = fcd.times
+        t        = fcd.time
+        pos      = fcd.pos
+        vids     = fcd.veh_ids
+        lanes    = fcd.lane_ids
+        n_veh    = len(vids)
+        # vehicle types are lowercased, default 'hdv'
+        types    = list(dict.fromkeys((vt or "hdv").lower() for vt in fcd.type_ids))
+        veh_type = np.array([types.index((vt or "hdv").lower()) for vt in fcd.type_ids] + [-1], dtype=np.int32)[fcd.veh_type]
+        s_type   = veh_type[fcd.veh]
+        lane_ok  = np.array([bool(ln) and not ln.startswith(":J") for ln in lanes], dtype=bool)[fcd.lane]
+
+        # ---------- RAW: prior to any filtering ----------
+        # Vehicle type registration (raw also needs it, otherwise downstream _all cannot find the type)
+        if not hasattr(self, "vehicle_info") or not isinstance(self.vehicle_info, dict):
+            self.vehicle_info = {}
+        for vid, k in zip(vids, veh_type.tolist()):
+            self.vehicle_info.setdefault(vid, {"type": types[k]})
 
-        # ===== Containers (ensure existence) =====
-        self.timesteps = []
-        self.num_hdvs_per_timestep = []
-        self.num_cavs_per_timestep = []
-
-        if not hasattr(self, "positions"):     self.positions = {"hdv": {}, "cav": {}}
-        if not hasattr(self, "positions_all"): self.positions_all = {"hdv": defaultdict(list), "cav": defaultdict(list)}
-        if not hasattr(self, "speed_traj"):
-            self.speed_traj = {"hdv": defaultdict(list), "cav": defaultdict(list)} if STORE_SPEED_TRAJ else {"hdv": {}, "cav": {}}
-        if not hasattr(self, "xy_traj"):
-            self.xy_traj = {"hdv": defaultdict(list), "cav": defaultdict(list)} if STORE_XY_TRAJ else {"hdv": {}, "cav": {}}
-
+        # ---------- Sample-level lane selector（gated pipeline） ----------
+        if (self.lane_selector is not None) and (self.strict_vehicle_filter == "sample"):
+            if hasattr(self.lane_selector, "allow_mask"):
+                gated = self.lane_selector.allow_mask(lanes, fcd.lane, pos, fcd.x, fcd.y)
+            else:
+                gated = np.fromiter(
+                    (self.lane_selector.allow(lanes[l], pos=p, x=x, y=y)
+                     for l, p, x, y in zip(fcd.lane.tolist(), pos.tolist(), fcd.x.tolist(), fcd.y.tolist())),
+                    dtype=bool, count=len(fcd))
+        else:
+            gated = np.ones(len(fcd), dtype=bool)
+
+        # clamp/clean
+        v  = np.clip(fcd.speed, 0.0, V_MAX)
+        a  = np.clip(fcd.accel, ACC_MIN, ACC_MAX)
+        has_leader = fcd.leader_speed >= 0
+        ls = np.clip(fcd.leader_speed, 0.0, V_MAX)
+        lg = np.maximum(0.0, fcd.leader_gap)
+
+        # unified gates
+        passed_pos_gate = (pos >= POS_MIN_ANALYSIS)
+        passed_safety   = passed_pos_gate if SAFETY_USE_POS_GATE else np.ones(len(fcd), dtype=bool)
+
+        # Python floats of the columns, shared by all containers (as when appending while streaming)
+        t_list   = times.tolist()
+        t_obj    = list(map(t_list.__getitem__, fcd.step.tolist()))
+        pos_obj  = pos.tolist()
+        tp_obj   = list(zip(t_obj, pos_obj))
+
+        def _by_vehicle(idx, *cols):
+            """Yield (vid, lists...) of the samples idx per vehicle, vehicles in order of first sample"""
+            order, vehs, starts, ends = fcd.group_by_vehicle(np.flatnonzero(idx))
+            order = order.tolist()
+            lists = [list(map(c.__getitem__, order)) for c in cols]
+            for vk, i0, i1 in zip(vehs.tolist(), starts.tolist(), ends.tolist()):
+                yield (vids[vk],) + tuple(c[i0:i1] for c in lists)
+
+        # trajectories: RAW positions & gated positions/speeds/xy
+        self.positions_all = {vt: defaultdict(list) for vt in ("hdv", "cav")}
+        self.positions     = {"hdv": {}, "cav": {}}
+        self.speed_traj    = {"hdv": defaultdict(list), "cav": defaultdict(list)} if STORE_SPEED_TRAJ else {"hdv": {}, "cav": {}}
+        self.xy_traj       = {"hdv": defaultdict(list), "cav": defaultdict(list)} if STORE_XY_TRAJ else {"hdv": {}, "cav": {}}
+        v_obj, x_obj, y_obj = v.tolist(), fcd.x.tolist(), fcd.y.tolist()
+        for k, vt in enumerate(types):
+            is_vt = (s_type == k)
+            for vid, tp in _by_vehicle(is_vt, tp_obj):
+                self.positions_all.setdefault(vt, defaultdict(list))[vid] = tp
+            for vid, tp, tt, vv, xx, yy in _by_vehicle(is_vt & gated, tp_obj, t_obj, v_obj, x_obj, y_obj):
+                self.positions.setdefault(vt, {})[vid] = tp
+                if STORE_SPEED_TRAJ:
+                    self.speed_traj.setdefault(vt, defaultdict(list))[vid] = list(zip(tt, vv))
+                if STORE_XY_TRAJ:
+                    self.xy_traj.setdefault(vt, defaultdict(list))[vid] = list(zip(tt, xx, yy))
+
+        del tp_obj, v_obj, x_obj, y_obj
+
+        # lane changes: RAW over all samples, gated over lane-grid samples and recorded when passed_safety
+        def _lane_history(idx, keep=None):
+            hist = {vt: defaultdict(list) for vt in ("hdv", "cav")}
+            prev, cur = fcd.lane_changes(np.flatnonzero(idx))
+            if keep is not None:
+                prev, cur = prev[keep[cur]], cur[keep[cur]]
+            for vk, tt, l0, l1 in zip(fcd.veh[cur].tolist(), t[cur].tolist(), fcd.lane[prev].tolist(), fcd.lane[cur].tolist()):
+                hist.setdefault(types[veh_type[vk]], defaultdict(list))[vids[vk]].append((tt, lanes[l0], lanes[l1]))
+            return hist
+
+        def _last_lane(idx):
+            order, vehs, _, ends = fcd.group_by_vehicle(np.flatnonzero(idx))
+            return {vids[vk]: lanes[l] for vk, l in zip(vehs.tolist(), fcd.lane[order[ends - 1]].tolist())}
+
+        self.vehicle_lane_history_all = _lane_history(np.ones(len(fcd), dtype=bool))
+        self.vehicle_lane_history     = _lane_history(gated & lane_ok, keep=passed_safety)
+        self._prev_lane_raw = _last_lane(np.ones(len(fcd), dtype=bool))
+        self.current_lane   = _last_lane(gated & lane_ok)
+
+        # distributions & safety (gated)
         self.speeds        = {"hdv": [], "cav": []}
         self.accelerations = {"hdv": [], "cav": []}
         self.space_gaps    = {"hdv": [], "cav": []}
@@ -797,213 +1214,100 @@ class TrafficMetrics:
         self.ttc_values    = {"hdv": [], "cav": []}
         self.drac_values   = {"hdv": [], "cav": []}
 
-        if not hasattr(self, "vehicle_lane_history"):     self.vehicle_lane_history     = {"hdv": defaultdict(list), "cav": defaultdict(list)}
-        if not hasattr(self, "vehicle_lane_history_all"): self.vehicle_lane_history_all = {"hdv": defaultdict(list), "cav": defaultdict(list)}
-        if not hasattr(self, "_prev_lane_raw"):           self._prev_lane_raw = {}
-
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            headway = np.minimum(999.0, lg / np.maximum(HW_V_EPS, v))
+            ttc     = lg / np.maximum(HW_V_EPS, v - ls)
+            drac    = (v - ls) * (v - ls) / (2.0 * lg)
+        has_ttc  = has_leader & (v > ls) & np.isfinite(ttc) & (ttc >= 0)
+        has_drac = has_leader & (lg > 1.0) & np.isfinite(drac)
+
+        for k, vt in enumerate(types):
+            safe = gated & passed_safety & (s_type == k)
+            self.speeds.setdefault(vt, []).extend(v[safe].tolist())
+            self.accelerations.setdefault(vt, []).extend(a[safe].tolist())
+            self.space_gaps.setdefault(vt, []).extend(lg[safe].tolist())
+            self.time_headways.setdefault(vt, []).extend(headway[safe].tolist())
+            self.ttc_values.setdefault(vt, []).extend(ttc[safe & has_ttc].tolist())
+            self.drac_values.setdefault(vt, []).extend(drac[safe & has_drac].tolist())
+
+        # time axis + presence (gated)
+        self.timesteps = list(t_list)
+        n_steps = len(times)
+        present = np.unique(fcd.step[gated].astype(np.int64) * n_veh + fcd.veh[gated])
+        counts  = {vt: [0] * n_steps for vt in ("hdv", "cav")}
+        for k, vt in enumerate(types):
+            is_vt = (veh_type[present % max(n_veh, 1)] == k)
+            counts[vt] = np.bincount(present[is_vt] // n_veh, minlength=n_steps).tolist()
+        self.num_hdvs_per_timestep = counts["hdv"]
+        self.num_cavs_per_timestep = counts["cav"]
+
+        # lane grid snapshots: gated occupancy/positions and RAW positions
         self.timestep_lane_occupancy = {}    # gated
         self.timestep_lane_positions = {}    # gated
-        if not hasattr(self, "timestep_lane_positions_all"):
-            self.timestep_lane_positions_all = defaultdict(lambda: defaultdict(dict))  # raw
-
-        self.first_seen     = {"hdv": {}, "cav": {}}
-        vehicle_last_seen   = {"hdv": {}, "cav": {}}
-
-        if not hasattr(self, "vehicle_info") or not isinstance(self.vehicle_info, dict):
-            self.vehicle_info = {}
-        if not hasattr(self, "current_lane") or not isinstance(self.current_lane, dict):
-            self.current_lane = {}
-
-        vehicle_fuel_consumption = {"hdv": {}, "cav": {}}
-        vehicle_distance         = {"hdv": {}, "cav": {}}
-
-        # Per-step state
-        cur_time  = None
-        prev_time = None
-        dt_step   = 0.1
-        step_idx  = -1
-        first_time = None
-        last_time  = None
-
-        # per-step containers: raw & gated
-        lane_occ_g  = None
-        lane_pos_g  = None
-        lane_pos_all = None
-        present_hdv_g = None
-        present_cav_g = None
-
-        # ==== streaming parse ====
-        context = ET.iterparse(self.fcd_file, events=("start", "end"))
-        context = iter(context)
-        try:
-            _ev, root = next(context)  # for periodic root.clear()
-        except StopIteration:
-            raise RuntimeError(f"Empty or invalid FCD XML: {self.fcd_file}")
-
-        CLEAR_ROOT_EVERY = 64
-
-        for event, elem in context:
-            tag = elem.tag.split('}')[-1]
-
-            # -- timestep start
-            if tag == "timestep" and event == "start":
-                cur_time = float(elem.get("time"))
-                step_idx += 1
-                if first_time is None:
-                    first_time = cur_time
-                if prev_time is not None:
-                    dt_step = max(1e-9, cur_time - prev_time)
-                else:
-                    dt_step = 0.1
-                last_time = cur_time
-
-                from collections import defaultdict as _dd
-                lane_occ_g   = _dd(set)
-                lane_pos_g   = _dd(dict)
-                lane_pos_all = _dd(dict)
-                present_hdv_g = set()
-                present_cav_g = set()
-
-            # -- vehicle end
-            elif tag == "vehicle" and event == "end":
-                try:
-                    vid   = elem.get("id")
-                    vtype = (elem.get("type") or "hdv").lower()
-                    lane  = elem.get("lane") or ""
-                    pos   = float(elem.get("pos"))
-                    x     = float(elem.get("x"))
-                    y     = float(elem.get("y", "nan"))
-                    v_raw = float(elem.get("speed"))
-                    a_raw = float(elem.get("acceleration"))
-                    lgap  = float(elem.get("leaderGap", "0"))
-                    ls_raw= float(elem.get("leaderSpeed", "-1"))
-                except Exception:
-                    elem.clear()
-                    continue
-
-                # ---------- RAW: prior to any filtering ----------
-                # Vehicle type registration (raw also needs it, otherwise downstream _all cannot find the type)
-                if vid not in self.vehicle_info:
-                    self.vehicle_info[vid] = {"type": vtype}
-
-                self.positions_all.setdefault(vtype, {}).setdefault(vid, []).append((cur_time, pos))
-                if lane and not lane.startswith(":J"):
-                    lane_pos_all[lane][vid] = pos
-
-                prev_raw = self._prev_lane_raw.get(vid)
-                if prev_raw is None:
-                    self._prev_lane_raw[vid] = lane
-                elif lane != prev_raw:
-                    self.vehicle_lane_history_all[vtype][vid].append((cur_time, prev_raw, lane))
-                    self._prev_lane_raw[vid] = lane
-
-                # ---------- Sample-level lane selector（gated pipeline） ----------
-                if (self.lane_selector is not None) and (self.strict_vehicle_filter == "sample"):
-                    if not self.lane_selector.allow(lane, pos=pos, x=x, y=y):
-                        elem.clear()
-                        continue  # Skip gated statistics, but RAW has already been recorded.
-
-                # gated presence sets
-                (present_hdv_g if vtype == "hdv" else present_cav_g).add(vid)
-
-                # clamp/clean
-                v  = min(max(v_raw, 0.0), V_MAX)
-                a  = min(max(a_raw, ACC_MIN), ACC_MAX)
-                ls = None if ls_raw < 0 else min(max(ls_raw, 0.0), V_MAX)
-                lg = max(0.0, lgap)
-
-                # first/last seen（gated TT)
-                if vid not in self.first_seen[vtype]:
-                    if TT_USE_POS_GATE:
-                        if pos >= POS_MIN_ANALYSIS:
-                            self.first_seen[vtype][vid] = cur_time
-                    else:
-                        self.first_seen[vtype][vid] = cur_time
-                vehicle_last_seen[vtype][vid] = cur_time
-
-                # trajectories (gated)
-                self.positions.setdefault(vtype, {}).setdefault(vid, []).append((cur_time, pos))
-                if STORE_SPEED_TRAJ:
-                    self.speed_traj[vtype][vid].append((cur_time, v))
-                if STORE_XY_TRAJ:
-                    self.xy_traj.setdefault(vtype, {}).setdefault(vid, []).append((cur_time, x, y))
-
-                # unified gates
-                passed_pos_gate = (pos >= POS_MIN_ANALYSIS)
-                passed_safety   = (pos >= POS_MIN_ANALYSIS) if SAFETY_USE_POS_GATE else True
-
-                # distributions & safety (gated)
-                if passed_safety:
-                    self.speeds[vtype].append(v)
-                    self.accelerations[vtype].append(a)
-                    self.space_gaps[vtype].append(lg)
-                    self.time_headways[vtype].append(min(999.0, lg / max(HW_V_EPS, v)))
-                    if (ls is not None) and (v > ls):
-                        ttc = lg / max(HW_V_EPS, (v - ls))
-                        if np.isfinite(ttc) and ttc >= 0:
-                            self.ttc_values[vtype].append(ttc)
-                    if lg > 1.0 and (ls is not None):
-                        rel_v = v - ls
-                        drac = (rel_v * rel_v) / (2.0 * lg)
-                        if np.isfinite(drac):
-                            self.drac_values[vtype].append(drac)
-
-                # lane grid (gated)
-                if lane and not lane.startswith(":J"):
-                    lane_occ_g[lane].add(vid)
-                    lane_pos_g[lane][vid] = pos
-                    # gated lane-change
-                    prev_lane = self.current_lane.get(vid)
-                    if prev_lane is None:
-                        self.current_lane[vid] = lane
-                    elif lane != prev_lane:
-                        self.current_lane[vid] = lane
-                        if passed_safety:
-                            self.vehicle_lane_history[vtype][vid].append((cur_time, prev_lane, lane))
-
-                # fuel/distance (gated， dt_step)
-                gps = max(0.0, self.fuel_rate_g_per_s(v, a, vtype))
-                if (not ENERGY_USE_POS_GATE) or passed_pos_gate:
-                    vehicle_fuel_consumption[vtype][vid] = vehicle_fuel_consumption[vtype].get(vid, 0.0) + gps * dt_step
-                    vehicle_distance[vtype][vid]         = vehicle_distance[vtype].get(vid, 0.0) + v * dt_step
-
-                elem.clear()
-
-            # -- timestep end
-            elif tag == "timestep" and event == "end":
-                # time axis + presence (gated)
-                self.timesteps.append(cur_time)
-                self.num_hdvs_per_timestep.append(len(present_hdv_g or ()))
-                self.num_cavs_per_timestep.append(len(present_cav_g or ()))
-
-                if BUILD_LANE_GRID and (step_idx % LANE_GRID_STRIDE == 0):
-                    # gated snapshots
-                    self.timestep_lane_occupancy[cur_time] = {ln: set(vs) for ln, vs in (lane_occ_g or {}).items()}
-                    self.timestep_lane_positions[cur_time] = {ln: dict(vmap) for ln, vmap in (lane_pos_g or {}).items()}
-                    # RAW snapshots
-                    self.timestep_lane_positions_all[cur_time] = {ln: dict(vmap) for ln, vmap in (lane_pos_all or {}).items()}
-
-                elem.clear()
-                prev_time = cur_time
-
-                if (step_idx % CLEAR_ROOT_EVERY) == 0:
-                    try:
-                        root.clear()
-                    except Exception:
-                        pass
+        self.timestep_lane_positions_all = defaultdict(lambda: defaultdict(dict))  # raw
+        if BUILD_LANE_GRID:
+            on_grid = lane_ok & (fcd.step % LANE_GRID_STRIDE == 0)
+            for tk in t_list[::LANE_GRID_STRIDE]:
+                self.timestep_lane_occupancy[tk] = {}
+                self.timestep_lane_positions[tk] = {}
+                self.timestep_lane_positions_all[tk] = {}
+
+            for grid, idx in ((self.timestep_lane_positions_all, on_grid), (self.timestep_lane_positions, on_grid & gated)):
+                idx = np.flatnonzero(idx)
+                order = idx[np.lexsort((fcd.lane[idx], fcd.step[idx]))]
+                s, l = fcd.step[order], fcd.lane[order]
+                bounds = np.flatnonzero((s[1:] != s[:-1]) | (l[1:] != l[:-1])) + 1
+                starts = np.concatenate(([0], bounds)).tolist() if len(order) else []
+                ends   = np.concatenate((bounds, [len(order)])).tolist() if len(order) else []
+                run_ids = list(map(vids.__getitem__, fcd.veh[order].tolist()))
+                run_pos = list(map(pos_obj.__getitem__, order.tolist()))
+                for i0, i1, sk, lk in zip(starts, ends, s[starts].tolist(), l[starts].tolist()):
+                    grid[t_list[sk]][lanes[lk]] = dict(zip(run_ids[i0:i1], run_pos[i0:i1]))
+                    if grid is self.timestep_lane_positions:
+                        self.timestep_lane_occupancy[t_list[sk]][lanes[lk]] = set(run_ids[i0:i1])
+
+        # first/last seen（gated TT)
+        def _first(idx):
+            """Vehicles of the samples idx and the index of their first sample, in order of first sample"""
+            idx = np.flatnonzero(idx)
+            vehs, i = np.unique(fcd.veh[idx], return_index=True)
+            o = np.argsort(i)
+            return vehs[o], idx[i[o]]
+
+        seen = (gated & passed_pos_gate) if TT_USE_POS_GATE else gated
+        first_veh, first_idx = _first(seen)
+        last_idx = np.full(n_veh, -1)
+        np.maximum.at(last_idx, fcd.veh[gated], np.flatnonzero(gated))
+
+        self.first_seen   = {vt: {} for vt in ("hdv", "cav")}
+        self.travel_times = {vt: {} for vt in ("hdv", "cav")}
+        for vk, t0, t1 in zip(first_veh.tolist(), t[first_idx].tolist(), t[last_idx[first_veh]].tolist()):
+            vt = types[veh_type[vk]]
+            self.first_seen.setdefault(vt, {})[vids[vk]] = t0
+            self.travel_times.setdefault(vt, {})[vids[vk]] = t1 - t0
 
         # ==== Finalize ====
-        self.simulation_duration = 0.0 if first_time is None else (last_time - first_time)
+        self.simulation_duration = float(times[-1] - times[0]) if n_steps else 0.0
         self.num_hdvs = len(self.first_seen["hdv"])
         self.num_cavs = len(self.first_seen["cav"])
 
-        # travel times
-        self.travel_times = {"hdv": {}, "cav": {}}
-        for vt in ("hdv", "cav"):
-            for vid, t0 in self.first_seen[vt].items():
-                t1 = vehicle_last_seen[vt].get(vid)
-                if t1 is not None:
-                    self.travel_times[vt][vid] = t1 - t0
+        # fuel/distance (gated， dt_step)
+        dt_step = np.full(n_steps, 0.1)
+        dt_step[1:] = np.maximum(1e-9, np.diff(times))
+        dt = dt_step[fcd.step]
+
+        burns = gated & (passed_pos_gate if ENERGY_USE_POS_GATE else True)
+        gps = np.maximum(0.0, self.fuel_rate_g_per_s(v, a))
+        fuel_g = np.bincount(fcd.veh[burns], weights=(gps * dt)[burns], minlength=n_veh)
+        dist_m = np.bincount(fcd.veh[burns], weights=(v * dt)[burns], minlength=n_veh)
+        burn_veh, _ = _first(burns)
+
+        vehicle_fuel_consumption = {"hdv": {}, "cav": {}}
+        vehicle_distance         = {"hdv": {}, "cav": {}}
+        for vk, f, d in zip(burn_veh.tolist(), fuel_g[burn_veh].tolist(), dist_m[burn_veh].tolist()):
+            vt = types[veh_type[vk]]
+            vehicle_fuel_consumption.setdefault(vt, {})[vids[vk]] = f
+            vehicle_distance.setdefault(vt, {})[vids[vk]] = d
 
         # fuel stats
         GRAMS_PER_GALLON = 2791.0
@@ -1357,11 +1661,21 @@ class TrafficMetrics:
 
     def compute_pet(self, distance_threshold=60.0):
         """
-        Compute PET (Post-Encroachment Time).
-        Uses RAW(_all) grids/trajectories when available; falls back to gated.
+        Compute PET (Post-Encroachment Time) of every RAW lane change.
+
+        For a vehicle A changing into a lane at t0, the candidates B are the vehicles on that lane at t0
+        in the RAW lane grid. PET is the time B takes to reach A's position at t0, the smallest over the
+        B within `distance_threshold`. All lane changes are evaluated in one vectorized pass on the FCD
+        columns (self.fcd):
+          - trajectories are the per-vehicle runs of time-ordered samples (FcdColumns.group_by_vehicle),
+            and positions at t0 are found by binary search on the run's timesteps
+          - candidates come from a (timestep, lane, pos) sorted index of the samples at lane-change
+            timesteps, so each lane change reads only its own cell
+          - crossing times use the binary search of _find_crossing_time, run for all pairs at once
+        Apart from the one-off vehicle grouping, the cost scales with the lane changes and their
+        candidates rather than with the length of the run.
         """
-        import bisect
-        times = list(getattr(self, "timesteps", []))
+        times = np.asarray(getattr(self, "timesteps", []), dtype=float)
         if len(times) < 2:
             self.pet_list = {"hdv": [], "cav": []}
             return
@@ -1373,101 +1687,148 @@ class TrafficMetrics:
         t_win    = float(getattr(self, "PET_T_WINDOW", 15.0))
         dist_th  = float(distance_threshold)
 
-        # helpers
-        def nearest_idx(t):
-            j = bisect.bisect_left(times, t)
-            cands = []
-            if 0 <= j < len(times):   cands.append((abs(times[j]  - t), j))
-            if j-1 >= 0:              cands.append((abs(times[j-1]- t), j-1))
-            if j+1 < len(times):      cands.append((abs(times[j+1]- t), j+1))
-            cands.sort(key=lambda z: z[0])
-            if not cands or cands[0][0] > dt_tol:
-                return None
-            return cands[0][1]
+        fcd = getattr(self, "fcd", None)
+        if fcd is None:
+            fcd = load_fcd_columns(self.fcd_file)
+        veh_index  = {vid: i for i, vid in enumerate(fcd.veh_ids)}
+        lane_index = {ln: i for i, ln in enumerate(fcd.lane_ids)}
+        n_steps = len(times)
 
-        pos_all_grid = getattr(self, "timestep_lane_positions_all", None)
-        pos_grid_g   = getattr(self, "timestep_lane_positions", {})
-        occ_grid_g   = getattr(self, "timestep_lane_occupancy", {})
-
-        def a_traj(vt, vid):
-            # prefer RAW, fallback gated
-            pa = (getattr(self, "positions_all", {}).get(vt, {}) or {}).get(vid, [])
-            if pa: return pa
-            return (getattr(self, "positions", {}).get(vt, {}) or {}).get(vid, [])
-
-        self.pet_list = {"hdv": [], "cav": []}
-        for vt in ("hdv", "cav"):
+        def nearest_idx(t):
+            """Index of the timestep nearest to each t (ties to the later one), -1 beyond dt_tol"""
+            j = np.searchsorted(times, t, side="left")
+            best = np.full(len(t), -1)
+            best_d = np.full(len(t), np.inf)
+            for k in (j, j - 1, j + 1):
+                ok = (k >= 0) & (k < n_steps)
+                d = np.where(ok, np.abs(times[np.clip(k, 0, n_steps - 1)] - t), np.inf)
+                better = d < best_d
+                best, best_d = np.where(better, k, best), np.where(better, d, best_d)
+            return np.where(best_d <= dt_tol, best, -1)
+
+        # ---- RAW lane changes, in the order of vehicle_lane_history_all ----
+        ch_type, ch_veh, ch_t, ch_lane = [], [], [], []
+        for k, vt in enumerate(("hdv", "cav")):
             src_changes = (getattr(self, "vehicle_lane_history_all", {}) or {}).get(vt, {})
             for vid, changes in (src_changes or {}).items():
                 for (t0, old_lane, new_lane) in changes:
-                    if not new_lane or new_lane.startswith(":J"):
-                        continue
-
-                    # 1) target set, prefer RAW grid (exact), else RAW nearest neighbor, then fallback gated
-                    candidates = set()
-                    if pos_all_grid and t0 in pos_all_grid:
-                        candidates = set(pos_all_grid[t0].get(new_lane, {}).keys())
-                    if not candidates:
-                        k = nearest_idx(t0)
-                        if (pos_all_grid is not None) and (k is not None):
-                            tN = times[k]
-                            candidates = set(pos_all_grid.get(tN, {}).get(new_lane, {}).keys())
-                    if not candidates:
-                        # fall back to gated occupancy / positions
-                        occ = occ_grid_g.get(t0, {})
-                        candidates = set(occ.get(new_lane, set()))
-                        if not candidates:
-                            k = nearest_idx(t0)
-                            if k is not None:
-                                tN = times[k]
-                                candidates = set(pos_grid_g.get(tN, {}).get(new_lane, {}).keys())
-                    candidates -= {vid}
-                    if not candidates:
-                        continue
-
-                    # 2) Get A's position (prefer RAW)
-                    a_pos = None
-                    ATR = a_traj(vt, vid)
-                    for (tt, pp) in ATR:
-                        if abs(tt - t0) <= dt_tol:
-                            a_pos = pp; break
-                    if a_pos is None and ATR:
-                        # Nearest neighbor interpolation
-                        i = nearest_idx(t0)
-                        if i is not None:
-                            # Simple nearest neighbor (more detailed linear interpolation can be done)
-                            for (tt, pp) in ATR:
-                                if abs(tt - times[i]) <= dt_tol:
-                                    a_pos = pp; break
-                    if a_pos is None:
+                    if not new_lane or new_lane.startswith(":J") or vid not in veh_index:
                         continue
+                    ch_type.append(k)
+                    ch_veh.append(veh_index[vid])
+                    ch_t.append(t0)
+                    ch_lane.append(lane_index.get(new_lane, -1))
+
+        ch_type = np.array(ch_type, dtype=np.int64)
+        ch_veh  = np.array(ch_veh, dtype=np.int64)
+        ch_t    = np.array(ch_t, dtype=float)
+        ch_lane = np.array(ch_lane, dtype=np.int64)
+        n_ch    = len(ch_t)
+
+        # ---- Trajectories: per-vehicle runs of samples in time order, order[veh_start[v]:veh_end[v]] ----
+        order, vehs, starts, ends = fcd.group_by_vehicle()
+        veh_start = np.zeros(len(fcd.veh_ids), dtype=np.int64)
+        veh_end   = np.zeros(len(fcd.veh_ids), dtype=np.int64)
+        veh_start[vehs], veh_end[vehs] = starts, ends
+        last = max(len(order) - 1, 0)
+
+        def traj_step(i): return fcd.step[order[np.clip(i, 0, last)]]
+        def traj_pos(i):  return fcd.pos[order[np.clip(i, 0, last)]]
+
+        def bisect_runs(start, n, key, x):
+            """
+            Binary search of each x in its run key(start .. start+n-1), with the loop of _find_crossing_time.
+            Returns the offset of the first key >= x when the run is sorted.
+            """
+            low, high = np.zeros(len(n), dtype=np.int64), n - 1
+            active = low <= high
+            while active.any():
+                mid = (low + high) // 2
+                below = key(start + mid) < x
+                low  = np.where(active & below, mid + 1, low)
+                high = np.where(active & ~below, mid - 1, high)
+                active = low <= high
+            return low
+
+        def first_within(veh, t):
+            """Index into order of each vehicle's first sample within dt_tol of t, -1 if none"""
+            start, end = veh_start[veh], veh_end[veh]
+            s_lo = np.searchsorted(times, t - dt_tol - 1e-6, side="left")
+            i0 = start + bisect_runs(start, end - start, traj_step, s_lo)
+            out = np.full(len(t), -1)
+            for i in (i0 + 1, i0):
+                ok = (i < end) & (np.abs(times[np.clip(traj_step(i), 0, n_steps - 1)] - t) <= dt_tol)
+                out = np.where(ok, i, out)
+            return out
 
-                    best_pet = None
-                    for b_id in candidates:
-                        btype = (self.vehicle_info.get(b_id, {}) or {}).get("type")
-                        if not btype:
-                            continue
-                        BTR = a_traj(btype, b_id)
-                        if not BTR:
-                            continue
-                        # proximity
-                        b_pos = None
-                        for (tt, pp) in BTR:
-                            if abs(tt - t0) <= dt_tol:
-                                b_pos = pp; break
-                        if b_pos is None or abs(b_pos - a_pos) > dist_th:
-                            continue
-                        ct = self._find_crossing_time(a_pos, BTR)
-                        if ct is None or ct < t0 - 1e-9:
-                            continue
-                        pet = ct - t0
-                        if (pet < eps_pet) or (pet > t_win):
-                            continue
-                        if (best_pet is None) or (pet < best_pet):
-                            best_pet = pet
+        # ---- A's position at t0, else at the nearest timestep ----
+        k0 = nearest_idx(ch_t)
+        a_i = first_within(ch_veh, ch_t)
+        retry = (a_i < 0) & (k0 >= 0)
+        a_i[retry] = first_within(ch_veh[retry], times[k0[retry]])
+
+        # ---- Candidates: cells of the RAW lane grid at t0, else at the nearest timestep ----
+        pos_all_grid = getattr(self, "timestep_lane_positions_all", None) or {}
+        t_list = times.tolist()
+        in_grid = np.array([t0 in pos_all_grid for t0 in ch_t.tolist()], dtype=bool)
+        ch_step = np.where(in_grid, np.searchsorted(times, ch_t), k0)
+        has_cell = (ch_step >= 0) & (ch_lane >= 0) & (a_i >= 0)
+        has_cell[has_cell] = [t_list[s] in pos_all_grid for s in ch_step[has_cell].tolist()]
+
+        # Samples of the lane-change timesteps (contiguous in the file), sorted by (timestep, lane, pos)
+        cell_steps = np.unique(ch_step[has_cell])
+        s0 = np.searchsorted(fcd.step, cell_steps, side="left")
+        s1 = np.searchsorted(fcd.step, cell_steps, side="right")
+        n_at = s1 - s0
+        at_change = np.repeat(s0 - (np.cumsum(n_at) - n_at), n_at) + np.arange(n_at.sum())
+        cell_idx = at_change[np.lexsort((fcd.pos[at_change], fcd.lane[at_change], fcd.step[at_change]))]
+        n_lanes = len(fcd.lane_ids)
+        cell_key = fcd.step[cell_idx].astype(np.int64) * n_lanes + fcd.lane[cell_idx]
+
+        query = np.where(has_cell, ch_step * n_lanes + ch_lane, -1)
+        lo = np.searchsorted(cell_key, query, side="left")
+        hi = np.where(has_cell, np.searchsorted(cell_key, query, side="right"), lo)
+
+        # (lane change, candidate) pairs
+        n_cand = hi - lo
+        pair_ch = np.repeat(np.arange(n_ch), n_cand)
+        pair_off = np.arange(len(pair_ch)) - np.repeat(np.cumsum(n_cand) - n_cand, n_cand)
+        b_veh = fcd.veh[cell_idx[lo[pair_ch] + pair_off]].astype(np.int64)
+        keep = (b_veh != ch_veh[pair_ch])
+        pair_ch, b_veh = pair_ch[keep], b_veh[keep]
+
+        # proximity of B to A's position at t0
+        a_pos = traj_pos(a_i[pair_ch])
+        b_i = first_within(b_veh, ch_t[pair_ch])
+        keep = (b_i >= 0) & (np.abs(traj_pos(b_i) - a_pos) <= dist_th)
+        pair_ch, b_veh, a_pos = pair_ch[keep], b_veh[keep], a_pos[keep]
+
+        # ---- Crossing time of A's position on B's trajectory (as _find_crossing_time) ----
+        start = veh_start[b_veh]
+        n = veh_end[b_veh] - start
+        low = bisect_runs(start, n, traj_pos, a_pos)
+
+        keep = (low > 0) & (low < n)
+        i = start + low - 1
+        p1, p2 = traj_pos(i), traj_pos(i + 1)
+        t1, t2 = times[traj_step(i)], times[traj_step(i + 1)]
+        delta_p = p2 - p1
+        keep &= (p1 <= a_pos) & (a_pos <= p2) & (delta_p != 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ct = t1 + (a_pos - p1) * (t2 - t1) / delta_p
+        t0 = ch_t[pair_ch]
+        keep &= (ct >= t0 - 1e-9)
+        pet = ct - t0
+        keep &= (pet >= eps_pet) & (pet <= t_win)
+
+        # smallest PET per lane change
+        best_pet = np.full(n_ch, np.inf)
+        np.minimum.at(best_pet, pair_ch[keep], pet[keep])
+        found = np.isfinite(best_pet)
+
+        self.pet_list = {vt: best_pet[found & (ch_type == k)].tolist() for k, vt in enumerate(("hdv", "cav"))}
 
-                    if best_pet is not None:
-                        self.pet_list[vt].append(best_pet)
         # —— Data sanitization ——     
         if getattr(self, "is_sanitizing", True):
             for v_type in ("hdv", "cav"):
@@ -1605,9 +1966,9 @@ class TrafficMetrics:
 
         Inputs
         ------
-        speed_mps : float
-            Vehicle speed [m/s]
-        accel_mps2 : float
+        speed_mps : float or np.ndarray
+            Vehicle speed [m/s]. Arrays are evaluated elementwise and return an array.
+        accel_mps2 : float or np.ndarray
             Longitudinal acceleration [m/s^2]
         veh_type : str
             Vehicle type key (e.g., "hdv"/"cav"). Currently uses a unified parameter set.
@@ -1634,8 +1995,8 @@ class TrafficMetrics:
         # Engine BSFC (g/kWh), typical 240–280
         BSFC = 260.0
 
-        v = max(0.0, float(speed_mps))
-        a = float(accel_mps2)
+        v = np.maximum(0.0, np.asarray(speed_mps, dtype=float))
+        a = np.asarray(accel_mps2, dtype=float)
 
         # Traction power (W): inertia + rolling + aero; negative traction doesn't increase fuel
         P_inertia = mass * a * v
@@ -1644,18 +2005,17 @@ class TrafficMetrics:
         P_trac    = P_inertia + P_roll + P_drag
 
         # Positive mechanical demand + auxiliaries
-        P_mech = max(0.0, P_trac) + P_aux
-
-        # Very low speed / load -> revert to idle fuel
-        if v < V_EPS and abs(a) < 0.1:
-            return IDLE_GPS
+        P_mech = np.maximum(0.0, P_trac) + P_aux
 
         # Power -> fuel (g/s): (kW) * (g/kWh) / 3600
         gps = (P_mech / 1000.0) * (BSFC / 3600.0)
 
         # Enforce idle floor and non‑negativity
-        gps = max(IDLE_GPS, gps)
-        return float(gps)
+        gps = np.maximum(IDLE_GPS, gps)
+
+        # Very low speed / load -> revert to idle fuel
+        gps = np.where((v < V_EPS) & (np.abs(a) < 0.1), IDLE_GPS, gps)
+        return float(gps) if gps.ndim == 0 else gps
 
     def _try_convert(self, value):
         """Try int/float conversion; otherwise return original string."""
@@ -2970,6 +3330,32 @@ class TrafficMetrics:
         print("PET   :", {k:len(v) for k,v in self.pet_list.items()})
         print("travel_times veh:", {k:len(v) for k,v in self.travel_times.items()})
 
+class CachedMetrics(TrafficMetrics):
+    """
+    TrafficMetrics restored from a metrics cache (see load_or_build_metrics).
+
+    Nothing is decoded up front: each attribute is read from its family's .npz file on first access
+    and then kept on the object. The FCD columns (self.fcd) are not cached.
+    """
+    def __init__(self, cache_dir, index, lane_selector=None):
+        self._cache_dir = cache_dir
+        self._cache_attrs = {attr: (family, codec)
+                             for family, entry in index["families"].items()
+                             for attr, codec in entry["attrs"].items()}
+        self.lane_selector = lane_selector
+
+    def __getattr__(self, name):
+        # Only called for attributes not decoded yet
+        cache_attrs = self.__dict__.get("_cache_attrs", {})
+        if name not in cache_attrs:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        family, codec = cache_attrs[name]
+        value = _read_metric(self._cache_dir, family, name, codec)
+        setattr(self, name, value)
+        return value
+
+
 # ## ---------------------------------------------------------- ##
 
 # def main():
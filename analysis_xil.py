@@ -17,6 +17,7 @@ import matplotlib.cm as cm
 import matplotlib.colors as colors
 
 import scripts.utils_vis as vis
+from scripts.utils_fcd import load_fcd_columns
 from src.settings import *
 from analysis import TrafficMetrics
 
@@ -65,62 +66,36 @@ class TrafficVisualizationXIL:
         return split_ids[-1]
     
     def process_fcd(self, fcd_file, lanes, direction):
-        # Parse the FCD XML file
-        tree = ET.parse(fcd_file)
-        root = tree.getroot()
-        
-        # Extract vehicle data
-        data = []
-
-        y_min, y_max, x_min, x_max, v_min, v_max = inf, -inf, inf, -inf, inf, -inf
-        ego_lanes = {}
-
-        for timestep in root.findall('timestep'):
-            # Simulation data
-            time = float(timestep.get('time'))
+        # Load the FCD columns, from the sidecar next to the XML when it is up to date
+        fcd = load_fcd_columns(fcd_file)
+        df = fcd.to_frame()
 
-            for vehicle in timestep.findall('vehicle'):
-                vehicle_id = vehicle.get('id')
-                
-                x = float(vehicle.get('x'))
-                y = float(vehicle.get('y'))
-                angle = float(vehicle.get('angle'))
-                type = vehicle.get('type')
-                speed = float(vehicle.get('speed'))
-                pos = float(vehicle.get('pos'))
-                lane_id = self.get_lane( vehicle.get('lane') )
-                acceleration = float(vehicle.get('acceleration'))
-                
-                leader_id = vehicle.get('leaderID')
-                leader_speed = vehicle.get('leaderSpeed')
-                leader_gap = vehicle.get('leaderGap')
-                if leader_id != '' and float(leader_gap) <= 100.:
-                    leader_speed = float(leader_speed)
-                    leader_gap = float(leader_gap)
-                else:
-                    leader_id = nan
-                    leader_speed = nan
-                    leader_gap = nan
-                
-                # Iterate    
-                y_min = min(y_min, y)
-                y_max = max(y_max, y)
-                x_min = min(x_min, x)
-                x_max = max(x_max, x)
-                v_min = min(v_min, speed)
-                v_max = max(v_max, speed)
+        # Lane of each sample, mapped once per lane id
+        lane_ids = np.array([self.get_lane(lane if lane else None) for lane in fcd.lane_ids] + [None], dtype=object)
+        df['lane_id'] = lane_ids[fcd.lane]
+        df['acceleration'] = df['accel']
 
-                # Check the ego lane
-                if type in self.ego_types:
-                    if vehicle_id not in ego_lanes:
-                        ego_lanes[vehicle_id] = []
+        # Leaders further than 100 m are not followed
+        has_leader = (fcd.leader >= 0) & (fcd.leader_gap <= 100.)
+        df['leader_id'] = df['leader_id'].where(has_leader, nan)
+        df['leader_speed'] = np.where(has_leader, fcd.leader_speed, nan)
+        df['leader_gap'] = np.where(has_leader, fcd.leader_gap, nan)
 
-                    ego_lanes[vehicle_id].append(lane_id)
+        y_min, y_max, x_min, x_max, v_min, v_max = inf, -inf, inf, -inf, inf, -inf
+        if len(fcd):
+            y_min, y_max = float(np.min(fcd.y)), float(np.max(fcd.y))
+            x_min, x_max = float(np.min(fcd.x)), float(np.max(fcd.x))
+            v_min, v_max = float(np.min(fcd.speed)), float(np.max(fcd.speed))
 
-                data.append([time, vehicle_id, x, y, angle, type, speed, pos, lane_id, acceleration, leader_id, leader_speed, leader_gap])
+        # Check the ego lanes
+        ego_lanes = {}
+        is_ego = np.array([type in self.ego_types for type in fcd.type_ids], dtype=bool)[fcd.sample_type]
+        order, vehs, starts, ends = fcd.group_by_vehicle(np.flatnonzero(is_ego))
+        ego_lane_ids = df['lane_id'].values[order]
+        for veh, i0, i1 in zip(vehs, starts, ends):
+            ego_lanes[fcd.veh_ids[veh]] = list(ego_lane_ids[i0:i1])
 
-        # Create a DataFrame
-        df = pd.DataFrame(data, columns=['time', 'vehicle_id', 'x', 'y', 'angle', 'type', 'speed', 'pos', 'lane_id', 'acceleration', 'leader_id', 'leader_speed', 'leader_gap'])
+        df = df[['time', 'vehicle_id', 'x', 'y', 'angle', 'type', 'speed', 'pos', 'lane_id', 'acceleration', 'leader_id', 'leader_speed', 'leader_gap']]
         
         # Filter data for specific lanes if provided
         if lanes is not None:
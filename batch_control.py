@@ -0,0 +1,132 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Batched evaluation of the CAV controller over all CAVs of a simulation step.
+
+Controllers may implement the batched API, called with the stacked states of many ego vehicles:
+
+    getCommands(sim_time, ego_ids, ego_states, leader_states, leader_trajs)
+        -> (accelerations, time_trajs, pos_trajs, vel_trajs, acc_trajs)
+
+where ego_states is an [N, 5] array of the EGO_STATES columns, leader_states an [N, 3] array of the
+LEADER_STATES columns and leader_trajs a list of the N (times, positions, velocities) V2V trajectories
+of the leaders. accelerations is an [N] array and the planned trajectories are lists of N entries.
+Controllers with only the scalar getCommand API are evaluated per vehicle by ScalarCommands.
+
+CAVs are evaluated in dependency levels: a CAV that follows another CAV is evaluated after its leader,
+so it reads the trajectory its leader broadcast in the same step, independently of the order of the
+CAVs. CAVs whose leaders are not controlled in the step form level 0.
+'''
+
+import numpy as np
+
+# Columns of the ego_states and leader_states arrays
+EGO_STATES = ('accel', 'speed', 'distance', 's_max', 'v_max')
+LEADER_STATES = ('accel', 'speed', 'rel_distance')
+
+class ScalarCommands:
+    '''Batched getCommands of a controller that only implements the scalar getCommand API'''
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def getCommands(self, sim_time, ego_ids, ego_states, leader_states, leader_trajs):
+        n = len(ego_ids)
+        accelerations = np.empty(n)
+        time_trajs, pos_trajs, vel_trajs, acc_trajs = [None]*n, [None]*n, [None]*n, [None]*n
+
+        for i, (ego, leader, traj) in enumerate(zip(ego_states.tolist(), leader_states.tolist(), leader_trajs)):
+            accelerations[i], time_trajs[i], pos_trajs[i], vel_trajs[i], acc_trajs[i] = self.controller.getCommand(
+                sim_time, *ego, *leader, *traj
+            )
+
+        return accelerations, time_trajs, pos_trajs, vel_trajs, acc_trajs
+
+def batched(controller):
+    '''Return the controller if it implements getCommands, otherwise its per-vehicle adapter'''
+    return controller if hasattr(controller, 'getCommands') else ScalarCommands(controller)
+
+def dependency_levels(ego_ids, lead_ids):
+    '''
+    Return the [N] evaluation level of each ego: 0 when its leader is not one of the egos, otherwise
+    one more than the level of its leader. A cycle of egos following each other, e.g. on a ring road,
+    is cut at the ego where it is found.
+    '''
+    index = {ego_id: i for i, ego_id in enumerate(ego_ids)}
+    levels = np.full(len(ego_ids), -1, dtype=np.int64)
+
+    for i in range(len(ego_ids)):
+        # Walk up the chain of unresolved leaders, then resolve it from the top down
+        chain = []
+        on_chain = set()
+        j = i
+        while j is not None and levels[j] < 0 and j not in on_chain:
+            chain.append(j)
+            on_chain.add(j)
+            j = index.get(lead_ids[j])
+
+        level = levels[j] if j is not None and levels[j] >= 0 else -1
+        for j in reversed(chain):
+            level += 1
+            levels[j] = level
+
+    return levels
+
+def evaluate_commands(controller, sim_time, ego_ids, lead_ids, ego_states, leader_states, comms, timer=None):
+    '''
+    Evaluate a controller for all egos with one getCommands call per dependency level. Each level reads
+    the V2V trajectories of its leaders from comms, including those broadcast by lower levels in this
+    step, and broadcasts the planned trajectories of its egos.
+
+    Parameters
+    ----------
+    controller : object
+        Controller with the batched getCommands or the scalar getCommand API.
+    ego_ids, lead_ids : list[str]
+        Ego vehicle IDs and the IDs of their leaders ("-1" when none).
+    ego_states, leader_states : np.ndarray
+        [N, 5] EGO_STATES and [N, 3] LEADER_STATES in ego_ids order.
+    comms : comms_buffer.RingCommunications
+        V2V store read for the leader trajectories and updated with the ego plans.
+    timer : step_timing.StepTimer, optional
+        Timer lapped for the comms_update and controller phases.
+
+    Returns
+    -------
+    accelerations : np.ndarray
+        Acceleration commands [m/s^2] in ego_ids order.
+    time_trajs, pos_trajs, vel_trajs, acc_trajs : list
+        Planned trajectories in ego_ids order.
+    '''
+    controller = batched(controller)
+
+    n = len(ego_ids)
+    accelerations = np.zeros(n)
+    time_trajs, pos_trajs, vel_trajs, acc_trajs = [None]*n, [None]*n, [None]*n, [None]*n
+
+    levels = dependency_levels(ego_ids, lead_ids)
+    for level in range(int(levels.max()) + 1 if n else 0):
+        idx = np.flatnonzero(levels == level)
+
+        leader_trajs = [comms.get_veh_comms(lead_ids[i], sim_time, distance_from_sv=leader_states[i, 2]) for i in idx]
+        if timer is not None:
+            timer.lap('comms_update')
+
+        accels, times, positions, velocities, accel_trajs = controller.getCommands(
+            sim_time, [ego_ids[i] for i in idx], ego_states[idx], leader_states[idx], leader_trajs
+        )
+        if timer is not None:
+            timer.lap('controller')
+
+        accelerations[idx] = accels
+        for j, i in enumerate(idx.tolist()):
+            time_trajs[i], pos_trajs[i], vel_trajs[i], acc_trajs[i] = times[j], positions[j], velocities[j], accel_trajs[j]
+            comms.update_veh_comms(ego_ids[i], times[j], positions[j], velocities[j], sim_time=sim_time)
+        if timer is not None:
+            timer.lap('comms_update')
+
+    return accelerations, time_trajs, pos_trajs, vel_trajs, acc_trajs
@@ -0,0 +1,208 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+V2V communications store on fixed-capacity ring buffers.
+
+Each vehicle that broadcasts gets a slot holding its last `history` messages in preallocated NumPy
+arrays, so storing a message and looking up the latest one are O(1) and do not allocate. Slots are
+released when vehicles leave the network (`remove_veh`) and reused by the next vehicles, so memory
+depends on the number of vehicles in the network at once rather than on the length of the run.
+
+An optional channel model delays each message by `latency` plus a uniform `jitter` and drops it with
+probability `loss`. Receivers then see the newest message that has been delivered. The history must
+hold every message sent during the longest delay, see `min_history`, or in-flight messages are
+overwritten before they are delivered.
+'''
+
+import math
+import numpy as np
+
+def min_history(latency, jitter, step_length):
+    '''Messages per vehicle needed to keep the newest delivered message when one is sent every step_length [s]'''
+    return math.ceil((latency + jitter) / step_length - 1e-9) + 1
+
+class RingCommunications:
+    '''
+    V2V broadcast store of planned trajectories, with the update_veh_comms/get_veh_comms interface
+    used by the simulation.
+
+    Parameters
+    ----------
+    capacity : int
+        Initial number of vehicle slots. Doubled when more vehicles broadcast at once.
+    history : int
+        Messages kept per vehicle, for messages still in flight under latency. See `min_history`.
+    traj_len : int
+        Initial trajectory length. Grown to fit longer trajectories.
+    latency, jitter : float
+        [s] Fixed delivery delay and the width of the uniform delay added on top of it.
+    loss : float
+        Probability that a message is dropped.
+    seed : int, optional
+        Random seed of the channel model.
+    '''
+
+    def __init__(self, capacity=256, history=4, traj_len=64, latency=0., jitter=0., loss=0., seed=None):
+        assert history >= 1, 'Need a history of at least 1 message.'
+        assert 0. <= loss < 1., 'Loss must be a probability in [0, 1).'
+
+        self.history = history
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = np.random.default_rng(seed)
+
+        self.slots = {}  # {veh_id: slot}
+        self.free = []  # Released slots, reused first
+        self.capacity = 0
+        self.traj_len = 0
+        self.allocate(capacity, traj_len)
+
+        self.sim_time = 0.  # [s] Send time of messages updated without a time
+        self.n_sent = 0
+        self.n_lost = 0
+
+    def allocate(self, capacity, traj_len):
+        '''(Re)allocate the buffers for capacity slots of traj_len samples, keeping the stored messages'''
+        shape = (capacity, self.history)
+
+        t = np.zeros(shape + (traj_len,))
+        s = np.zeros(shape + (traj_len,))
+        v = np.zeros(shape + (traj_len,))
+        n = np.zeros(shape, dtype=np.int32)  # Trajectory lengths
+        n_vel = np.zeros(shape, dtype=np.int32)  # Velocity trajectory lengths, 0 when not sent
+        delivered = np.full(shape, np.inf)  # [s] Delivery times
+        head = np.zeros(capacity, dtype=np.int32)  # Index of the newest message
+        count = np.zeros(capacity, dtype=np.int32)  # Stored messages
+
+        if self.capacity:
+            c, l = self.capacity, self.traj_len
+            t[:c, :, :l] = self.t
+            s[:c, :, :l] = self.s
+            v[:c, :, :l] = self.v
+            n[:c] = self.n
+            n_vel[:c] = self.n_vel
+            delivered[:c] = self.delivered
+            head[:c] = self.head
+            count[:c] = self.count
+
+        self.t, self.s, self.v = t, s, v
+        self.n, self.n_vel, self.delivered = n, n_vel, delivered
+        self.head, self.count = head, count
+
+        # New slots are handed out lowest first
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+        self.traj_len = traj_len
+
+    def set_history(self, history):
+        '''Grow the messages kept per vehicle to history, keeping the stored messages'''
+        if history <= self.history:
+            return
+
+        # Unroll each ring so its newest message is last, then continue the rings in the larger buffers
+        order = (self.head[:, None] + 1 + np.arange(self.history)) % self.history
+        shape = (self.capacity, history)
+
+        t = np.zeros(shape + (self.traj_len,))
+        s = np.zeros(shape + (self.traj_len,))
+        v = np.zeros(shape + (self.traj_len,))
+        n = np.zeros(shape, dtype=np.int32)
+        n_vel = np.zeros(shape, dtype=np.int32)
+        delivered = np.full(shape, np.inf)
+
+        h = self.history
+        t[:, :h] = np.take_along_axis(self.t, order[:, :, None], axis=1)
+        s[:, :h] = np.take_along_axis(self.s, order[:, :, None], axis=1)
+        v[:, :h] = np.take_along_axis(self.v, order[:, :, None], axis=1)
+        n[:, :h] = np.take_along_axis(self.n, order, axis=1)
+        n_vel[:, :h] = np.take_along_axis(self.n_vel, order, axis=1)
+        delivered[:, :h] = np.take_along_axis(self.delivered, order, axis=1)
+
+        self.t, self.s, self.v = t, s, v
+        self.n, self.n_vel, self.delivered = n, n_vel, delivered
+        self.head[:] = h - 1
+        self.history = history
+
+    def get_slot(self, veh_id):
+        slot = self.slots.get(veh_id)
+        if slot is None:
+            if not self.free:
+                self.allocate(2*self.capacity, self.traj_len)
+
+            slot = self.slots[veh_id] = self.free.pop()
+            self.count[slot] = 0
+
+        return slot
+
+    def update_veh_comms(self, veh_id, time_traj, pos_traj, vel_traj=None, sim_time=None):
+        '''Broadcast the planned trajectory of a vehicle, sent at sim_time [s]'''
+        if sim_time is not None:
+            self.sim_time = sim_time
+
+        self.n_sent += 1
+        if self.loss > 0. and self.rng.random() < self.loss:
+            self.n_lost += 1
+            return
+
+        n = len(time_traj)
+        n_vel = len(vel_traj) if vel_traj is not None else 0
+        if max(n, n_vel) > self.traj_len:
+            self.allocate(self.capacity, max(n, n_vel, 2*self.traj_len))
+
+        slot = self.get_slot(veh_id)
+        i = (self.head[slot] + 1) % self.history
+
+        self.t[slot, i, :n] = time_traj
+        self.s[slot, i, :n] = pos_traj
+        if n_vel:
+            self.v[slot, i, :n_vel] = vel_traj
+        self.n[slot, i] = n
+        self.n_vel[slot, i] = n_vel
+
+        delay = self.latency
+        if self.jitter > 0.:
+            delay += self.jitter*self.rng.random()
+        self.delivered[slot, i] = self.sim_time + delay
+
+        self.head[slot] = i
+        self.count[slot] = min(self.count[slot] + 1, self.history)
+
+    def get_veh_comms(self, veh_id, sim_time, distance_from_sv=0.):
+        '''
+        Return the (times, positions, velocities) lists of the newest trajectory of a vehicle delivered
+        by sim_time [s], with positions shifted by the distance [m] from the subject vehicle. Lists are
+        empty when nothing was delivered.
+        '''
+        slot = self.slots.get(veh_id)
+        if slot is None:
+            return [], [], []
+
+        i = self.head[slot]
+        for _ in range(self.count[slot]):
+            if self.delivered[slot, i] <= sim_time:
+                n, n_vel = self.n[slot, i], self.n_vel[slot, i]
+                return self.t[slot, i, :n].tolist(), (self.s[slot, i, :n] + distance_from_sv).tolist(), self.v[slot, i, :n_vel].tolist()
+
+            i = (i - 1) % self.history
+
+        return [], [], []
+
+    def remove_veh(self, veh_id):
+        '''Release the slot of a vehicle that left the network'''
+        slot = self.slots.pop(veh_id, None)
+        if slot is not None:
+            self.count[slot] = 0
+            self.free.append(slot)
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def nbytes(self):
+        '''Memory of the message buffers [bytes]'''
+        return sum(a.nbytes for a in (self.t, self.s, self.v, self.n, self.n_vel, self.delivered, self.head, self.count))
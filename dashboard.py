@@ -1680,7 +1680,7 @@ if __name__ == '__main__':
     parser.add_argument('--urban', choices=['auto', 'yes', 'no'], default='auto',
                         help="Show Urban Signals tab: 'auto' (default, show when detector+TLS present), 'yes' (force show), 'no' (hide)")
     parser.add_argument('--p', '--penetration-tag', dest='p_tag', default="0",
-                        help="Penetration tag for output filenames, e.g. 0.1 or p0.1. If provided, dashboard will look for fcd_<tag>.xml and stats_<tag>.xml and will use metrics_<tag>.pkl cache. Default: 0 -> p0")
+                        help="Penetration tag for output filenames, e.g. 0.1 or p0.1. If provided, dashboard will look for fcd_<tag>.xml and stats_<tag>.xml and will use the metrics_<tag>.cache directory. Default: 0 -> p0")
 
     # ---- (optional) CLI lane-filtering rules ----
     parser.add_argument('--exclude-lane', action='append', default=[],
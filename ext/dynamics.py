@@ -51,6 +51,123 @@ def step_dyn(dt, t, x, y, v, a, heading, ua, usteer=0.):
 
     return t, x, y, v, a, heading
 
+class BatchWork:
+    '''Preallocated work buffers of step_dyn_batch for N vehicles, in a state-major [5, N] layout so each state is contiguous'''
+    BUFFERS = ('x', 'xs', 'k', 'ua', 'beta', 'sin_beta_lr', 'tmp')
+
+    def __init__(self, n):
+        self.n = n
+        self.x = np.empty((5, n)) # States at the start of the step
+        self.xs = np.empty((5, n)) # States of the current stage, then the result
+        self.k = np.empty((4, 5, n)) # Stage increments
+        self.ua = np.empty(n) # Acceleration requests
+        self.beta = np.empty(n) # Slip angles
+        self.sin_beta_lr = np.empty(n) # sin(beta)/Lr
+        self.tmp = np.empty(n)
+        self.last_view = None
+
+    def view(self, n):
+        '''Return the work buffers of the first n <= N vehicles as views, reusing the views of the last call'''
+        if n == self.n:
+            return self
+
+        if self.last_view is None or self.last_view.n != n:
+            view = object.__new__(BatchWork)
+            view.n = n
+            for name in self.BUFFERS:
+                setattr(view, name, getattr(self, name)[..., :n])
+            self.last_view = view
+
+        return self.last_view
+
+_BATCH_WORK = None # BatchWork of the largest fleet so far, shared by smaller fleets as views
+
+def step_dyn_batch(dt, X, U):
+    """
+    Apply controls U[N, 2] = [ua, usteer] and step forward the dynamics of N vehicles with states
+    X[N, 5] = [x, y, v, a, heading] using explicit Runge-Kutta integrator. Clamps the acceleration
+    and prevents reversing as step_dyn does for each vehicle.
+
+    The model of dyn is evaluated in place into one set of work buffers grown to the largest fleet
+    size, so a step allocates no arrays unless a vehicle is unstable or reversing or the fleet grows.
+
+    Returns:
+    X updated in place
+    """
+    global _BATCH_WORK
+
+    n = X.shape[0]
+    if _BATCH_WORK is None or _BATCH_WORK.n < n:
+        _BATCH_WORK = BatchWork(n)
+    w = _BATCH_WORK.view(n)
+
+    x, xs, k = w.x, w.xs, w.k
+    np.copyto(x, X.T)
+    np.copyto(w.ua, U[:, 0])
+
+    # The slip angle depends on the steering only, so it is constant over the stages
+    Lr, Lf = 0.5*VEHLENGTH, 0.5*VEHLENGTH
+    np.tan(U[:, 1], out=w.tmp)
+    w.tmp *= Lr/(Lf+Lr)
+    np.arctan(w.tmp, out=w.beta)
+    np.sin(w.beta, out=w.sin_beta_lr)
+    w.sin_beta_lr /= Lr
+
+    # Explicit fourth-order Runge-Kutta stages of RK4
+    dyn_batch_into(x, w, k[0], dt)
+
+    np.multiply(k[0], 0.5, out=xs)
+    xs += x
+    dyn_batch_into(xs, w, k[1], dt)
+
+    np.multiply(k[1], 0.5, out=xs)
+    xs += x
+    dyn_batch_into(xs, w, k[2], dt)
+
+    np.add(x, k[2], out=xs)
+    dyn_batch_into(xs, w, k[3], dt)
+
+    # xs = x + 0.16666667*(k1 + 2*k2 + 2*k3 + k4)
+    np.add(k[1], k[2], out=xs)
+    xs *= 2.
+    xs += k[0]
+    xs += k[3]
+    xs *= 0.16666667
+    xs += x
+
+    # Check for instability in acceleration from discrete lag filter
+    unstable = np.abs(xs[3]) > 10.
+    if unstable.any():
+        print(' !!! Unstable acceleration detected - a={}'.format(np.round(xs[3, unstable], 2)))
+        xs[3, unstable] = 10. * np.sign(xs[3, unstable])
+
+    # Prevent reversing and if detected default to previous positions and heading
+    reversing = xs[2] < 0
+    if reversing.any():
+        X[~reversing] = xs.T[~reversing]
+        X[reversing, 2:4] = 0.
+    else:
+        np.copyto(X, xs.T)
+
+    return X
+
+def dyn_batch_into(xs, w, out, dt):
+    '''Evaluate dt*dyn for the state-major stage states xs[5, N] into out[5, N] with the steering terms of the work buffers w'''
+    TAUINV = 5.0 # First order lag on acceleration tracking
+    tmp = w.tmp
+
+    np.add(xs[4], w.beta, out=tmp)
+    np.sin(tmp, out=out[0])
+    out[0] *= xs[2]
+    np.cos(tmp, out=out[1])
+    out[1] *= xs[2]
+    out[2] = xs[3]
+    np.subtract(w.ua, xs[3], out=out[3])
+    out[3] *= TAUINV
+    np.multiply(xs[2], w.sin_beta_lr, out=out[4])
+
+    out *= dt
+
 def dyn(t, x, u):
     '''
     Simulates a kinematic bicycle model with a first-order forward acceleration lag
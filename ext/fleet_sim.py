@@ -0,0 +1,495 @@
+#! /usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+# Simulation script to mock many external vehicles from one process for XIL fleet tests.
+# States, dynamics and sensor noise of all vehicles are stepped together with NumPy, and the BSMs
+# of all vehicles are multiplexed over one socket to the asyncio XIL server (--async_server).
+
+import json
+import select
+import socket
+import traceback
+from time import perf_counter as counter, sleep
+import argparse
+import numpy as np
+from math import fmod, pi
+
+from src.settings import *
+from src.agents import PCC
+from src.messages import BSM, SIM
+import parsers.client
+
+from ext.dynamics import step_dyn_batch
+from xil_wire import NeighborTable
+from xil_telemetry import XILTelemetry
+
+### Settings
+TEND_XIL = 140. # progressed time until XIL client automatically ends simulation [s]
+SERVER_TIMEOUT = 10. # [s] Stop when the server has been silent for longer
+NEIGHBOR_TIMEOUT = 1. # [s] Step a lockstep frame without the neighbor batches still missing after this, e.g. lost datagrams
+BATCH_SIZE = 32 # Vehicle BSMs per datagram, keeping JSON datagrams below the UDP payload limit
+
+# Ports that the server publishes each message type to, see README_XIL.md
+BSM_PORT = 10001
+SIM_PORT = 10004
+
+
+class FleetNoise:
+    '''Measurement noise simulation of the Noise class in ext/vehicle_sim.py for N vehicles at once'''
+    def __init__(self, n, use=True):
+        # Settings
+        self.use = use # 0 (no noise) or 1 (use measurement noise)
+        self.case = 'ornstein-uhlenbeck' # 'gaussian', 'ornstein-uhlenbeck'
+        self.rng = np.random.default_rng()
+
+        # Sensor characteristics of the [x, y, vx, vy, a, heading] readings
+        self.bias = np.array([0., 0., 0., 0., 0., 0.]) # Mean on a reading bias
+        self.std = np.array([0.010, 0.010, 0.080, 0.080, 0.200, 0.005]) # Standard deviation on reading noise
+
+        # Process states [N, 6]
+        self.P = np.zeros((n, 6))
+
+        # Measurements [N, 6] of [x, y, vx, vy, a, heading] with noise
+        self.M = np.zeros((n, 6))
+
+    def step_noise(self, dt, X):
+        '''Step the noise processes and measure the vehicle states X[N, 5] = [x, y, v, a, heading]'''
+        if self.use: # If enabling noise
+            if self.case == 'gaussian':
+                self.P[:] = self.rng.normal(self.bias, self.std, size=self.P.shape)
+            elif self.case == 'ornstein-uhlenbeck':
+                self.step_ou(dt)
+            else:
+                raise ValueError('Unrecognized noise process case.')
+
+        # True state + sensor process state
+        self.M[:, 0] = X[:, 0] + self.P[:, 0]
+        self.M[:, 1] = X[:, 1] + self.P[:, 1]
+        self.M[:, 2] = X[:, 2]*np.sin(X[:, 4]) + self.P[:, 2]
+        self.M[:, 3] = X[:, 2]*np.cos(X[:, 4]) + self.P[:, 3]
+        self.M[:, 4] = X[:, 3] + self.P[:, 4]
+        self.M[:, 5] = X[:, 4] + self.P[:, 5]
+
+        return self.M
+
+    def step_ou(self, dt):
+        '''Step the states of the noise forward using an Ornstein-Uhlenbeck process with one draw for all vehicles'''
+        theta_ou = 1.0 # Mean reversion rate
+
+        self.P += theta_ou*(self.bias - self.P) + self.std*np.sqrt(dt)*self.rng.standard_normal(self.P.shape)
+
+class FleetSIL:
+    """
+    Simulates N external vehicles in one process. Each vehicle appears to the server as its own
+    external vehicle: BSMs are marked "fleet" so the server keys them by vehicle ID instead of by
+    client address, and the neighbor batches sent back name the ego vehicle they are for.
+    """
+    def __init__(self):
+        ### Handle input arguments
+        parser = argparse.ArgumentParser('fleet_simulation')
+
+        parser.add_argument('--num_vehicles', type=int, default=100, help='Number of external vehicles to simulate. Default 100')
+        parser.add_argument('--num_lanes', type=int, default=3, help='Number of lanes to spread the vehicles over. Default 3')
+        parser.add_argument('--spacing', type=float, default=25., help='Initial spacing of the vehicles in each lane [m]. Default 25')
+        parser.add_argument('--controller', type=str, default='idm', choices=['idm', 'pcc'], help='Vehicle controller: vectorized "idm" for large fleets, or a "pcc" per vehicle. Default idm')
+        parser.add_argument('--noise', help='Flag to additionally simulate sensor measurement noise. Otherwise, use ideal sensors.', action="store_true")
+        parser.add_argument('--id_number', type=int, default=1, help='Number to add to IDs to identify the vehicles of this program. E.g. id=python_fleet_<n>_<k>')
+
+        parsers.client.register_parser(parser)
+
+        self.args = parser.parse_args()
+
+        n = self.args.num_vehicles
+        assert n >= 1, 'Need at least 1 vehicle.'
+
+        self.n = n
+        self.ids = [f"python_fleet_{self.args.id_number}_{k}" for k in range(n)] # Unique ids associated with each vehicle
+        self.index = {id: k for k, id in enumerate(self.ids)}
+
+        ### Initialize variables
+        self.init_states()
+
+        ### Sensor noise
+        self.no = FleetNoise(n, use=self.args.noise)
+
+        ### Controllers
+        if self.args.controller == 'pcc':
+            self.controls = [PCC() for _ in range(n)]
+
+        ### Initialize communications with server - one socket out, one per message type in
+        self.server = (self.args.server_ip, self.args.server_port)
+
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.send_socket.bind((self.args.client_ip, 0))
+
+        self.recv_sockets = {}
+        for msg_type, port in (('bsm', BSM_PORT), ('sim', SIM_PORT)):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind((self.args.client_ip, port))
+            s.setblocking(False)
+            self.recv_sockets[msg_type] = s
+
+        self.server_status = SIM.SimStatus.NOT_READY.value
+        self.init_server_frames()
+        self.t_server = counter() # Last time the server was heard from
+
+        ### Simulation
+        self.dt = 1./self.args.framerate
+        self.t_start = counter()
+        self.rt_start_time = counter()
+        self.rt_iter = 0
+
+        ### Latency/jitter telemetry of the server updates
+        self.telemetry = XILTelemetry(period=self.dt) if self.args.telemetry else None
+        self.last_echo_utc_time = None
+
+    def init_states(self):
+        '''Initialize the vehicle states spread over the lanes at the start of the road'''
+        n = self.n
+        k = np.arange(n)
+
+        # Vehicle states [N, 5] of [x, y, v, a, heading] - y=0 is leftmost shoulder in sumo
+        self.X = np.zeros((n, 5))
+        self.X[:, 0] = self.args.spacing * (k // self.args.num_lanes)
+        self.X[:, 1] = -(k % self.args.num_lanes + 0.5) * LANEWIDTH
+        self.X[:, 4] = 0.5*pi
+
+        # Controls [N, 2] of [acceleration request, steering]
+        self.U = np.zeros((n, 2))
+
+        # Planned trajectories of each vehicle
+        self.time_trajs = [[] for _ in range(n)]
+        self.forward_trajs = [[] for _ in range(n)]
+
+        # Neighbor states sent by the server for each vehicle
+        self.neighbors = [NeighborTable() for _ in range(n)]
+
+        # Simulation time
+        self.t = 0.
+        self.iter = 0
+        self.frame = -1 # Last lockstep frame of the server stepped with
+
+    def init_server_frames(self):
+        '''Initialize the lockstep frames and reset requests heard from the server'''
+        self.server_frame = -1
+        self.server_neighbors = 0 # Neighbor batches the server sent for server_frame
+        self.neighbor_frame = -1 # Last lockstep frame neighbor batches were received for
+        self.neighbor_count = 0 # Neighbor batches received for neighbor_frame
+        self.server_reset = False # The server reset the simulation for a new run
+
+    def reset(self):
+        '''
+        Resets the vehicles in place for a new run after the server reset the simulation, keeping the
+        sockets alive. The server already reset, so unlike SIL.reset no RESET status is sent back.
+        '''
+        # Vehicle, controller and noise states
+        self.init_states()
+
+        self.no = FleetNoise(self.n, use=self.args.noise)
+        if self.args.controller == 'pcc':
+            self.controls = [PCC() for _ in range(self.n)]
+
+        self.init_server_frames()
+        self.last_echo_utc_time = None
+
+    ### Communications
+    def send(self, message):
+        self.send_socket.sendto(json.dumps(message).encode('utf-8'), self.server)
+
+    def publish_status(self, sim_status):
+        self.send(SIM.make_sim(f"python_fleet_{self.args.id_number}", sim_status))
+
+    def publish_bsms(self):
+        '''Send the BSMs of all vehicles in one datagram'''
+        M = self.no.M
+        speeds = np.sqrt(M[:, 2]**2 + M[:, 3]**2)
+
+        bsms = []
+        for k, id in enumerate(self.ids):
+            motion_data = BSM.make_bsm(id, M[k, 1], M[k, 0], speeds[k], M[k, 4], M[k, 5], 0.0, BSM.Error.OK.value,
+                         length=VEHLENGTH, width=VEHWIDTH)
+
+            if self.time_trajs[k]:
+                motion_data = BSM.Trajectory.make_and_add_trajectory(motion_data, self.time_trajs[k], self.forward_trajs[k])
+
+            motion_data['fleet'] = True
+            bsms.append(motion_data)
+
+        # Acknowledge the last lockstep frame with the last BSM, once the server has all the others
+        if self.args.lockstep:
+            bsms[-1]['frame'] = self.frame
+
+        for i in range(0, self.n, BATCH_SIZE):
+            self.send({'msg_type': 'bsm_batch', 'bsms': bsms[i:i+BATCH_SIZE]})
+
+    def receive(self):
+        '''Drain the sockets into the neighbor tables and the server status'''
+        for msg_type, s in self.recv_sockets.items():
+            while True:
+                try:
+                    data = s.recv(65535)
+                except BlockingIOError:
+                    break
+
+                self.t_server = counter()
+                message = json.loads(data)
+
+                if msg_type == 'sim':
+                    self.server_status = message.get('sim_status', self.server_status)
+
+                    # Remembered until handled, as the statuses of the next run may follow in the same drain
+                    if self.server_status == SIM.SimStatus.RESET.value:
+                        self.server_reset = True
+
+                    if message.get('frame', -1) > self.server_frame:
+                        self.server_frame = message['frame']
+                        self.server_neighbors = message.get('neighbors', 0)
+
+                elif message.get('msg_type') == 'bsm_batch':
+                    self.count_neighbors(message.get('frame'))
+
+                    if message.get('ego') in self.index:
+                        self.neighbors[self.index[message['ego']]].apply(message)
+
+                        if self.telemetry is not None:
+                            self.record_telemetry(message)
+
+    def count_neighbors(self, frame):
+        '''Count a neighbor batch of a lockstep frame'''
+        if frame is None or frame < self.neighbor_frame:
+            return
+
+        if frame > self.neighbor_frame:
+            self.neighbor_frame = frame
+            self.neighbor_count = 0
+
+        self.neighbor_count += 1
+
+    def has_neighbors(self):
+        '''True once every neighbor batch the server sent for its last frame was received'''
+        return self.server_neighbors == 0 or (self.neighbor_frame == self.server_frame and self.neighbor_count >= self.server_neighbors)
+
+    def record_telemetry(self, message):
+        '''Record the round trip of the fleet BSMs echoed back by the server'''
+        for bsm in message['bsms']:
+            echo_utc_time = bsm.get('echo_utc_time')
+            if echo_utc_time is not None and echo_utc_time != self.last_echo_utc_time:
+                self.telemetry.record_rtt('server', echo_utc_time)
+                self.last_echo_utc_time = echo_utc_time
+
+    def is_simming(self):
+        return self.server_status == SIM.SimStatus.RUNNING.value and not self.server_reset and counter() - self.t_server < SERVER_TIMEOUT
+
+    ### Simulation
+    def get_preceding_vehicles(self):
+        '''Return the gap [m], speed [m/s] and acceleration [m/s2] arrays of the closest in-lane vehicle ahead of each vehicle'''
+        pv = np.tile([2000., 0., 0.], (self.n, 1)) # Defaults
+        self.pv_trajs = [None]*self.n
+
+        for k, table in enumerate(self.neighbors):
+            for bsm in table.bsms.values():
+                # Only vehicles ahead in the ego lane - the server also sends followers and adjacent lanes
+                if bsm["rel_long_gap"] <= 0 or abs(bsm.get("rel_lat_gap", 0.)) >= 0.5*LANEWIDTH:
+                    continue
+
+                if bsm["rel_long_gap"] < pv[k, 0]:
+                    pv[k] = bsm["rel_long_gap"], bsm["speed"], bsm["acceleration"]
+
+                    if BSM.Trajectory.has_trajectory(bsm):
+                        self.pv_trajs[k] = BSM.Trajectory.get_trajectory(bsm)
+
+        return pv[:, 0], pv[:, 1], pv[:, 2]
+
+    def step_idm(self, speed, pv_gap, pv_speed, v_max):
+        '''Intelligent driver model acceleration requests of all vehicles'''
+        a_max, b, s0, T = 1.5, 2.0, 2.0, 1.5
+
+        s_star = s0 + np.maximum(speed*T + speed*(speed - pv_speed)/(2.*np.sqrt(a_max*b)), 0.)
+        return a_max*(1. - (speed/v_max)**4 - (s_star/np.maximum(pv_gap, 0.1))**2)
+
+    def step_pcc(self, accel, speed, pv_gap, pv_speed, pv_accel, v_max):
+        '''Predictive cruise control acceleration requests, one controller per vehicle'''
+        u = np.zeros(self.n)
+
+        for k, control in enumerate(self.controls):
+            lead_t_comms, lead_s_comms = self.pv_trajs[k] if self.pv_trajs[k] is not None else ([], [])
+            s_max = 1200 - self.X[k, 0]
+
+            u[k], self.time_trajs[k], self.forward_trajs[k], vel_traj, acc_traj = control.getCommand(
+                self.t, accel[k], speed[k], 0., s_max, v_max, pv_accel[k], pv_speed[k], pv_gap[k], lead_t_comms, lead_s_comms, [])
+
+        return u
+
+    def step(self):
+        '''Step a single iteration of all vehicles'''
+        ### Get most recent updates from microsim server
+        self.receive()
+
+        pv_gap, pv_speed, pv_accel = self.get_preceding_vehicles()
+
+        ### Step vehicle control and vehicle dynamics
+        M = self.no.M
+        speed = np.sqrt(M[:, 2]**2 + M[:, 3]**2)
+        v_max = 30. / 2.23693629
+
+        if self.args.controller == 'pcc':
+            self.U[:, 0] = self.step_pcc(M[:, 4], speed, pv_gap, pv_speed, pv_accel, v_max)
+        else:
+            self.U[:, 0] = self.step_idm(speed, pv_gap, pv_speed, v_max)
+
+        step_dyn_batch(self.dt, self.X, self.U)
+        self.t += self.dt
+
+        self.no.step_noise(self.dt, self.X)
+
+        ### Send vehicle updates to the server
+        self.publish_bsms()
+
+        if abs(fmod(self.t, 1)) < 1e-6: # Publish every n seconds of simulation time
+            self.publish_status(SIM.SimStatus.RUNNING.value)
+
+        # Iterate
+        if fmod(self.iter, 10)==0:
+            print('real time: {:3.2f}, sim time: {:3.2f} | {} vehicles | mean speed: {:5.2f} m/s'.format(
+                counter()-self.t_start, self.t, self.n, self.X[:, 2].mean())
+            )
+
+        self.iter += 1
+
+    def rate(self):
+        '''Control real time rate'''
+        self.rt_iter += 1
+        sleep_duration = self.dt * self.rt_iter - (counter() - self.rt_start_time)
+        if sleep_duration > 0:
+            sleep(sleep_duration)
+
+    def wait_for_frame(self, timeout=10.):
+        '''
+        Block on the sockets until the next lockstep frame of the server and its neighbor batches
+        arrived. Returns False if no frame arrived within timeout or the server reset.
+        '''
+        deadline = counter() + timeout
+        sockets = list(self.recv_sockets.values())
+
+        while True:
+            self.receive()
+
+            if self.server_reset:
+                return False
+
+            if self.server_frame > self.frame:
+                # Once the frame is in, wait a bounded time for its neighbors
+                deadline = min(deadline, counter() + NEIGHBOR_TIMEOUT)
+
+                if self.has_neighbors() or counter() >= deadline:
+                    self.frame = self.server_frame
+                    return True
+
+            remaining = deadline - counter()
+            if remaining <= 0:
+                return False
+
+            select.select(sockets, [], [], remaining)
+
+    def wait(self):
+        '''Wait for the server to start the simulation'''
+        print(f'Waiting for first server data with {self.n} vehicles...')
+
+        self.no.step_noise(self.dt, self.X)
+
+        while self.server_status != SIM.SimStatus.RUNNING.value:
+            self.publish_bsms()
+            self.publish_status(SIM.SimStatus.WAITING.value)
+
+            self.receive()
+            self.rate()
+
+        self.t_server = counter()
+
+    def elapsed(self):
+        '''Time into the run [s] - simulated in lockstep, otherwise real'''
+        return self.t if self.args.lockstep else counter() - self.t_start
+
+    def stop(self):
+        '''Stops the fleet simulation'''
+        self.publish_status(SIM.SimStatus.OFFLINE.value)
+
+        self.send_socket.close()
+        for s in self.recv_sockets.values():
+            s.close()
+
+        if self.telemetry is not None:
+            self.telemetry.export('logs', f'xil_telemetry_fleet_{self.args.id_number}')
+
+    def sim(self):
+        '''Run simulation of the fleet in SIL interface, resetting in place when the server resets'''
+        while True:
+            self.run()
+
+            if not self.server_reset:
+                break
+
+            print('Server reset detected. Resetting the fleet for a new run.')
+            self.reset()
+
+        # Stop
+        try:
+            self.stop()
+
+        except Exception as e:
+            print(f'An exception occured: {e}')
+
+    def run(self):
+        '''Run one simulation of the fleet until the server or the client ends it'''
+        try:
+            # Wait for the server
+            self.wait()
+
+            ### Simulation
+            self.t_start = counter()
+            self.rt_start_time = counter()
+            self.rt_iter = 0
+
+            # Main loop - in lockstep, the test duration is simulated time
+            while self.elapsed() < TEND_XIL and self.is_simming():
+                # Lockstep - step once per server frame
+                if self.args.lockstep and not self.wait_for_frame():
+                    if not self.server_reset:
+                        print('Fleet shutdown automatically due to no lockstep frames from the server.')
+                    break
+
+                # Step all vehicles
+                t_frame = counter()
+                self.step()
+
+                if self.telemetry is not None:
+                    self.telemetry.record_frame(counter() - t_frame)
+
+                # Rollover and control runtime rate
+                if not self.args.lockstep:
+                    self.rate()
+
+            if self.elapsed() >= TEND_XIL:
+                print('Fleet shutdown automatically due to t > t_end.')
+
+        except KeyboardInterrupt:
+            self.server_reset = False
+
+        except Exception as e:
+            print(traceback.format_exc())
+            print(f'An unknown exception occured: {e}')
+
+def main():
+    fleet = FleetSIL()
+    fleet.sim()
+
+if __name__ == '__main__':
+    # Run simulation
+    main()
+
+    print('Exited fleet simulation.')
@@ -9,7 +9,7 @@
 # Simulation script to mock the vehicle-level sensors and actuation
 
 import traceback
-from time import perf_counter as counter
+from time import perf_counter as counter, sleep
 import argparse
 import numpy as np
 from math import sin, cos, sqrt, fmod, pi
@@ -23,11 +23,14 @@ from src.messages import BSM, SPAT, SIM
 import parsers.client
 
 from ext.dynamics import step_dyn
+from xil_telemetry import XILTelemetry
 
 ### Settings
 MAX_N_RESETS = 1 # The number of trials the client program will attempt
 RESETS = 0 # The number of trials the client has currently performed
 TEND_XIL = 140. # progressed time until XIL client automatically ends simulation [s]
+NEIGHBOR_TIMEOUT = 1. # [s] Step a lockstep frame without the neighbor BSMs still missing after this, e.g. lost datagrams
+POLL_INTERVAL = 1e-3 # [s] Sleep between checks of the latest server messages while waiting for a lockstep frame
 
 
 class Noise:
@@ -156,8 +159,33 @@ class SIL:
         parsers.client.register_parser(parser)
     
         self.args = parser.parse_args()
-        
+
+        self.id = f"python_ego_{str(self.args.id_number)}" # Unique id associated with ego
+
         ### Initialize variables
+        self.init_states()
+
+        ### Sensor noise
+        self.no = Noise(use=self.args.noise)
+
+        ### CAV Controller
+        self.control = PCC()
+
+        ### Initialize communications with server
+        # Run client to send/listen for server messages
+        self.client = UDPClient(server_ip=self.args.server_ip, server_port=self.args.server_port, framerate=self.args.framerate)  
+        
+        ### Simulation
+        self.dt = 1./self.client.framerate
+        self.t_start = counter()
+
+        ### Latency/jitter telemetry of the server updates
+        self.telemetry = XILTelemetry(period=self.dt) if self.args.telemetry else None
+        self.last_bsm_utc_times = {} # {nv_id: send time} of the neighbor BSMs already recorded
+        self.last_echo_utc_time = None
+
+    def init_states(self):
+        '''Initialize the ego states at the start of the road'''
         # gamma - Road orientation angle at a point s
 
         # rf = setLocation() # RoadFrame object
@@ -180,27 +208,14 @@ class SIL:
         self.u0 = 0.0 # Acceleration request [m/s2]
         self.u1 = 1 # Integer lane request - 1 rightmost lane, 2 second lane, ...
 
-        self.id = f"python_ego_{str(self.args.id_number)}" # Unique id associated with ego
-
         # Ego planned trajectory
         self.time_traj = []
         self.forward_traj = []
 
-        ### Sensor noise
-        self.no = Noise(use=self.args.noise)
-
-        ### CAV Controller
-        self.control = PCC()
-
-        ### Initialize communications with server
-        # Run client to send/listen for server messages
-        self.client = UDPClient(server_ip=self.args.server_ip, server_port=self.args.server_port, framerate=self.args.framerate)  
-        
-        ### Simulation
-        self.dt = 1./self.client.framerate
+        # Simulation time
         self.t = 0.
         self.iter = 0
-        self.t_start = counter()
+        self.frame = -1 # Last lockstep frame of the server stepped with
 
     def publish_status(self, sim_status):
         sim_data = SIM.make_sim(self.id, sim_status)
@@ -214,20 +229,35 @@ class SIL:
 
         motion_data = BSM.Trajectory.make_and_add_trajectory(motion_data, self.time_traj, self.forward_traj)
 
+        # Acknowledge the last lockstep frame
+        if self.args.lockstep:
+            motion_data['frame'] = self.frame
+
         # Send data
         self.client.send_update_data(motion_data)
 
     def reset(self):
         '''
-        Resets the simulation and communication client.
+        Resets the vehicle in place for a new run, keeping the communication client alive.
         '''
 
         if self.client.is_running():
             self.publish_status(SIM.SimStatus.RESET.value)
-            self.client.stop()
 
-        # Restart
-        main()
+        # Ego, controller and noise states
+        self.init_states()
+
+        self.no = Noise(use=self.args.noise)
+        self.control = PCC()
+
+        self.last_bsm_utc_times = {}
+        self.last_echo_utc_time = None
+
+        # Let the server acknowledge the reset before waiting for its next run
+        t = counter()
+        while self.client.is_running() and self.client.is_simming() and counter() - t < 2.:
+            self.publish_status(SIM.SimStatus.RESET.value)
+            self.client.rate()
 
     def stop(self):
         '''Stops the SIL simulation'''
@@ -236,19 +266,33 @@ class SIL:
             
             self.client.stop()
 
+        if self.telemetry is not None:
+            self.telemetry.export('logs', f'xil_telemetry_{self.id}')
+
     def step(self):
         '''Step a single iteration of the SIL simulation'''
         ### Get most recent update from microsim server
         bsm_data = self.client.get_data('bsm')
 
+        # In lockstep, only the neighbors of the frame - BSMs of departed neighbors stay in the latest-value table
+        if bsm_data and self.args.lockstep:
+            bsm_data = {id: bsm for id, bsm in bsm_data.items() if bsm.get('frame') == self.frame}
+
         ### Step vehicle control and vehicle dynamics
         # PV states as from server
         pv_gap, pv_speed, pv_accel = 2000., 0., 0. # Defaults
         lead_t_comms, lead_s_comms, lead_v_comms = [], [], [] # Defaults
 
+        if bsm_data and self.telemetry is not None:
+            self.record_telemetry(bsm_data)
+
         if bsm_data:
             for id, bsm in bsm_data.items():      
-                # Get closest surrounding vehicle that was sent
+                # Only vehicles ahead in the ego lane can be the preceding vehicle - the server also sends followers and adjacent lanes
+                if bsm["rel_long_gap"] <= 0 or abs(bsm.get("rel_lat_gap", 0.)) >= 0.5*LANEWIDTH:
+                    continue
+
+                # Get closest preceding vehicle that was sent
                 if bsm["rel_long_gap"] < pv_gap:
                     pv_gap = bsm["rel_long_gap"]
                     pv_speed = bsm["speed"]
@@ -290,16 +334,65 @@ class SIL:
             
         self.iter += 1
 
+    def record_telemetry(self, bsm_data):
+        '''Record the latency of the neighbor BSMs from the server and the round trip of the echoed ego BSM'''
+        # Neighbor BSMs not yet recorded, in send order
+        new_times = []
+        for id, bsm in bsm_data.items():
+            sent_time = bsm.get('current_utc_time')
+            if sent_time is not None and sent_time != self.last_bsm_utc_times.get(id):
+                self.last_bsm_utc_times[id] = sent_time
+                new_times.append(sent_time)
+
+        for sent_time in sorted(new_times):
+            self.telemetry.record_message('server', sent_time)
+
+        for bsm in bsm_data.values():
+            echo_utc_time = bsm.get('echo_utc_time')
+            if echo_utc_time is not None and echo_utc_time != self.last_echo_utc_time:
+                self.telemetry.record_rtt('server', echo_utc_time)
+                self.last_echo_utc_time = echo_utc_time
+
     def rate(self):
         '''Control real time rate'''
         self.client.rate()
 
-    def wait(self):
-        '''Wait for other required nodes to come online'''
+    def wait_for_frame(self, timeout=10.):
+        '''
+        Wait for the next lockstep frame of the server and the neighbor BSMs sent for it. The messages
+        are received by the threads of the UDPClient, so their latest values are checked every
+        POLL_INTERVAL. Returns False if no frame arrived within timeout.
+        '''
+        deadline = counter() + timeout
+
+        while self.client.is_running():
+            sim_data = self.client.get_data('sim') or {}
+            frame = max((sim for sim in sim_data.values() if 'frame' in sim), key=lambda sim: sim['frame'], default=None)
+
+            if frame is not None and frame['frame'] > self.frame:
+                # Once the frame is in, wait a bounded time for its neighbors
+                deadline = min(deadline, counter() + NEIGHBOR_TIMEOUT)
+
+                bsm_data = self.client.get_data('bsm') or {}
+                n = sum(bsm.get('frame') == frame['frame'] for bsm in bsm_data.values())
+
+                if n >= frame.get('neighbors', 0) or counter() >= deadline:
+                    self.frame = frame['frame']
+                    return True
+
+            if counter() >= deadline:
+                break
+
+            sleep(POLL_INTERVAL)
+
+        return False
+
+    def wait(self, prepare=True):
+        '''Wait for other required nodes to come online. The preparation phase is skipped after a reset.'''
         first = True
 
         t = counter()
-        while self.client.is_running() and counter() - t < 10:
+        while prepare and self.client.is_running() and counter() - t < 10:
             if first:
                 print('Preparing client for XIL...')
                 first = False
@@ -322,28 +415,72 @@ class SIL:
         self.publish_status(SIM.SimStatus.RUNNING.value)
 
     def sim(self):
-        '''Run simulation of a real vehicle in SIL interface'''
+        '''Run simulation of a real vehicle in SIL interface, resetting in place between runs'''
         global RESETS
-        if RESETS >= MAX_N_RESETS:
-            return
 
+        prepare = True
+        while RESETS < MAX_N_RESETS:
+            self.run(prepare=prepare)
+            prepare = False
+
+            # Reset for another run
+            try:
+                RESETS += 1
+                if RESETS < MAX_N_RESETS and self.client.is_simming():
+                    self.reset()
+                    continue
+
+            except KeyboardInterrupt as e:
+                RESETS = MAX_N_RESETS
+
+            except Exception as e:
+                print(f'An exception occured: {e}')
+
+            break
+
+        # Stop
+        try:
+            self.stop()
+
+        except KeyboardInterrupt as e:
+            RESETS = MAX_N_RESETS
+            
+        except Exception as e:
+            print(f'An exception occured: {e}')
+
+    def elapsed(self):
+        '''Time into the run [s] - simulated in lockstep, otherwise real'''
+        return self.t if self.args.lockstep else counter() - self.t_start
+
+    def run(self, prepare=True):
+        '''Run one simulation of a real vehicle until the server or the client ends it'''
         try:
             # Wait for other nodes/server
-            self.wait()
+            self.wait(prepare=prepare)
 
             ### Simulation
             # Initialize external agent
             self.t_start = counter()
 
-            # Main loop
-            while self.client.running.is_set() and counter() - self.t_start < TEND_XIL and self.client.is_simming():
+            # Main loop - in lockstep, the test duration is simulated time
+            while self.client.running.is_set() and self.elapsed() < TEND_XIL and self.client.is_simming():
+                # Lockstep - step once per server frame
+                if self.args.lockstep and not self.wait_for_frame():
+                    print('SIL shutdown automatically due to no lockstep frames from the server.')
+                    break
+
                 # Step the SIL simulation
+                t_frame = counter()
                 self.step()
 
+                if self.telemetry is not None:
+                    self.telemetry.record_frame(counter() - t_frame)
+
                 # Rollover and control runtime rate
-                self.client.rate()
+                if not self.args.lockstep:
+                    self.client.rate()
 
-            if counter() - self.t_start >= TEND_XIL:
+            if self.elapsed() >= TEND_XIL:
                 print('SIL shutdown automatically due to t > t_end.')
         
         except KeyboardInterrupt:
@@ -364,20 +501,6 @@ class SIL:
             print(traceback.format_exc())
             print(f'An unknown exception occured: {e}')
 
-        # Stop
-        try:
-            RESETS += 1
-            if RESETS < MAX_N_RESETS and self.client.is_simming():
-                self.reset()
-
-            self.stop()
-
-        except KeyboardInterrupt as e:
-            RESETS = MAX_N_RESETS
-            
-        except Exception as e:
-            print(f'An exception occured: {e}')
-
 def main():
     veh = SIL()
     veh.sim()
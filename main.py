@@ -10,6 +10,7 @@
 # Profiling helpers
 #   python -m cProfile -o <output_name>.prof <script_name>.py
 #   snakeviz <output_name>.prof
+#   python main.py --step_timing --cprofile_steps 500 --cprofile_start 1000  # per-phase step timing and a windowed profile
 #
 # Quick-start and API references (SUMO / TraCI):
 #   https://sumo.dlr.de/docs/Tutorials/Hello_SUMO.html
@@ -63,24 +64,67 @@ from time import perf_counter as counter
 from time import sleep
 import warnings
 import os
+import pickle
 import argparse
 from typing import List, Dict
-from math import fmod, pi
+from math import fmod, pi, sin, cos
 import random
 from datetime import datetime
 import xml.etree.ElementTree as ET
 
 from sumolib import checkBinary
-import traci # traci has full API options
-# import libsumo as traci  # libsumo is faster but has no GUI support and certain API options are limited
+from sumo_backend import traci # libsumo for headless runs when installed, otherwise traci which has full API options and GUI support
+import traci.constants as tc
 
 from src.agents import PCC, CAV, EXT
-from src.sensing import Communications
 from src.settings import *
 import parsers.sumo
 from src.logging import logger
 
 import scripts.utils_data_read as reader
+from step_timing import StepTimer
+from comms_buffer import RingCommunications, min_history
+from batch_control import EGO_STATES, LEADER_STATES, evaluate_commands
+
+# Vehicle variables subscribed once per spawned vehicle and read back each step in one batched response
+VEHICLE_SUBSCRIPTION_VARS = (
+    tc.VAR_TYPE,
+    tc.VAR_SPEED,
+    tc.VAR_ACCELERATION,
+    tc.VAR_LANE_ID,
+    tc.VAR_LANEPOSITION,
+    tc.VAR_ANGLE,
+    tc.VAR_POSITION,
+    tc.VAR_LEADER,
+)
+
+# Per-vehicle getter equivalents, used when subscriptions are disabled or a value is missing from the snapshot
+# Bound to the selected backend in simulation.__init__
+VEHICLE_GETTERS = {
+    tc.VAR_TYPE: 'getTypeID',
+    tc.VAR_SPEED: 'getSpeed',
+    tc.VAR_ACCELERATION: 'getAcceleration',
+    tc.VAR_LANE_ID: 'getLaneID',
+    tc.VAR_LANEPOSITION: 'getLanePosition',
+    tc.VAR_ANGLE: 'getAngle',
+    tc.VAR_POSITION: 'getPosition',
+    tc.VAR_LENGTH: 'getLength',
+}
+
+# Neighbor variables returned by the context subscription around each CAV/EXT
+NEIGHBOR_SUBSCRIPTION_VARS = (
+    tc.VAR_TYPE,
+    tc.VAR_SPEED,
+    tc.VAR_ACCELERATION,
+    tc.VAR_LANE_ID,
+    tc.VAR_LANEPOSITION,
+    tc.VAR_ANGLE,
+    tc.VAR_POSITION,
+    tc.VAR_LENGTH,
+)
+
+# Version of the Python-side checkpoint payload - bump when its fields change
+CHECKPOINT_VERSION = 2
 
 # -------------------------------------------------------------------------------------------------------
 
@@ -99,8 +143,8 @@ class simulation():
 
     Notes
     -----
-    * This implementation imports `libsumo as traci` for performance (no GUI).
-      If GUI is requested, you must import/use standard `traci` and launch `sumo-gui`.
+    * The SUMO API is reached through the `sumo_backend.traci` facade, which uses libsumo
+      in-process for headless runs when installed (`--backend`), and standard traci with `sumo-gui`.
     * Only comments/docstrings were modified to English; the program logic remains unchanged.
     """
 
@@ -177,18 +221,15 @@ class simulation():
             'ghost': (0, 0, 0, 0)
         }
 
-        # Set up SUMO backend
-        if traci.isLibsumo():
-            print('Using lib sumo.')
-            # Guard: libsumo does not support the GUI flag
-            assert not self.args.gui, 'Libsumo API does not support using GUI option! Adjust the Python import, or adjust command-line option'
+        # Set up SUMO backend - libsumo does not support the GUI so traci is used with --gui
+        traci.select(backend=self.args.backend, gui=self.args.gui)
 
         # SUMO scenario inputs
         SUMO_CFG_FILE = f"{self.args.scenario_folder}/{self.args.scenario}/{self.args.scenario}.sumocfg"
         assert os.path.isfile(SUMO_CFG_FILE), f'Could not find .sumocfg file at {SUMO_CFG_FILE}'
 
         # SUMO scenario outputs
-        SUMO_OUT_DIR = f"{self.args.scenario_folder}/{self.args.scenario}/output"  # Directory where additional TraCI-defined outputs are saved
+        SUMO_OUT_DIR = f"{self.args.scenario_folder}/{self.args.scenario}/{self.args.output_name}"  # Directory where additional TraCI-defined outputs are saved
 
         if self.args.timestamp_output:  # Optionally suffix outputs with a timestamp
             now = datetime.now()
@@ -196,6 +237,7 @@ class simulation():
             SUMO_OUT_DIR += formatted
 
         os.makedirs(SUMO_OUT_DIR, exist_ok=True)
+        self.output_dir = SUMO_OUT_DIR
 
         # Choose SUMO binary
         if self.args.gui:  # GUI requires standard traci (libsumo does not support GUI)
@@ -229,6 +271,11 @@ class simulation():
         # Build a single penetration tag (e.g. 'p0.1', 'p0.25') so filenames stay consistent
         # Use the general format specifier to avoid floating-point artifacts (0.1 -> '0.1')
         penetration_tag = f"p{self.args.penetration:g}"
+        self.penetration_tag = penetration_tag
+
+        # Per-step phase timing and optional cProfile window
+        self.timer = StepTimer(enabled=self.args.step_timing, cprofile_start=self.args.cprofile_start, cprofile_steps=self.args.cprofile_steps)
+        self.timer.profile_file = os.path.join(SUMO_OUT_DIR, f"step_{penetration_tag}.prof")
 
         if not self.args.no_inflow:  # For non-replay cases with inflow, enable data logging
             SUMO_CMD += [
@@ -244,16 +291,27 @@ class simulation():
             ]
 
         # Modify flows according to CAV penetration rate (route file uses the same tag)
-        output_file = f"{self.args.scenario_folder}/{self.args.scenario}/{self.args.scenario}_{penetration_tag}.rou.xml"
+        # The route file is written next to the run outputs so concurrent runs do not share it
+        output_file = os.path.join(SUMO_OUT_DIR, f"{self.args.scenario}_{penetration_tag}.rou.xml")
 
-        reader.update_flows(
+        # Reused without parsing the template when an up-to-date route file exists
+        route_meta = reader.update_flows(
             penetration_rate=self.args.penetration,
             input_file=f"{self.args.scenario_folder}/{self.args.scenario}/{self.args.scenario}_template.rou.xml",
-            output_file=output_file
+            output_file=output_file,
+            use_cache=not self.args.regenerate_routes
         )
+        self.route_file = output_file
+        self.route_planned_end = route_meta.get('planned_end')
 
         SUMO_CMD += ['--route-files', output_file]
 
+        # Warm-start from a saved SUMO state - vehicles in the snapshot do not appear as departed
+        if self.args.load_checkpoint:
+            state_file, _ = self.get_checkpoint_files(self.args.load_checkpoint)
+            assert os.path.isfile(state_file), f'Cannot find checkpoint state file {state_file}'
+            SUMO_CMD += ['--load-state', state_file]
+
         if self.args.no_inflow:
             input_file = output_file
             output_file = output_file
@@ -263,31 +321,244 @@ class simulation():
         print(f'Starting SUMO with configuration file: {SUMO_CFG_FILE}.')
         print(f'Outputting additional SUMO data to dir: {SUMO_OUT_DIR}.')
 
-        # Initialize (C)AV controllers if penetration > 0
-        if self.args.penetration > 0:
-            # Pick the virtual ego controller:
-            self.ego = PCC()  # Predictive Cruise Controller
-            # self.ego = CAV() # TODO: CAV controller for eco-approach with I2V-connected intersections
-
-        # Initialize V2V communications buffer
-        self.comms = Communications()
-
         # Initialize traffic-light logger
         self.tl_logger = logger()
 
-        # Start SUMO (TraCI/libsumo)
-        traci.start(SUMO_CMD)
+        # Start SUMO (TraCI/libsumo) - an explicit port/label keeps parallel workers apart
+        self.sumo_cmd = SUMO_CMD
+        traci.start(SUMO_CMD, port=self.args.traci_port, label=self.args.traci_label)
+        traci.report()
+
+        self.vehicle_getters = {var_id: getattr(traci.vehicle, name) for var_id, name in VEHICLE_GETTERS.items()}
+        self.vehicle_getters[tc.VAR_LEADER] = lambda veh_id: traci.vehicle.getLeader(veh_id, dist=RADAR_RANGE)
+
+        self.reset_state()
+
+        # Restore the Python-side state matching the loaded SUMO state
+        if self.args.load_checkpoint:
+            self.load_checkpoint(self.args.load_checkpoint)
+
+        # Snapshot of the start of the run for fast in-place resets - see reset
+        self.reset_state_file = None
+        if getattr(self.args, 'reset_from_state', False):
+            self.reset_state_file = os.path.join(SUMO_OUT_DIR, f"reset_{penetration_tag}.state.xml.gz")
+            traci.simulation.saveState(self.reset_state_file)
+
+    def reset_state(self):
+        """
+        Initialize the controllers, the V2V communications buffer and the TraCI bookkeeping and
+        subscriptions of a run that starts at the current SUMO state.
+        """
+        # Initialize (C)AV controllers if penetration > 0 - otherwise only once a CAV shows up, e.g. from a checkpoint
+        if self.args.penetration > 0:
+            self.init_controller()
+
+        # Initialize V2V communications buffer - bounded ring buffers with an optional latency/loss channel,
+        # holding every message still in flight under the longest delay
+        self.comms = RingCommunications(
+            history=max(4, min_history(self.args.comms_latency, self.args.comms_jitter, self.dt)),
+            latency=self.args.comms_latency, jitter=self.args.comms_jitter, loss=self.args.comms_loss, seed=self.args.seed
+        )
+
+        # Microsimulation time-keeping
+        self.sim_time = traci.simulation.getTime()
+        self.rt_start_time = counter()
+        self.rt_iter = 0
 
-        # TraCI bookkeeping
+        # TraCI bookkeeping - updated incrementally from the departed/arrived ID lists each step
         self.spawned_vehs = {}  # {veh_id: type_id} for vehicles currently in the network
-        self.has_set_vehs = []  # List of veh_ids for which one-time properties were configured
+        self.has_set_vehs = set()  # Set of veh_ids for which one-time properties were configured
+        self.ext_type_id = EXT().type_id
+        self.active_vehs = {'hdv': {}, 'cav': {}, self.ext_type_id: {}}  # {type_id: {veh_id: None}} insertion-ordered active IDs by type
+
+        # Vehicle variable subscriptions
+        self.use_subscriptions = not self.args.no_subscriptions
+        self.veh_states = {}  # {veh_id: {var_id: value}} subscription snapshot for the current step
+
+        # Departed/arrived lists are fetched with getters in-process under libsumo
+        self.use_sim_subscription = self.use_subscriptions and not traci.isLibsumo()
+        if self.use_sim_subscription:
+            traci.simulation.subscribe((tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS))
+
+        # Context subscriptions around CAV/EXT vehicles - only these vehicles get variable subscriptions
+        self.use_context_subscriptions = self.use_subscriptions and self.args.context_subscriptions
+        self.neighbor_states = {}  # {ego_id: {nv_id: {var_id: value}}} neighbor tables for the current step
+
+        # Traffic-light program cache
+        self.tl_metadata = {}  # {tl_id: static program metadata} - see build_tl_metadata
+        self.tl_route_link_index = {}  # {(tl_id, route_edges): link_index} route membership lookups
+        self.tl_phases = {}  # {tl_id: {var_id: value}} current phase/program for the current step
+
+        for tl_id in traci.trafficlight.getIDList():
+            self.build_tl_metadata(tl_id)
+            if self.use_subscriptions:
+                traci.trafficlight.subscribe(tl_id, (tc.TL_CURRENT_PHASE, tc.TL_CURRENT_PROGRAM))
+
+    def init_controller(self):
+        """Create the virtual ego controller that drives the vehicles labeled 'cav'."""
+        # Pick the virtual ego controller:
+        self.ego = PCC()  # Predictive Cruise Controller
+        # self.ego = CAV() # TODO: CAV controller for eco-approach with I2V-connected intersections
+
+    def reset(self):
+        """
+        Restart the scenario in the running SUMO instance instead of relaunching SUMO.
+
+        The scenario is reloaded with `traci.load` and the same command line, so the route file is
+        reused and the outputs are rewritten from the start. With `--reset_from_state`, the SUMO
+        state saved when the run started is loaded instead, which skips re-reading the network but
+        continues writing the outputs of the previous run. The Python-side state is reinitialized
+        in place with `reset_state`, and with `--load_checkpoint` the checkpoint's Python-side state
+        is re-applied on top, since either SUMO state starts the run at the checkpoint.
+        """
+        if self.reset_state_file is not None:
+            traci.simulation.loadState(self.reset_state_file)
+        else:
+            traci.load(self.sumo_cmd[1:])
+
+        self.reset_state()
+
+        if self.args.load_checkpoint:
+            self.load_checkpoint(self.args.load_checkpoint)
+
+        print(f'Reset SUMO simulation to t={self.sim_time:.1f}s.')
 
     def stop(self):
         """Close the SUMO simulation and detach the TraCI/libsumo connection."""
         if traci.isLoaded():
+            self.timer.write_report(self.output_dir, self.penetration_tag)
+
             print('Closing SUMO.')
             traci.close()
 
+    def get_checkpoint_files(self, path):
+        """Return the (SUMO state file, Python state file) pair for a checkpoint path prefix."""
+        return f"{path}.state.xml.gz", f"{path}.pkl"
+
+    def save_checkpoint(self, path):
+        """
+        Save the SUMO state together with the Python-side state needed to continue the run.
+
+        The SUMO snapshot is written with `traci.simulation.saveState`. The Python state holds the
+        vehicle bookkeeping, the V2V communications buffer and the controller internals. Controllers
+        may implement `get_state()`/`set_state(state)` to control what is saved, otherwise the
+        controller object itself is pickled.
+
+        Parameters
+        ----------
+        path : str
+            Checkpoint path prefix. See `get_checkpoint_files`.
+        """
+        state_file, py_file = self.get_checkpoint_files(path)
+
+        traci.simulation.saveState(state_file)
+
+        controller_state = None
+        if hasattr(self, 'ego'):
+            controller_state = self.ego.get_state() if hasattr(self.ego, 'get_state') else self.ego
+
+        checkpoint = {
+            'version': CHECKPOINT_VERSION,
+            'sim_time': self.sim_time,
+            'scenario': self.args.scenario,
+            'penetration': self.args.penetration,
+            'seed': self.args.seed,
+            'spawned_vehs': self.spawned_vehs,
+            'has_set_vehs': self.has_set_vehs,
+            'active_vehs': self.active_vehs,
+            'comms': self.comms,
+            'controller': controller_state,
+        }
+
+        try:
+            data = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            warnings.warn(f'Could not pickle the controller state ({e}). Saving the checkpoint without it.')
+            checkpoint['controller'] = None
+            data = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Write atomically so an interrupted save never leaves a truncated checkpoint
+        with open(py_file + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(py_file + '.tmp', py_file)
+
+        print(f'Saved checkpoint at t={self.sim_time:.1f}s to {path}.')
+
+    def load_checkpoint(self, path):
+        """
+        Restore the Python-side state saved by `save_checkpoint` after SUMO was started with the
+        matching `--load-state` snapshot.
+
+        The run may branch from the checkpoint with a different penetration or controller. Vehicles
+        already in the network keep the types of the snapshot, so the controller is created for the
+        restored CAVs even when this run has a penetration of 0. Vehicle subscriptions and the one-time CAV settings
+        are not part of the SUMO state, so they are re-applied here.
+
+        Parameters
+        ----------
+        path : str
+            Checkpoint path prefix. See `get_checkpoint_files`.
+        """
+        _, py_file = self.get_checkpoint_files(path)
+
+        with open(py_file, 'rb') as f:
+            checkpoint = pickle.load(f)
+
+        assert checkpoint['version'] == CHECKPOINT_VERSION, f"Checkpoint version {checkpoint['version']} does not match {CHECKPOINT_VERSION}."
+
+        if checkpoint['scenario'] != self.args.scenario:
+            warnings.warn(f"Checkpoint was saved for scenario {checkpoint['scenario']} but {self.args.scenario} is running.")
+
+        self.sim_time = traci.simulation.getTime()
+
+        # Vehicle bookkeeping - keep only vehicles present in the loaded SUMO state
+        in_network = set(traci.vehicle.getIDList())
+        self.spawned_vehs = {veh_id: type_id for veh_id, type_id in checkpoint['spawned_vehs'].items() if veh_id in in_network}
+        self.has_set_vehs = {veh_id for veh_id in checkpoint['has_set_vehs'] if veh_id in in_network}
+        for type_id, vehs in checkpoint['active_vehs'].items():
+            self.active_vehs[type_id] = {veh_id: None for veh_id in vehs if veh_id in in_network}
+
+        # V2V communications buffer - with the channel model of this run
+        self.comms = checkpoint['comms']
+        for veh_id in [veh_id for veh_id in self.comms.slots if veh_id not in in_network]:
+            self.comms.remove_veh(veh_id)
+        self.comms.latency, self.comms.jitter, self.comms.loss = self.args.comms_latency, self.args.comms_jitter, self.args.comms_loss
+        self.comms.set_history(min_history(self.comms.latency, self.comms.jitter, self.dt))
+
+        # Controller internals - restored CAVs stay controlled whatever the penetration of this run
+        if self.active_vehs['cav'] and not hasattr(self, 'ego'):
+            self.init_controller()
+        if hasattr(self, 'ego') and checkpoint['controller'] is not None:
+            if hasattr(self.ego, 'set_state'):
+                self.ego.set_state(checkpoint['controller'])
+            else:
+                self.ego = checkpoint['controller']
+
+        # Re-create the per-vehicle TraCI settings that the SUMO state does not hold
+        for veh_id, vehicle_type in self.spawned_vehs.items():
+            if self.use_context_subscriptions:
+                if vehicle_type in ('cav', self.ext_type_id):
+                    self.subscribe_vehicle(veh_id)
+                    self.subscribe_neighbors(veh_id)
+            elif self.use_subscriptions:
+                self.subscribe_vehicle(veh_id)
+
+            if vehicle_type in ('hdv', 'cav'):
+                traci.vehicle.setColor(veh_id, self.colors[vehicle_type])
+
+        for veh_id in self.has_set_vehs:
+            if self.spawned_vehs.get(veh_id) == 'cav':
+                self.set_cav_parameters(veh_id)
+
+        print(f"Loaded checkpoint {path} at t={self.sim_time:.1f}s with {len(self.spawned_vehs)} vehicles (saved with penetration {checkpoint['penetration']:g}).")
+
+    def set_cav_parameters(self, ego_id):
+        """Apply the one-time TraCI settings of a controlled CAV."""
+        traci.vehicle.setSpeedFactor(ego_id, 1.0)
+        traci.vehicle.setSpeedMode(ego_id, int('1100000', 2))
+        traci.vehicle.setLaneChangeMode(ego_id, int('011001010101', 2))
+        traci.vehicle.setColor(ego_id, self.colors['cav'])
+
     def init_vehicle(self, veh_id, route_id="mainlane", type_id="DEFAULT_VEHTYPE"):
         """
         Insert a new vehicle into the network and assign its route/type.
@@ -369,6 +640,10 @@ class simulation():
         params = traci.vehicletype.getParameter(copy_type_id, "maxSpeed")
         max_speed = float(params) if params else 38.0
 
+        # Already registered, e.g. kept by a reset from a state snapshot
+        if new_type_id in traci.vehicletype.getIDList():
+            return
+
         # Create the new type
         traci.vehicletype.copy(copy_type_id, new_type_id)
 
@@ -382,6 +657,89 @@ class simulation():
 
         print(f"  Added new vehicle type '{new_type_id}' with color {color}")
 
+    def subscribe_vehicle(self, veh_id):
+        """
+        Register the one-time variable subscription for a newly spawned vehicle.
+
+        After this call SUMO returns the subscribed values of every vehicle in a
+        single batched response per step, read via `getAllSubscriptionResults()`.
+
+        Parameters
+        ----------
+        veh_id : str
+            Vehicle ID to subscribe.
+        """
+        traci.vehicle.subscribe(veh_id, VEHICLE_SUBSCRIPTION_VARS,
+                                parameters={tc.VAR_LEADER: ("d", RADAR_RANGE)})
+
+    def subscribe_neighbors(self, ego_id):
+        """
+        Register a context subscription around a CAV/EXT so that the states of its
+        neighbors within RADAR_RANGE come back in the same batched step response.
+
+        The context is filtered to the leader and follower on the ego lane and on both
+        adjacent lanes, which keeps the response small in dense traffic.
+
+        Parameters
+        ----------
+        ego_id : str
+            Vehicle ID at the center of the context.
+        """
+        traci.vehicle.subscribeContext(ego_id, tc.CMD_GET_VEHICLE_VARIABLE, RADAR_RANGE, NEIGHBOR_SUBSCRIPTION_VARS)
+        traci.vehicle.addSubscriptionFilterLeadFollow(lanes=[-1, 0, 1])
+        traci.vehicle.addSubscriptionFilterDownstreamDistance(RADAR_RANGE)
+        traci.vehicle.addSubscriptionFilterUpstreamDistance(RADAR_RANGE)
+
+    def get_neighbor_table(self, ego_id):
+        """
+        Return the neighbor table of a CAV/EXT for the current step.
+
+        Returns
+        -------
+        dict
+            Mapping {nv_id: {var_id: value}} of the vehicles in the ego context, excluding the ego itself.
+            Empty when context subscriptions are disabled.
+        """
+        table = self.neighbor_states.get(ego_id)
+        if not table:
+            return {}
+
+        return {nv_id: values for nv_id, values in table.items() if nv_id != ego_id}
+
+    def get_neighbor_value(self, ego_id, nv_id, var_id):
+        """
+        Return a neighbor variable from the ego's context subscription, falling back to
+        `get_vehicle_value` when the neighbor is outside the context.
+        """
+        table = self.neighbor_states.get(ego_id)
+        if table:
+            values = table.get(nv_id)
+            if values is not None and var_id in values:
+                return values[var_id]
+
+        return self.get_vehicle_value(nv_id, var_id)
+
+    def get_vehicle_value(self, veh_id, var_id):
+        """
+        Return a vehicle variable from the current step's subscription snapshot.
+
+        Falls back to the equivalent per-vehicle TraCI getter when subscriptions are
+        disabled (`--no_subscriptions`) or the vehicle is missing from the snapshot.
+
+        Parameters
+        ----------
+        veh_id : str
+            Vehicle ID to query.
+        var_id : int
+            TraCI variable constant, one of `VEHICLE_SUBSCRIPTION_VARS`.
+        """
+        if self.use_subscriptions:
+            values = self.veh_states.get(veh_id)
+            if values is not None and var_id in values:
+                return values[var_id]
+
+        return self.vehicle_getters[var_id](veh_id)
+
     def step_external_vehicles(self, exts:Dict[str,EXT]):
         """
         Advance the XIL portion of the interface for a set of external vehicles.
@@ -396,11 +754,9 @@ class simulation():
             Mapping of external vehicle IDs to `EXT` agent objects.
         """
         # Verify the vehicles exist in the network
-        vehicle_ids = traci.vehicle.getIDList()
-
         for ext in exts.values():
             ego_id = ext.veh_id
-            if ego_id not in vehicle_ids:
+            if ego_id not in self.spawned_vehs:
                 raise ValueError(f'Cannot find external vehicle {ego_id}!')
 
             # Set states for the external vehicle
@@ -422,15 +778,17 @@ class simulation():
 
             # Push V2V trajectory into the communications buffer
             time_traj, pos_traj = ext.states.get_trajectory()
-            self.comms.update_veh_comms(ego_id, time_traj, pos_traj)
+            self.comms.update_veh_comms(ego_id, time_traj, pos_traj, sim_time=self.sim_time)
 
-            # Disable internal car-following and lane-changing behavior
-            traci.vehicle.setSpeedFactor(ego_id, 1.0)
-            traci.vehicle.setSpeedMode(ego_id, int('1100000', 2))
-            traci.vehicle.setLaneChangeMode(ego_id, int('000000000000', 2))
+            # One-time: disable internal car-following and lane-changing behavior
+            if ego_id not in self.has_set_vehs:
+                traci.vehicle.setSpeedFactor(ego_id, 1.0)
+                traci.vehicle.setSpeedMode(ego_id, int('1100000', 2))
+                traci.vehicle.setLaneChangeMode(ego_id, int('000000000000', 2))
 
-            # Visual cue for external vehicles
-            traci.vehicle.setColor(ego_id, self.colors['ext'])
+                # Visual cue for external vehicles
+                traci.vehicle.setColor(ego_id, self.colors['ext'])
+                self.has_set_vehs.add(ego_id)
 
             # Controller/context constraints
             s_max, is_lane_ending = self.get_end_of_lane_distance(ego_id)
@@ -440,17 +798,17 @@ class simulation():
             tl_states = self.get_routewise_upcoming_traffic_light_states(ego_id)
 
             # Leader detection
-            leader = traci.vehicle.getLeader(ego_id, dist=RADAR_RANGE)
+            leader = self.get_vehicle_value(ego_id, tc.VAR_LEADER)
             if leader is not None and leader[0] != "":
                 lead_id = leader[0]                  # "flowID.vehID"
                 lead_rel_distance = leader[1]        # gap from ego front to leader rear (plus minGap)
-                lead_speed = traci.vehicle.getSpeed(lead_id)
-                lead_accel = traci.vehicle.getAcceleration(lead_id)
-                lead_heading = traci.vehicle.getAngle(lead_id)
+                lead_speed = self.get_neighbor_value(ego_id, lead_id, tc.VAR_SPEED)
+                lead_accel = self.get_neighbor_value(ego_id, lead_id, tc.VAR_ACCELERATION)
+                lead_heading = self.get_neighbor_value(ego_id, lead_id, tc.VAR_ANGLE)
                 lead_heading_rate = 0.0
-                lead_x, lead_y = traci.vehicle.getPosition(lead_id)
+                lead_x, lead_y = self.get_neighbor_value(ego_id, lead_id, tc.VAR_POSITION)
                 lead_lat_gap = 0.0
-                lead_type = traci.vehicle.getTypeID(lead_id)
+                lead_type = self.get_neighbor_value(ego_id, lead_id, tc.VAR_TYPE)
                 headway = lead_rel_distance / ego_speed if ego_speed > 0 else 0.0
             else:
                 # Defaults when no leader is present
@@ -474,7 +832,7 @@ class simulation():
             # Pack neighboring-vehicle information for the external agent
             ext.reset_nv_states()
 
-            if lead_type or lead_type != 'None':
+            if lead_id != "-1":
                 ext.update_nv_states(
                     lead_id, lead_y, lead_x, lead_rel_distance, lead_lat_gap,
                     lead_speed, lead_accel, lead_heading, lead_heading_rate
@@ -482,10 +840,90 @@ class simulation():
                 if lead_t_comms:
                     ext.nv_states[lead_id].set_trajectory(times=lead_t_comms, rel_long_pos=lead_s_comms)
 
+            # Follower and adjacent-lane vehicles
+            if getattr(self.args, 'ext_neighbors', 'all') == 'all':
+                for nv_id, rel_long_gap, rel_lat_gap in self.get_surrounding_vehicles(ego_id):
+                    if nv_id == lead_id or nv_id in ext.nv_states:
+                        continue
+
+                    nv_x, nv_y = self.get_neighbor_value(ego_id, nv_id, tc.VAR_POSITION)
+                    ext.update_nv_states(
+                        nv_id, nv_y, nv_x, rel_long_gap, rel_lat_gap,
+                        self.get_neighbor_value(ego_id, nv_id, tc.VAR_SPEED),
+                        self.get_neighbor_value(ego_id, nv_id, tc.VAR_ACCELERATION),
+                        self.get_neighbor_value(ego_id, nv_id, tc.VAR_ANGLE),
+                        0.0
+                    )
+
             # Periodic debug print
             if abs(fmod(self.sim_time, 10)) < 1e-6:
                 print(f"  Ext: {ego_id}, Leader: {lead_id}, Gap: {lead_rel_distance:.2f} m, Headway: {headway:.2f} s")
 
+    def get_surrounding_vehicles(self, ego_id):
+        """
+        Return the follower and the adjacent-lane leaders/followers of a vehicle within RADAR_RANGE.
+
+        With context subscriptions these are read from the ego's neighbor table, whose lead/follow
+        filter holds the same vehicles, otherwise they are queried with the TraCI getters.
+
+        Returns
+        -------
+        list[tuple[str, float, float]]
+            (veh_id, rel_long_gap, rel_lat_gap) with rel_long_gap [m] negative behind the ego and
+            rel_lat_gap [m] positive for the lane to the left.
+        """
+        if self.neighbor_states.get(ego_id):
+            return self.get_surrounding_vehicles_from_context(ego_id)
+
+        surrounding = []
+
+        follower = traci.vehicle.getFollower(ego_id, dist=RADAR_RANGE)
+        if follower is not None and follower[0] != "":
+            surrounding.append((follower[0], -follower[1], 0.0))
+
+        for get_neighbors, rel_lat_gap, sign in (
+            (traci.vehicle.getLeftLeaders, LANEWIDTH, 1.0),
+            (traci.vehicle.getRightLeaders, -LANEWIDTH, 1.0),
+            (traci.vehicle.getLeftFollowers, LANEWIDTH, -1.0),
+            (traci.vehicle.getRightFollowers, -LANEWIDTH, -1.0),
+        ):
+            for nv_id, gap in get_neighbors(ego_id):
+                if abs(gap) <= RADAR_RANGE:
+                    surrounding.append((nv_id, sign*gap, rel_lat_gap))
+
+        return surrounding
+
+    def get_surrounding_vehicles_from_context(self, ego_id):
+        """
+        Return `get_surrounding_vehicles` from the ego's context subscription.
+
+        The neighbors are placed relative to the ego from their front-bumper positions: the gap
+        between the bumpers along the ego heading, and the lateral offset rounded to a lane.
+        """
+        ego_x, ego_y = self.get_vehicle_value(ego_id, tc.VAR_POSITION)
+        heading = self.get_vehicle_value(ego_id, tc.VAR_ANGLE) * (pi / 180.0)  # [rad] clockwise from north
+        ego_length = self.get_neighbor_value(ego_id, ego_id, tc.VAR_LENGTH)
+
+        surrounding = []
+        for nv_id, values in self.get_neighbor_table(ego_id).items():
+            nv_x, nv_y = values[tc.VAR_POSITION]
+            dx, dy = nv_x - ego_x, nv_y - ego_y
+            rel_long_pos = dx*sin(heading) + dy*cos(heading)
+            lane_offset = round((dy*sin(heading) - dx*cos(heading)) / LANEWIDTH)
+
+            # The leader on the ego lane is read from VAR_LEADER by the caller
+            if abs(lane_offset) > 1 or (lane_offset == 0 and rel_long_pos > 0):
+                continue
+
+            if rel_long_pos > 0:
+                gap = rel_long_pos - self.get_neighbor_value(ego_id, nv_id, tc.VAR_LENGTH)
+            else:
+                gap = rel_long_pos + ego_length
+            if abs(gap) <= RADAR_RANGE:
+                surrounding.append((nv_id, gap, lane_offset*LANEWIDTH))
+
+        return surrounding
+
     def step_replay_vehicle(self, veh_id, veh_type, x, y, speed, heading, acceleration):
         """
         Advance the "replay" vehicle to the given state (position, heading, speed)
@@ -506,11 +944,9 @@ class simulation():
             Longitudinal acceleration [m/s^2].
         """
         # Ensure the vehicle exists
-        vehicle_ids = traci.vehicle.getIDList()
-
         ego_id = veh_id
-        # if ego_id not in vehicle_ids:
-        #     print(vehicle_ids)
+        # if ego_id not in self.spawned_vehs:
+        #     print(list(self.spawned_vehs))
         #     raise ValueError(f'Cannot find replay vehicle {ego_id}!')
 
         # State to apply
@@ -557,11 +993,11 @@ class simulation():
 
         # Road-geometry example for the 'onramp' scenario
         if self.args.scenario == 'onramp':
-            lane_id = traci.vehicle.getLaneID(ego_id)
+            lane_id = self.get_vehicle_value(ego_id, tc.VAR_LANE_ID)
 
             if self.is_on_onramp(lane_id):  # Hard-coded for this scenario
                 link_length = traci.lane.getLength(lane_id)
-                link_distance = traci.vehicle.getLanePosition(ego_id)
+                link_distance = self.get_vehicle_value(ego_id, tc.VAR_LANEPOSITION)
 
                 s_max = link_length - link_distance
                 is_lane_ending = True
@@ -610,6 +1046,119 @@ class simulation():
         """
         return ego_lane_id == 'E2_0'  # TODO: make lane filtering more robust
 
+    def build_tl_metadata(self, tl_id):
+        """
+        Fetch and cache the static signal program of a traffic light.
+
+        The cache holds everything the per-step traffic-light queries need apart from
+        the current phase, so those queries reduce to a phase lookup and dict indexing.
+        It is filled once per `tl_id` at load time and rebuilt on a program switch.
+
+        Parameters
+        ----------
+        tl_id : str
+            Traffic light ID.
+
+        Returns
+        -------
+        dict or None
+            The cached metadata, or None if the traffic light has no program logic.
+        """
+        logics = traci.trafficlight.getAllProgramLogics(tl_id)
+        if not logics:
+            warnings.warn(f"No Traffic light logic set for id {tl_id}?")
+            self.tl_metadata[tl_id] = None
+            return None
+
+        # Logic of the running program, e.g. after a switch from the default program
+        program = traci.trafficlight.getProgram(tl_id)
+        logic = next((logic for logic in logics if logic.programID == program), logics[0])
+
+        # Controlled links as edge IDs, in controller link order
+        tl_controlled_links = []
+        lane_format_error = None  # Raised only by the route-wise query that relies on the lane format
+        for lane in traci.trafficlight.getControlledLanes(tl_id):
+            split = lane.split('_')
+            tl_controlled_links.append(split[0])
+            if len(split) > 2 and lane_format_error is None:
+                lane_format_error = f'TL Lane ID found as {lane}. Was expecting a format with one underscore <>_<>?'
+
+        # First controller link index of each controlled edge
+        link_index_by_edge = {}
+        for i, link in enumerate(tl_controlled_links):
+            link_index_by_edge.setdefault(link, i)
+
+        phases = []
+        for phase in logic.phases:
+            is_turning = phase.name in ('2', '4', '6', '8')
+            phases.append({
+                "phase_state": phase.state,
+                "cycle_duration": phase.duration,
+                "min_duration": phase.minDur,
+                "max_duration": phase.maxDur,
+                "phase_name": phase.name,
+                # Heuristics for yellow/red duration when not directly available
+                "yellow_guess": 3,
+                "red_guess": 2 if is_turning else 0,
+            })
+
+        # Phase sequences starting at each current phase index
+        n_phases = len(phases)
+        next_states_by_phase = [
+            {i: phases[(current_phase_i + i) % n_phases] for i in range(n_phases)}
+            for current_phase_i in range(n_phases)
+        ]
+
+        self.tl_metadata[tl_id] = {
+            "program": program,
+            "cycle_time": traci.trafficlight.getParameter(tl_id, "cycleTime"),
+            "offset": traci.trafficlight.getParameter(tl_id, "offset"),
+            "ring1": logic.getParameter('ring1'),
+            "ring2": logic.getParameter('ring2'),
+            "controlled_links": tl_controlled_links,
+            "lane_format_error": lane_format_error,
+            "controlled_edges": frozenset(tl_controlled_links),
+            "link_index_by_edge": link_index_by_edge,
+            "states_match_links": all(len(phase["phase_state"]) == len(tl_controlled_links) for phase in phases),
+            "next_states_by_phase": next_states_by_phase,
+        }
+
+        # Route membership lookups depend on the controlled links
+        for key in [key for key in self.tl_route_link_index if key[0] == tl_id]:
+            del self.tl_route_link_index[key]
+
+        return self.tl_metadata[tl_id]
+
+    def get_tl_phase(self, tl_id):
+        """
+        Return (metadata, current phase index) for a traffic light at the current step.
+
+        The phase and program are read from the traffic-light subscription snapshot, or
+        fetched once per step when subscriptions are disabled. A change of the running
+        program triggers a rebuild of the cached metadata.
+        """
+        values = self.tl_phases.get(tl_id)
+        if values is None:
+            values = {
+                tc.TL_CURRENT_PHASE: traci.trafficlight.getPhase(tl_id),
+                tc.TL_CURRENT_PROGRAM: traci.trafficlight.getProgram(tl_id),
+            }
+            self.tl_phases[tl_id] = values
+
+        metadata = self.tl_metadata.get(tl_id)
+        if tl_id not in self.tl_metadata or (metadata is not None and metadata["program"] != values[tc.TL_CURRENT_PROGRAM]):
+            metadata = self.build_tl_metadata(tl_id)
+
+        return metadata, values[tc.TL_CURRENT_PHASE]
+
+    def get_tl_next_states(self, metadata, current_phase_i):
+        """Return the next phase descriptors of a traffic light from its current phase index, wrapped to the program length."""
+        next_states_by_phase = metadata["next_states_by_phase"]
+        if not next_states_by_phase:
+            return {}
+
+        return next_states_by_phase[current_phase_i % len(next_states_by_phase)]
+
     def get_upcoming_traffic_light_states(self, ego_id):
         """
         Retrieve upcoming traffic-light states near the ego vehicle (within CONN_RANGE),
@@ -640,49 +1189,21 @@ class simulation():
             if distance > CONN_RANGE:
                 continue
 
-            # Basic parameters (may be None depending on program configuration)
-            cycle_time = traci.trafficlight.getParameter(tl_id, "cycleTime")
-            offset = traci.trafficlight.getParameter(tl_id, "offset")
-
-            logics = traci.trafficlight.getAllProgramLogics(tl_id)
-            current_phase_i = traci.trafficlight.getPhase(tl_id)
-
-            if logics:
-                logic = logics[0]  # default program
-                ring1 = logic.getParameter('ring1')
-                ring2 = logic.getParameter('ring2')
-
-                n_phases = len(logic.phases)
-                next_states = {}
-                for i in range(n_phases):
-                    phase_index = (current_phase_i + i) % n_phases
-                    name = logic.phases[phase_index].name
-                    is_turning = name in ('2', '4', '6', '8')
-
-                    next_states[i] = {
-                        "phase_state": logic.phases[phase_index].state,
-                        "cycle_duration": logic.phases[phase_index].duration,
-                        "min_duration": logic.phases[phase_index].minDur,
-                        "max_duration": logic.phases[phase_index].maxDur,
-                        "phase_name": logic.phases[phase_index].name,
-                        # Heuristics for yellow/red duration when not directly available
-                        "yellow_guess": 3,
-                        "red_guess": 2 if is_turning else 0
-                    }
+            # Cached program (cycle time and offset may be None depending on program configuration)
+            metadata, current_phase_i = self.get_tl_phase(tl_id)
 
+            if metadata is not None:
                 traffic_light_states[tl_id] = {
                     "sim_time": self.sim_time,
-                    "cycle_time": cycle_time,
-                    "offset": offset,
+                    "cycle_time": metadata["cycle_time"],
+                    "offset": metadata["offset"],
                     "distance_to_current_tl": distance,
                     "current_state": current_state,
-                    "next_states": next_states,
-                    "ring1": ring1,
-                    "ring2": ring2,
+                    "next_states": self.get_tl_next_states(metadata, current_phase_i),
+                    "ring1": metadata["ring1"],
+                    "ring2": metadata["ring2"],
                     "link_index": -1,
                 }
-            else:
-                warnings.warn(f"No Traffic light logic set for id {tl_id}?")
 
         return traffic_light_states
 
@@ -721,125 +1242,144 @@ class simulation():
             if distance > CONN_RANGE:
                 continue
 
-            logics = traci.trafficlight.getAllProgramLogics(tl_id)
-            current_phase_i = traci.trafficlight.getPhase(tl_id)
-
-            if logics:
-                logic = logics[0]
-                tl_controlled_links = []
-
-                tl_controlled_lanes = traci.trafficlight.getControlledLanes(tl_id)
-                for lane in tl_controlled_lanes:
-                    split = lane.split('_')
-                    tl_controlled_links.append(split[0])
-                    if len(split) > 2:
-                        raise ValueError(f'TL Lane ID found as {lane}. Was expecting a format with one underscore <>_<>?')
-
-                # Keep only the lanes present in the ego's planned route
-                active_links = [link for link in tl_controlled_links if link in ego_planned_route]
-                if not active_links:
-                    raise ValueError("No active lanes?")
-
-                link_index = tl_controlled_links.index(active_links[0])
-
-                ring1 = logic.getParameter('ring1')
-                ring2 = logic.getParameter('ring2')
-
-                n_phases = len(logic.phases)
-                next_states = {}
-                for i in range(n_phases):
-                    phase_index = (current_phase_i + i) % n_phases
-                    name = logic.phases[phase_index].name
-                    is_turning = name in ('2', '4', '6', '8')
-
-                    next_states[i] = {
-                        "phase_state": logic.phases[phase_index].state,
-                        "cycle_duration": logic.phases[phase_index].duration,
-                        "min_duration": logic.phases[phase_index].minDur,
-                        "max_duration": logic.phases[phase_index].maxDur,
-                        "phase_name": logic.phases[phase_index].name,
-                        "yellow_guess": 3,
-                        "red_guess": 2 if is_turning else 0,
-                    }
-
-                    # Sanity checks
-                    if not len(logic.phases[phase_index].state) == len(tl_controlled_links):
-                        raise ValueError('Phase state length does not match number of controlled links.')
-                    elif not link_index and link_index != 0:
-                        raise ValueError('Invalid link index computed.')
+            metadata, current_phase_i = self.get_tl_phase(tl_id)
+
+            if metadata is not None:
+                if metadata["lane_format_error"]:
+                    raise ValueError(metadata["lane_format_error"])
+
+                # First controlled link present in the ego's planned route
+                key = (tl_id, tuple(ego_planned_route))
+                link_index = self.tl_route_link_index.get(key)
+                if link_index is None:
+                    active_links = metadata["controlled_edges"].intersection(ego_planned_route)
+                    if not active_links:
+                        raise ValueError("No active lanes?")
+
+                    link_index = min(metadata["link_index_by_edge"][link] for link in active_links)
+                    self.tl_route_link_index[key] = link_index
+
+                # Sanity checks
+                if not metadata["states_match_links"]:
+                    raise ValueError('Phase state length does not match number of controlled links.')
 
                 traffic_light_states[tl_id] = {
                     "sim_time": self.sim_time,
                     "distance_to_current_tl": distance,
                     "current_state": current_state,
-                    "next_states": next_states,
-                    "ring1": ring1,
-                    "ring2": ring2,
+                    "next_states": self.get_tl_next_states(metadata, current_phase_i),
+                    "ring1": metadata["ring1"],
+                    "ring2": metadata["ring2"],
                     "link_index": link_index,
                 }
-            else:
-                warnings.warn(f"No Traffic light logic set for id {tl_id}?")
 
         return traffic_light_states
 
     def step(self):
         """Advance the simulation by one TraCI step and run CAV control logic for vehicles of type 'cav'."""
+        timer = self.timer
+        timer.start_step()
+
         # Run one simulation step
         traci.simulationStep()
 
         # Update simulation time
         self.sim_time = traci.simulation.getTime()
+        timer.lap('simulationStep')
+
+        # Vehicles that entered and left the network during this step
+        if self.use_sim_subscription:
+            sim_states = traci.simulation.getSubscriptionResults()
+            departed_ids = sim_states[tc.VAR_DEPARTED_VEHICLES_IDS]
+            arrived_ids = sim_states[tc.VAR_ARRIVED_VEHICLES_IDS]
+        else:
+            departed_ids = traci.simulation.getDepartedIDList()
+            arrived_ids = traci.simulation.getArrivedIDList()
+
+        # Read all subscribed vehicle variables for this step in one call
+        if self.use_subscriptions:
+            self.veh_states = traci.vehicle.getAllSubscriptionResults()
 
-        # Current vehicles in network
-        vehicle_ids = traci.vehicle.getIDList()
+        if self.use_context_subscriptions:
+            self.neighbor_states = traci.vehicle.getAllContextSubscriptionResults()
+
+        # Current traffic-light phases, otherwise fetched on first use this step
+        if self.use_subscriptions:
+            self.tl_phases = traci.trafficlight.getAllSubscriptionResults()
+        else:
+            self.tl_phases = {}
 
         # Track newly spawned vehicles
-        for id in vehicle_ids:
-            if id not in self.spawned_vehs:
+        for id in departed_ids:
+            if self.use_context_subscriptions:
+                # Only CAV/EXT vehicles are subscribed - neighbor states come from their context
                 vehicle_type = traci.vehicle.getTypeID(id)
-                self.spawned_vehs[id] = vehicle_type
-                # One-time: color HDVs on spawn so they use the configured palette
-                if vehicle_type == 'hdv':
-                    traci.vehicle.setColor(id, self.colors['hdv'])
-                elif vehicle_type == 'cav':
-                    traci.vehicle.setColor(id, self.colors['cav'])
-
-        # Optionally keep only currently active vehicles
-        for id in list(self.spawned_vehs.keys()):
-            if id not in vehicle_ids:
-                del self.spawned_vehs[id]
+                if vehicle_type in ('cav', self.ext_type_id):
+                    self.subscribe_vehicle(id)
+                    self.subscribe_neighbors(id)
+            else:
+                if self.use_subscriptions:
+                    self.subscribe_vehicle(id)  # Subscription response is added to this step's snapshot
+                vehicle_type = self.get_vehicle_value(id, tc.VAR_TYPE)
+            self.spawned_vehs[id] = vehicle_type
+            self.active_vehs.setdefault(vehicle_type, {})[id] = None
+            # One-time: color HDVs on spawn so they use the configured palette
+            if vehicle_type == 'hdv':
+                traci.vehicle.setColor(id, self.colors['hdv'])
+            elif vehicle_type == 'cav':
+                traci.vehicle.setColor(id, self.colors['cav'])
+                if not hasattr(self, 'ego'):
+                    # CAVs still pending insertion in a loaded SUMO state
+                    self.init_controller()
+
+        # Keep only currently active vehicles
+        for id in arrived_ids:
+            vehicle_type = self.spawned_vehs.pop(id, None)
+            if vehicle_type is not None:
+                self.active_vehs[vehicle_type].pop(id, None)
+            self.has_set_vehs.discard(id)
+            self.comms.remove_veh(id)
+        timer.lap('bookkeeping')
 
         # Run the virtual CAV controller for vehicles labeled 'cav'
-        type_gen = (ego_id for ego_id, vtype in self.spawned_vehs.items() if vtype == 'cav')
+        # Controller inputs are gathered for all CAVs first, evaluated in batches by dependency level, then applied
+        ego_ids, lead_ids, headways = [], [], []
+        n_cav = len(self.active_vehs['cav'])
+        ego_states = np.empty((n_cav, len(EGO_STATES)))
+        leader_states = np.empty((n_cav, len(LEADER_STATES)))
 
-        for ego_id in type_gen:
+        for ego_id in self.active_vehs['cav']:
             # Controller constraints: end-of-lane distance
             s_max, is_lane_onramp = self.get_end_of_lane_distance(ego_id)
 
             if is_lane_onramp:
                 # If on ramp, let the internal model handle it; keep CAV color consistent
+                timer.lap('lane_queries')
                 traci.vehicle.setColor(ego_id, self.colors['cav'])
+                timer.lap('setters')
                 continue
 
             # Effective speed limit
             v_max = self.get_lane_speed_limit(ego_id)
+            timer.lap('lane_queries')
 
             # Upcoming traffic signals along route
             tl_states = self.get_routewise_upcoming_traffic_light_states(ego_id)
+            timer.lap('tl_queries')
 
             # Ego kinematics
             ego_distance = 0.0  # placeholder; could use traci.vehicle.getDistance(ego_id)
-            ego_speed = traci.vehicle.getSpeed(ego_id)
-            ego_accel = traci.vehicle.getAcceleration(ego_id)
+            ego_speed = self.get_vehicle_value(ego_id, tc.VAR_SPEED)
+            ego_accel = self.get_vehicle_value(ego_id, tc.VAR_ACCELERATION)
 
             # Preceding vehicle
-            leader = traci.vehicle.getLeader(ego_id, dist=RADAR_RANGE)
+            leader = self.get_vehicle_value(ego_id, tc.VAR_LEADER)
             if leader is not None and leader[0] != "":
                 lead_id = leader[0]
                 lead_rel_distance = leader[1]
-                lead_speed = traci.vehicle.getSpeed(lead_id)
-                lead_accel = traci.vehicle.getAcceleration(lead_id)
-                lead_type = traci.vehicle.getTypeID(lead_id)
+                lead_speed = self.get_neighbor_value(ego_id, lead_id, tc.VAR_SPEED)
+                lead_accel = self.get_neighbor_value(ego_id, lead_id, tc.VAR_ACCELERATION)
+                lead_type = self.get_neighbor_value(ego_id, lead_id, tc.VAR_TYPE)
                 headway = lead_rel_distance / ego_speed if ego_speed > 0 else 0
             else:
                 lead_id = "-1"
@@ -848,40 +1388,42 @@ class simulation():
                 lead_accel = 0.0
                 lead_type = 'None'
                 headway = -1
-
-            # V2V info for the leader
-            lead_t_comms, lead_s_comms, lead_v_comms = self.comms.get_veh_comms(
-                lead_id, self.sim_time, distance_from_sv=lead_rel_distance
-            )
-
-            # Query the controller
-            desired_acceleration, time_traj, pos_traj, vel_traj, acc_traj = self.ego.getCommand(
-                self.sim_time, ego_accel, ego_speed, ego_distance, s_max, v_max,
-                lead_accel, lead_speed, lead_rel_distance,
-                lead_t_comms, lead_s_comms, lead_v_comms
-            )
-
-            # Update V2V broadcast for the ego
-            self.comms.update_veh_comms(ego_id, time_traj, pos_traj, vel_traj)
-
+            timer.lap('leader_queries')
+
+            # Gather controller inputs
+            i = len(ego_ids)
+            ego_ids.append(ego_id)
+            lead_ids.append(lead_id)
+            headways.append(headway)
+            ego_states[i] = ego_accel, ego_speed, ego_distance, s_max, v_max
+            leader_states[i] = lead_accel, lead_speed, lead_rel_distance
+
+        # Query the controller once per dependency level - followers read the broadcasts of their CAV leaders from this step
+        n = len(ego_ids)
+        desired_accelerations, time_trajs, pos_trajs, vel_trajs, acc_trajs = evaluate_commands(
+            self.ego, self.sim_time, ego_ids, lead_ids, ego_states[:n], leader_states[:n], self.comms, timer=timer
+        ) if n else ([], [], [], [], [])
+
+        # Apply the commands in one pass
+        acc_duration = 1.0 # 3.64   [s] internal low-pass "propagation" time for realized acceleration
+        set_acceleration = traci.vehicle.setAcceleration
+
+        for i, ego_id in enumerate(ego_ids):
             # One-time vehicle parameters
             if ego_id not in self.has_set_vehs:
-                traci.vehicle.setSpeedFactor(ego_id, 1.0)
-                traci.vehicle.setSpeedMode(ego_id, int('1100000', 2))
-                traci.vehicle.setLaneChangeMode(ego_id, int('011001010101', 2))
-                traci.vehicle.setColor(ego_id, self.colors['cav'])
-                self.has_set_vehs.append(ego_id)
+                self.set_cav_parameters(ego_id)
+                self.has_set_vehs.add(ego_id)
 
             # Apply longitudinal command
-            acc_duration = 1.0 # 3.64   [s] internal low-pass "propagation" time for realized acceleration
-            traci.vehicle.setAcceleration(ego_id, desired_acceleration, acc_duration)
+            set_acceleration(ego_id, float(desired_accelerations[i]), acc_duration)
 
             # Optional per-step debug
             if self.args.debug:
-                print(f"Time: {self.sim_time:.2f}, Vehicle: {ego_id}, Leader: {lead_id}, Gap: {lead_rel_distance:.2f} m, Headway: {headway:.2f} s")
+                print(f"Time: {self.sim_time:.2f}, Vehicle: {ego_id}, Leader: {lead_ids[i]}, Gap: {leader_states[i, 2]:.2f} m, Headway: {headways[i]:.2f} s")
+        timer.lap('setters')
 
         # Example: set others to 'ghost' color if needed
-        # for ego_id in vehicle_ids:
+        # for ego_id in self.spawned_vehs:
         #     traci.vehicle.setColor(ego_id, self.colors['ghost'])
 
         # Periodic heartbeat
@@ -890,8 +1432,7 @@ class simulation():
 
         # HDV debugging (kept as-is)
         if self.args.debug:
-            type_gen = (ego_id for ego_id in vehicle_ids if traci.vehicle.getTypeID(ego_id) == 'hdv')
-            for ego_id in type_gen:
+            for ego_id in self.active_vehs['hdv']:
                 leader = traci.vehicle.getLeader(ego_id)
                 if leader is not None and leader[0] == "ext_2":
                     lead_id = leader[0]
@@ -901,6 +1442,8 @@ class simulation():
                     lead_type = traci.vehicle.getTypeID(lead_id)
                     print(f"Time: {self.sim_time:.2f}, Vehicle: {ego_id}, Gap: {lead_rel_distance:.2f} m, PV Vel: {lead_speed:.2f}, PV Acc: {lead_accel:.2f}")
 
+        timer.end_step()
+
     def rate(self):
         """
         Honor the requested real-time step rate (if `--realtime` is enabled) by sleeping
@@ -936,7 +1479,14 @@ class simulation():
 
         The loop periodically prints RTF (real-time factor) and small telemetry
         to help monitor performance.
+
+        Returns the reason the loop ended, also kept in `self.termination`: 'natural',
+        'wall_guard', 'sim_guard', 'interrupted' or 'error'. On 'error' the exception
+        text is kept in `self.termination_error`.
         """
+        self.termination = None
+        self.termination_error = None
+
         # If not provided externally, fall back to args (if present, else None)
         if max_wall_time is None and hasattr(self.args, 'max_wall_time'):
             max_wall_time = self.args.max_wall_time
@@ -964,27 +1514,16 @@ class simulation():
                 except Exception:
                     planned_end = None
 
-                # 2) Fallback: infer from the generated route file by scanning <flow>/<vehicle>
+                # 2) Fallback: planned end inferred when the route file was generated (stored in its sidecar)
+                if planned_end is None:
+                    planned_end = getattr(self, "route_planned_end", None)
+
+                # 3) Fallback: infer from the route file by scanning <flow>/<vehicle>
                 if planned_end is None:
                     route_path = getattr(self, "route_file", None)
                     if route_path and os.path.exists(route_path):
                         try:
-                            tree = ET.parse(route_path)
-                            root = tree.getroot()
-                            max_end = 0.0
-                            for flow in root.iter('flow'):
-                                end_attr = flow.get('end')
-                                begin_attr = flow.get('begin')
-                                if end_attr is not None:
-                                    max_end = max(max_end, float(end_attr))
-                                elif begin_attr is not None:
-                                    max_end = max(max_end, float(begin_attr))
-                            for veh in root.iter('vehicle'):
-                                dep = veh.get('depart')
-                                if dep is not None:
-                                    max_end = max(max_end, float(dep))
-                            if max_end > 0:
-                                planned_end = max_end
+                            planned_end = reader.infer_planned_end(ET.parse(route_path).getroot())
                         except Exception as e:
                             print(f"[WARN] failed to infer planned end from route file: {e}")
 
@@ -1006,8 +1545,12 @@ class simulation():
                     use_wall_guard = False
 
             # ---------- Main loop ----------
+            # RTF and periodic summaries are measured from the start time, which is not 0 when restored from a checkpoint
+            sim_start = traci.simulation.getTime()
             debug_dump_interval = 10.0
-            next_dump = 0.0
+            next_dump = sim_start
+
+            checkpoint_time = self.args.save_checkpoint
 
             print("Starting SUMO simulation.")
             while True:
@@ -1016,10 +1559,15 @@ class simulation():
                 sim_time = traci.simulation.getTime()
                 min_expected = traci.simulation.getMinExpectedNumber()
 
+                # Save a warm-start checkpoint once the requested time is reached
+                if checkpoint_time is not None and sim_time >= checkpoint_time:
+                    self.save_checkpoint(os.path.join(self.output_dir, f"checkpoint_{self.penetration_tag}_t{checkpoint_time:g}"))
+                    checkpoint_time = None
+
                 # Periodic summary (incl. RTF)
                 if sim_time >= next_dump:
                     wall_elapsed = time.perf_counter() - wall_start
-                    rtf = sim_time / max(wall_elapsed, 1e-9)
+                    rtf = (sim_time - sim_start) / max(wall_elapsed, 1e-9)
                     inNet = len(traci.vehicle.getIDList())
                     loaded = len(traci.vehicle.getLoadedIDList())
                     tele = len(traci.vehicle.getTeleportingIDList())
@@ -1030,6 +1578,7 @@ class simulation():
                 # Guard #1: natural end
                 if min_expected == 0:
                     print("[INFO] getMinExpectedNumber()==0 -> All vehicles have been processed. Simulation complete.")
+                    self.termination = 'natural'
                     break
 
                 # Guard #2: wall clock
@@ -1037,11 +1586,13 @@ class simulation():
                     wall_elapsed = time.perf_counter() - wall_start
                     if wall_elapsed >= max_wall_time:
                         print(f"[WARN] wall-clock exceeded {max_wall_time:.1f}s (elapsed={wall_elapsed:.1f}s) -> forcing stop")
+                        self.termination = 'wall_guard'
                         break
 
                 # Guard #3: simulation clock
                 if guard_limit is not None and sim_time >= guard_limit:
                     print(f"[WARN] sim_time reached guard {guard_limit:.1f}s -> forcing stop")
+                    self.termination = 'sim_guard'
                     break
 
                 # Respect --realtime if enabled
@@ -1049,11 +1600,16 @@ class simulation():
 
         except KeyboardInterrupt:
             print("[INFO] KeyboardInterrupt, exiting sim loop")
+            self.termination = 'interrupted'
         except Exception as e:
             print(f"[ERROR] Unexpected simulation error {str(e)}")
+            self.termination = 'error'
+            self.termination_error = str(e)
         finally:
             self.stop()
 
+        return self.termination
+
 # -------------------------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
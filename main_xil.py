@@ -14,20 +14,23 @@ import warnings
 import argparse
 import traceback
 from math import atan2, pi, fmod
-from time import perf_counter as counter, sleep
+from time import perf_counter as counter
 
 from main import simulation
 
 from src.agents import EXT
 from src.settings import *
 from src.xil_server import UDPServer
+from xil_async_server import AsyncUDPServer
+from xil_telemetry import XILTelemetry
+from xil_wire import NeighborPublisher
 from src.messages import BSM, SPAT, SIM
 
 import parsers.xil
 import parsers.server
 import parsers.sumo
 
-from traci import TraCIException
+from sumo_backend import traci
 
 MAX_N_RESETS = 10
 RESETS = 0
@@ -45,7 +48,7 @@ class sumoWrapper():
         - Initializes an empty dictionary for tracking external vehicles.
         - Sets up the SUMO microsimulation framework.
         - Configures a UDP server to handle messages from connected clients.
-        - Ensures only a single external client is supported in this implementation.
+        - Supports any number of external clients, each placing one external vehicle.
         '''
 
         ### Handle input arguments
@@ -60,32 +63,66 @@ class sumoWrapper():
         self.args.timestamp_output = True
 
         ### Ego vehicle/light states and controls
-        # Object placed into microsimulation framework
+        # Objects placed into microsimulation framework, one per client address
         self.exts = {}
+        self.ext_clients = {}  # {veh_id: client} owner of each external vehicle ID
 
         ### Microsimulation
         self.microsim = simulation(args=self.args)
 
         ### Set up server to listen for multiple client messages
-        self.server = UDPServer(server_ip=self.args.server_ip, server_port=self.args.server_port, framerate=self.args.framerate, is_debugging=self.args.debug)
+        if self.args.async_server:
+            self.server = AsyncUDPServer(server_ip=self.args.server_ip, server_port=self.args.server_port, framerate=self.args.framerate, is_debugging=self.args.debug)
+        else:
+            self.server = UDPServer(server_ip=self.args.server_ip, server_port=self.args.server_port, framerate=self.args.framerate, is_debugging=self.args.debug)
+
+        ### Neighbor broadcast stage - batched datagrams need the asyncio server
+        self.neighbor_publisher = None
+        if self.args.async_server:
+            self.neighbor_publisher = NeighborPublisher(self.server.wire, delta=self.args.neighbor_delta, keyframe_interval=self.args.keyframe_interval)
+        elif self.args.neighbor_delta:
+            warnings.warn('--neighbor_delta requires --async_server. Sending full neighbor BSMs.')
+
+        ### Latency/jitter telemetry
+        self.telemetry = XILTelemetry(period=1./self.args.framerate) if self.args.telemetry else None
+        if self.telemetry is not None and hasattr(self.server, 'telemetry'):
+            self.server.telemetry = self.telemetry
+        self.client_utc_times = {}  # {client_ip: send time of the latest BSM} echoed back for round-trip latency
+
+        ### Lockstep frame counter - the last frame published to the clients
+        self.frame = 0
+        self.frame_neighbors = {}  # {client_ip: neighbor datagrams sent for the frame}
 
         ### Error Check
-        assert self.args.num_clients == 1, 'Only support 1 Num exts currently.'
+        assert self.args.num_clients >= 1, 'Need at least 1 client.'
+        assert not self.args.lockstep or self.args.async_server, 'Lockstep mode requires --async_server.'
 
     def reset(self):
         '''
-        Resets the microsimulation and communication server.
+        Resets the microsimulation in place for a new run with the same clients.
+        - Reloads the SUMO scenario in the running SUMO instance, see simulation.reset.
+        - Keeps the UDP server sockets and the client registry alive.
+        - Clears the external vehicles, which are re-created from the next client BSMs.
         '''
 
-        if self.server.is_running():
-            self.publish_status(SIM.SimStatus.RESET.value)
-            self.server.stop()
+        self.publish_status(SIM.SimStatus.RESET.value)
 
-        self.microsim.stop()
+        self.microsim.reset()
 
-        # Restart
-        sleep(5)
-        main()
+        # External vehicles and the per-client state of the previous run
+        self.frame = 0
+        self.frame_neighbors = {}
+        self.exts = {}
+        self.ext_clients = {}
+        self.client_utc_times = {}
+
+        if self.neighbor_publisher is not None:
+            for client in list(self.neighbor_publisher.last_sent):
+                self.neighbor_publisher.forget(client)
+
+        # Drop the stale BSMs and RESET statuses so the clients are waited for again
+        if hasattr(self.server, 'clear_data'):
+            self.server.clear_data()
 
     def stop(self):
         ''' 
@@ -100,6 +137,9 @@ class sumoWrapper():
 
         self.microsim.stop()
 
+        if self.telemetry is not None:
+            self.telemetry.export(self.microsim.output_dir, 'xil_telemetry_server')
+
     def wait(self):
         ''' 
         Waits for expected clients to connect before beginning the simulation.
@@ -126,10 +166,14 @@ class sumoWrapper():
 
         self.publish_status(SIM.SimStatus.RUNNING.value)
 
+        if self.args.lockstep:
+            self.publish_frame(self.frame)
+
     def update_exts(self):
         ''' 
         Retrieves external vehicle motion data from connected clients and updates their state in the simulation.
         - Requests motion data from all connected clients.
+        - Routes each BSM to the external vehicle of the client address it came from.
         - Initializes new external vehicles if they are not already tracked.
         - Updates existing external vehicle states with received data.
         - Warns about error flags received from clients.
@@ -157,8 +201,22 @@ class sumoWrapper():
             rel_long_pos = data['path_intentions_rel_long_pos']
             rel_lat_pos = data['path_intentions_rel_lat_pos']
 
+            # Age of the BSM when integrated into the microsim step
+            self.client_utc_times[client_ip] = current_utc_time
+            if self.telemetry is not None:
+                self.telemetry.record_message(f'{client_ip}:step', current_utc_time)
+
             # Update external vehicle 
-            if client_ip not in self.exts.keys():
+            if client_ip not in self.exts:
+                # Vehicle IDs must be unique in the network - suffix IDs already owned by another client
+                if id in self.ext_clients:
+                    n = len(self.exts)
+                    while f'{id}_{n}' in self.ext_clients:
+                        n += 1
+                    warnings.warn(f'Client {client_ip} uses the ID {id} of client {self.ext_clients[id]}. Renaming to {id}_{n}.')
+                    id = f'{id}_{n}'
+                self.ext_clients[id] = client_ip
+
                 self.exts[client_ip] = EXT() # Make new vehicle associated with this client id
                 self.exts[client_ip].veh_id = id
 
@@ -166,7 +224,8 @@ class sumoWrapper():
                 ext = self.exts[client_ip]
                 self.microsim.init_vehicle(ext.veh_id, route_id=ext.route_id, type_id=ext.type_id)
 
-                self.microsim.set_camera(ext.veh_id, 650)
+                if len(self.exts) == 1: # Follow the first external vehicle
+                    self.microsim.set_camera(ext.veh_id, 650)
             
             self.exts[client_ip].update_states(latitude, longitude, speed, acceleration, heading, heading_rate_change, times=times, rel_long_pos=rel_long_pos)
 
@@ -183,13 +242,45 @@ class sumoWrapper():
 
         self.server.broadcast_update_to_all(sim_data)
 
+    def publish_frame(self, frame):
+        '''
+        Publish a lockstep frame as a RUNNING status carrying the frame number and the number of
+        neighbor datagrams sent to the client for the frame. Clients wait for both, step once per
+        frame and acknowledge it with the `frame` field of their next BSM.
+        '''
+
+        sim_data = SIM.make_sim('SUMO-XIL', SIM.SimStatus.RUNNING.value, SIM.Error.OK.value)
+        sim_data['frame'] = frame
+
+        self.server.send_updates(
+            [(client_ip, {**sim_data, 'neighbors': self.frame_neighbors.get(client_ip, 0)}) for client_ip in self.server.get_clients()],
+            msg_type='sim'
+        )
+
+    def wait_for_acks(self):
+        '''
+        Block until every client acknowledged the last lockstep frame, re-sending the frame after
+        each timeout in case it was lost. Returns False when the clients stopped simulating.
+        '''
+
+        while not self.server.wait_for_acks(self.frame, timeout=self.args.lockstep_timeout):
+            if not self.server.is_running() or not self.server.is_simming():
+                return False
+
+            self.publish_frame(self.frame)
+
+        return True
+
     def publish_microsim(self):
         ''' 
         Collects microsimulation data and publishes relevant updates to external clients.
         - Extracts information about external vehicles and their neighboring vehicles.
-        - Formats motion data into standardized messages.
-        - Sends simulation updates to each connected client.
+        - Formats motion data into standardized messages for all clients first.
+        - Sends the simulation updates to each connected client in one batched loop, with all
+          neighbors of a batching client packed into one datagram (optionally as deltas) by the asyncio server.
         '''
+        updates = []
+
         for client, ext in self.exts.items():
             bsm_data = {}
 
@@ -210,10 +301,12 @@ class sumoWrapper():
                     error_flag = BSM.Error.OK.value
 
                     # Make BSM
-                    bsm_data = {nv_id:
-                        BSM.make_bsm(nv_id, latitude, longitude, speed, acceleration, heading, heading_rate_change, error_flag,
-                                     rel_long_gap=rel_long_gap, rel_lat_gap=rel_lat_gap)
-                    }
+                    bsm_data[nv_id] = BSM.make_bsm(nv_id, latitude, longitude, speed, acceleration, heading, heading_rate_change, error_flag,
+                                                   rel_long_gap=rel_long_gap, rel_lat_gap=rel_lat_gap)
+
+                    # Send time of the latest client BSM, for the client to measure the round trip
+                    if client in self.client_utc_times:
+                        bsm_data[nv_id]['echo_utc_time'] = self.client_utc_times[client]
 
                     # Intentions
                     if nv.intended_trajectory:
@@ -223,8 +316,21 @@ class sumoWrapper():
                             bsm_data[nv_id], t, s
                         )
             
-            for id, message in bsm_data.items():
-                self.server.send_update(message, client)
+            updates.append((client, bsm_data))
+
+        # Fan out the updates once all are built so the sends are not interleaved with message construction
+        if self.neighbor_publisher is not None:
+            # One datagram with all neighbors per batching client, queued to the event loop without blocking the step
+            # In lockstep, the neighbors are marked with the frame published next
+            self.frame_neighbors = self.server.send_neighbors(
+                [(client, bsm_data, {'ego': self.exts[client].veh_id}) for client, bsm_data in updates],
+                self.neighbor_publisher, frame=self.frame + 1 if self.args.lockstep else None
+            )
+        else:
+            send_update = self.server.send_update
+            for client, bsm_data in updates:
+                for message in bsm_data.values():
+                    send_update(message, client)
 
     def sim(self):
         ''' 
@@ -238,60 +344,80 @@ class sumoWrapper():
         global RESETS
 
         try:
-            # Create a new external vehicle type
-            self.microsim.add_external_vehicle_type("hdv", EXT().type_id, self.microsim.ext_color)
+            # Runs until shutdown, with in-place resets on client requests
+            while True:
+                # Create a new external vehicle type
+                self.microsim.add_external_vehicle_type("hdv", EXT().type_id, self.microsim.ext_color)
+
+                # Wait for other nodes/clients
+                self.wait()
+
+                ### Simulation
+                t_start = counter()
 
-            # Wait for other nodes/clients
-            self.wait()
+                while self.server.is_running() and self.server.is_simming() and self.microsim.is_running():
+                    # Lockstep - step once every client has stepped with the last frame
+                    if self.args.lockstep and not self.wait_for_acks():
+                        break
 
-            ### Simulation
-            t_start = counter()
+                    t_frame = counter()
 
-            while self.server.is_running() and self.server.is_simming() and self.microsim.is_running():
-                ### Step microsim
-                self.microsim.step()
+                    ### Step microsim
+                    self.microsim.step()
 
-                ### Step the VIL portion of microsim
-                # Get client data
-                self.update_exts()
+                    ### Step the VIL portion of microsim
+                    # Get client data
+                    self.update_exts()
                         
-                # Step external vehicles
-                self.microsim.step_external_vehicles(self.exts)
+                    # Step external vehicles
+                    self.microsim.step_external_vehicles(self.exts)
                 
-                # Get server data update for clients
-                self.publish_microsim()
+                    # Get server data update for clients
+                    self.publish_microsim()
 
-                if abs(fmod(self.microsim.sim_time, 1)) < 1e-6: # Publish every n seconds of simulation time
-                    self.publish_status(SIM.SimStatus.RUNNING.value)
+                    if self.args.lockstep: # Publish every frame to release the clients
+                        self.frame += 1
+                        self.publish_frame(self.frame)
 
-                # Iterate
-                if abs(fmod(self.microsim.sim_time, 1)) < 1e-6: # Print output every n seconds of simulation time
-                    print(f'real time={(counter()-t_start):0.2f}, sim time={self.microsim.sim_time:0.2f}')
+                    elif abs(fmod(self.microsim.sim_time, 1)) < 1e-6: # Publish every n seconds of simulation time
+                        self.publish_status(SIM.SimStatus.RUNNING.value)
 
-                ### Error Check
-                assert abs(self.microsim.dt - 1./self.args.framerate) < 1e-3, 'Microsimulation stepsize and server framerate set at mismatched time intervals!'
+                    # Iterate
+                    if abs(fmod(self.microsim.sim_time, 1)) < 1e-6: # Print output every n seconds of simulation time
+                        print(f'real time={(counter()-t_start):0.2f}, sim time={self.microsim.sim_time:0.2f}')
 
-                ### Rollover and control runtime rate
-                self.server.rate()
+                    ### Error Check
+                    assert abs(self.microsim.dt - 1./self.args.framerate) < 1e-3, 'Microsimulation stepsize and server framerate set at mismatched time intervals!'
 
-            if self.microsim.sim_time + self.microsim.dt >= TEND:
-                print('Microsim shutdown automatically due to t > t_end.')
+                    # Frame-deadline misses of the work done this frame
+                    if self.telemetry is not None:
+                        self.telemetry.record_frame(counter() - t_frame)
 
-            if not self.server.is_connected(self.args.num_clients):
-                print('Microsim shutdown automatically due to some clients disconnecting.')
+                    ### Rollover and control runtime rate - lockstep runs as fast as the slowest client
+                    if not self.args.lockstep:
+                        self.server.rate()
+
+                if self.microsim.sim_time + self.microsim.dt >= TEND:
+                    print('Microsim shutdown automatically due to t > t_end.')
+
+                if not self.server.is_connected(self.args.num_clients):
+                    print('Microsim shutdown automatically due to some clients disconnecting.')
             
-            if self.server.is_resetting():
-                if RESETS >= MAX_N_RESETS:
-                    print('Max number reset requests exceeded.')
+                if self.server.is_resetting():
+                    if RESETS >= MAX_N_RESETS:
+                        print('Max number reset requests exceeded.')
 
-                if RESETS < MAX_N_RESETS:
-                    print('Reset request detected.')
-                    RESETS += 1
+                    if RESETS < MAX_N_RESETS:
+                        print('Reset request detected.')
+                        RESETS += 1
                     
-                    self.reset()
+                        self.reset()
+                        continue
             
-            if not self.server.is_simming():
-                print('Microsim shutdown automatically due to some clients requesting sim shutdown.')
+                if not self.server.is_simming():
+                    print('Microsim shutdown automatically due to some clients requesting sim shutdown.')
+
+                break
 
         except KeyboardInterrupt as e:
             RESETS = MAX_N_RESETS
@@ -302,7 +428,7 @@ class sumoWrapper():
         except AssertionError as e:
             print(f'An assertion error occurred: {e}')
 
-        except TraCIException as e:
+        except traci.TraCIException as e:
             print(f'SUMO exception occurred: {e}')
 
         except IndexError as e:
@@ -12,6 +12,10 @@ def register_parser(parser):
     parser.add_argument("--server_port", type=int, default=12345, help="Server port. Default 12345")
     parser.add_argument("--framerate", type=int, default=10, help="Message send frequency. Default 10")
 
+    parser.add_argument("--telemetry", default=False, action="store_true", help="Flag to record XIL latency, jitter, drops and frame-deadline misses and export them to logs/ at shutdown. Default false.")
+
+    parser.add_argument("--lockstep", default=False, action="store_true", help="Flag to step once per server frame as fast as possible instead of at the framerate. Use with a server started with --lockstep. Default false.")
+
     parser.add_argument("--client_ip", type=str, default="127.0.0.1", help="Client IP address. Default LOCALHOST")
 
     return parser
\ No newline at end of file
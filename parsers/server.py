@@ -12,5 +12,9 @@ def register_parser(parser):
     parser.add_argument("--server_port", type=int, default=12345, help="Server port for listening. Default 12345")
     parser.add_argument("--framerate", type=int, default=10, help="Message check frequency. Default 10")
     parser.add_argument("--num_clients", type=int, default=1, help="Expected number of clients to listen for. Default 1")
+    parser.add_argument("--telemetry", default=False, action="store_true", help="Flag to record XIL latency, jitter, drops and frame-deadline misses per client and export them at shutdown. Default false.")
+    parser.add_argument("--async_server", default=False, action="store_true", help="Flag to use the asyncio UDP server, which receives client messages on an event loop thread. Default false.")
+    parser.add_argument("--lockstep", default=False, action="store_true", help="Flag to step in lockstep with the clients as fast as possible instead of at the framerate. Each frame waits for every client to acknowledge the previous one. Requires --async_server. Default false.")
+    parser.add_argument("--lockstep_timeout", type=float, default=1.0, help="Time to wait for client acknowledgements before re-sending a lockstep frame [s]. Default 1.0")
 
     return parser
\ No newline at end of file
@@ -42,10 +42,68 @@ def register_parser(parser):
         help='Flag to run SUMO simulation with no inflow traffic. Default false to turn off debugging features.', 
         default=False, action='store_true')
     
+    parser.add_argument('--output_name',
+        help='Name of the output folder under <scenario_folder>/<scenario>/ for SUMO outputs and generated route files. Default "output"',
+        default="output", nargs="?", type=str)
+    
+    parser.add_argument('--backend',
+        help='Select the SUMO API backend: ["auto", "libsumo", "traci"]. Default "auto" to use libsumo when headless and installed, otherwise traci',
+        default="auto", nargs="?", type=str, choices=["auto", "libsumo", "traci"])
+    
+    parser.add_argument('--traci_port',
+        help='Set the TraCI port to connect to SUMO on. Default None to pick a free port',
+        default=None, nargs="?", type=int)
+    
+    parser.add_argument('--traci_label',
+        help='Set the TraCI connection label. Default "default"',
+        default="default", nargs="?", type=str)
+    
     parser.add_argument('--timestamp_output',
         help='Flag to timestamp the output folders of SUMO simulation. Default false to turn off debugging features.', 
         default=False, action='store_true')
     
-
+    parser.add_argument('--no_subscriptions',
+        help='Flag to query vehicle states with per-vehicle TraCI getters instead of batched variable subscriptions. Default false.', 
+        default=False, action='store_true')
+    
+    parser.add_argument('--context_subscriptions',
+        help='Flag to read CAV/EXT neighbor states from TraCI context subscriptions within the radar range. Default false.', 
+        default=False, action='store_true')
+    
+    parser.add_argument('--regenerate_routes',
+        help='Flag to regenerate the penetration route file even if an up-to-date cached file exists. Default false.', 
+        default=False, action='store_true')
+    
+    parser.add_argument('--save_checkpoint',
+        help='Save a checkpoint of the SUMO state and Python-side state at this simulation time [s] to checkpoint_<penetration>_t<time> in the output folder. Default None',
+        default=None, nargs="?", type=float)
+    
+    parser.add_argument('--load_checkpoint',
+        help='Warm-start from a checkpoint path prefix written by --save_checkpoint, e.g. "sumo_scenarios/i24/output/checkpoint_p0_t3600". Default None',
+        default=None, nargs="?", type=str)
+    
+    parser.add_argument('--comms_latency',
+        help='Delay of V2V messages between CAVs [s]. Default 0',
+        default=0., nargs="?", type=float)
+    
+    parser.add_argument('--comms_jitter',
+        help='Width of a uniform random delay added to --comms_latency [s]. Default 0',
+        default=0., nargs="?", type=float)
+    
+    parser.add_argument('--comms_loss',
+        help='Probability that a V2V message is lost. Default 0',
+        default=0., nargs="?", type=float)
+    
+    parser.add_argument('--step_timing',
+        help='Flag to time the phases of each simulation step and write p50/p95/p99 to step_timing_<penetration>.json/.csv in the output folder. Default false.', 
+        default=False, action='store_true')
+    
+    parser.add_argument('--cprofile_steps',
+        help='Run cProfile over this many simulation steps and write step_<penetration>.prof to the output folder. Default 0 to turn off profiling',
+        default=0, nargs="?", type=int)
+    
+    parser.add_argument('--cprofile_start',
+        help='Simulation step at which the --cprofile_steps window starts. Default 0',
+        default=0, nargs="?", type=int)
     
     return parser
\ No newline at end of file
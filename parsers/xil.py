@@ -7,4 +7,20 @@
 import argparse
 
 def register_parser(parser):
+    parser.add_argument('--ext_neighbors',
+        help='Select the neighbors sent to each external vehicle: ["leader", "all"]. "all" adds the follower and adjacent-lane leaders/followers. Default "all"',
+        default="all", nargs="?", type=str, choices=["leader", "all"])
+    
+    parser.add_argument('--neighbor_delta',
+        help='Flag to send only the neighbor fields that changed since the last frame, with a full keyframe every --keyframe_interval frames. Default false.', 
+        default=False, action='store_true')
+    
+    parser.add_argument('--keyframe_interval',
+        help='Number of frames between full neighbor keyframes when --neighbor_delta is used. Default 10',
+        default=10, nargs="?", type=int)
+    
+    parser.add_argument('--reset_from_state',
+        help='Flag to reset the scenario from a SUMO state snapshot taken at start instead of reloading it with traci.load. Faster on large networks, but outputs continue in the files of the previous run. Default false.', 
+        default=False, action='store_true')
+    
     return parser
\ No newline at end of file
@@ -1,14 +1,101 @@
 import gzip
 import csv
 import re
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 import os
 import xml.etree.ElementTree as ET
 from scipy.interpolate import interp1d
 from collections import OrderedDict
+from scripts.utils_fcd import load_fcd_columns
 
-def update_flows(penetration_rate, input_file="onramp_template.rou.xml", output_file="onramp.rou.xml"):
+# Version of the generated route files and their metadata sidecars - bump when update_flows output changes
+ROUTE_CACHE_VERSION = 1
+
+def get_route_metadata_file(output_file):
+    """Return the path of the metadata sidecar stored next to a generated route file."""
+    return output_file + '.meta.json'
+
+def hash_file(file, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def infer_planned_end(root):
+    """
+    Infer the planned end time [s] of a routes XML root from the latest <flow> end (or begin)
+    and <vehicle> depart. Returns None if no times are found.
+    """
+    max_end = 0.0
+    for flow in root.iter('flow'):
+        end_attr = flow.get('end')
+        begin_attr = flow.get('begin')
+        if end_attr is not None:
+            max_end = max(max_end, float(end_attr))
+        elif begin_attr is not None:
+            max_end = max(max_end, float(begin_attr))
+    for veh in root.iter('vehicle'):
+        dep = veh.get('depart')
+        if dep is not None:
+            max_end = max(max_end, float(dep))
+
+    return max_end if max_end > 0 else None
+
+def write_atomic(output_file, write):
+    """Call write(tmp_file) then move the result onto output_file so concurrent readers never see a partial file."""
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def write_json(file, data):
+    with open(file, 'w') as f:
+        json.dump(data, f, indent=4)
+
+def get_cached_route_metadata(penetration_rate, input_file, output_file):
+    """
+    Return the sidecar metadata of output_file if it was generated from the current content of
+    input_file with the same penetration rate, otherwise None.
+
+    An unchanged template is recognized from its size and mtime alone. The content hash is only
+    computed when these differ, e.g. after a checkout that touched the file.
+    """
+    meta_file = get_route_metadata_file(output_file)
+    if not os.path.isfile(output_file) or not os.path.isfile(meta_file):
+        return None
+
+    try:
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != ROUTE_CACHE_VERSION or meta.get('penetration') != penetration_rate:
+        return None
+
+    stat = os.stat(input_file)
+    if meta.get('template_size') == stat.st_size and meta.get('template_mtime_ns') == stat.st_mtime_ns:
+        return meta
+
+    if meta.get('template_sha256') != hash_file(input_file):
+        return None
+
+    # Same content with a new mtime - refresh the stat key so the next check skips hashing
+    meta['template_size'] = stat.st_size
+    meta['template_mtime_ns'] = stat.st_mtime_ns
+    write_atomic(meta_file, lambda tmp: write_json(tmp, meta))
+
+    return meta
+
+def update_flows(penetration_rate, input_file="onramp_template.rou.xml", output_file="onramp.rou.xml", use_cache=True):
     """
     Split each <flow> in a SUMO routes file into HDV/CAV subflows according to
     the given penetration rate, preserving original timing/routes and attributes.
@@ -28,7 +115,28 @@ def update_flows(penetration_rate, input_file="onramp_template.rou.xml", output_
     The previous implementation only matched specific flow ids via regex and
     hard-coded begin/end. This general version parses XML and works for i24 and
     onramp templates alike.
+
+    Generated files are cached: a metadata sidecar (see get_route_metadata_file) records the
+    template size/mtime/content hash, the penetration rate and the inferred planned end time.
+    When an up-to-date output file exists, it is reused without parsing the template. Files are
+    written atomically so parallel workers sharing an output file do not collide.
+
+    Returns
+    -------
+    dict
+        The sidecar metadata, including 'planned_end' [s] or None.
     """
+    pen = float(penetration_rate)
+    pen = max(0.0, min(1.0, pen))  # clamp
+
+    if use_cache:
+        meta = get_cached_route_metadata(pen, input_file, output_file)
+        if meta is not None:
+            return meta
+
+    stat = os.stat(input_file)
+    template_sha256 = hash_file(input_file)
+
     tree = ET.parse(input_file)
     root = tree.getroot()
 
@@ -57,9 +165,6 @@ def update_flows(penetration_rate, input_file="onramp_template.rou.xml", output_
             root.append(flow)
             continue
 
-        pen = float(penetration_rate)
-        pen = max(0.0, min(1.0, pen))  # clamp
-
         cav_vph = total_vph * pen
         hdv_vph = total_vph - cav_vph
 
@@ -91,7 +196,20 @@ def update_flows(penetration_rate, input_file="onramp_template.rou.xml", output_
             root.append(_mk_flow('cav', 'cav', cav_vph))
 
     # Save result
-    tree.write(output_file, encoding='UTF-8', xml_declaration=True)
+    write_atomic(output_file, lambda tmp: tree.write(tmp, encoding='UTF-8', xml_declaration=True))
+
+    meta = {
+        'version': ROUTE_CACHE_VERSION,
+        'template': os.path.abspath(input_file),
+        'template_size': stat.st_size,
+        'template_mtime_ns': stat.st_mtime_ns,
+        'template_sha256': template_sha256,
+        'penetration': pen,
+        'planned_end': infer_planned_end(root),
+    }
+    write_atomic(get_route_metadata_file(output_file), lambda tmp: write_json(tmp, meta))
+
+    return meta
 
 
 def extract_mile_marker(link_name):
@@ -345,41 +463,34 @@ def parse_and_reorder_xml(xml_file, output_csv, link_names=None):
     # OrderedDict to store data by vehicle id, preserving the order of first appearance
     vehicle_data = OrderedDict()
     
-    # Stream the XML file with iterparse
-    context = ET.iterparse(xml_file, events=('end',))
-    
-    # Parse each timestep and collect vehicle data
-    print("parsing xml file...")
-    for event, elem in context:
-        if elem.tag == 'timestep':
-            time = elem.get('time', '-1')  # Get the time for this timestep
-            
-            for vehicle in elem.findall('vehicle'):
-                vehicle_id = vehicle.get('id', '-1')
-                lane_id = vehicle.get('lane', '-1')
-                local_y = vehicle.get('x', '-1')
-                mean_speed = vehicle.get('speed', '-1')
-                mean_accel = vehicle.get('accel', '-1')  # Assuming 'accel' exists
-                veh_length = vehicle.get('length', '-1')
-                veh_class = vehicle.get('type', '-1')
-                follower_id = vehicle.get('pos', '-1')  # Assuming 'pos' is follower ID
-                leader_id = vehicle.get('slope', '-1')  # Assuming 'slope' is leader ID
-                
-                # Ensure vehicle_id is added the first time it appears
-                if vehicle_id not in vehicle_data:
-                    vehicle_data[vehicle_id] = []
-                
-                # Append the row for this vehicle at this timestep
-                vehicle_data[vehicle_id].append([
-                    vehicle_id, time, lane_id, local_y, mean_speed, mean_accel, 
-                    veh_length, veh_class, follower_id, leader_id
-                ])
-            elem.clear()  # Free memory
+    # Load the FCD columns, from the sidecar next to the XML when it is up to date
+    print("loading fcd columns...")
+    fcd = load_fcd_columns(xml_file)
 
     # Reorder data by vehicle_id first appearance, then by time
     print("reorder by time...")
-    for vehicle_id in vehicle_data:
-        vehicle_data[vehicle_id].sort(key=lambda x: float(x[1]))
+    order, vehs, starts, ends = fcd.group_by_vehicle()
+
+    lane_ids = [lane if lane else '-1' for lane in fcd.lane_ids]
+    type_ids = [type if type else '-1' for type in fcd.type_ids]
+
+    rows = list(zip(
+        fcd.time[order].tolist(),
+        [lane_ids[lane] for lane in fcd.lane[order].tolist()],
+        fcd.x[order].tolist(),
+        fcd.speed[order].tolist(),
+        [type_ids[type] for type in fcd.sample_type[order].tolist()],
+        fcd.pos[order].tolist(),  # Assuming 'pos' is follower ID
+        [slope if not np.isnan(slope) else '-1' for slope in fcd.slope[order].tolist()],  # Assuming 'slope' is leader ID
+    ))
+    for veh, i0, i1 in zip(vehs.tolist(), starts.tolist(), ends.tolist()):
+        vehicle_id = fcd.veh_ids[veh]
+
+        # Rows for this vehicle in time order, without 'accel' and 'length' attributes in FCD
+        vehicle_data[vehicle_id] = [
+            [vehicle_id, time, lane_id, local_y, mean_speed, '-1', '-1', veh_class, follower_id, leader_id]
+            for time, lane_id, local_y, mean_speed, veh_class, follower_id, leader_id in rows[i0:i1]
+        ]
 
     # Write the result to a CSV file
     print("writing to csv...")
@@ -0,0 +1,499 @@
+"""
+Columnar reader of SUMO FCD output.
+
+The FCD is decoded once into typed NumPy arrays holding one entry per <vehicle> sample, in file
+order. Vehicle, lane and vehicle type IDs are interned into string tables, so the samples only hold
+integer indices into them. Analyses then work on whole columns with vectorized group-bys instead of
+walking the XML or nested per-vehicle dicts.
+
+The columns are saved in a sidecar directory next to the FCD, `<fcd>.cols/`, holding one .npy file
+per column and a meta.json with the string tables. The sidecar is keyed by the size and mtime of the
+XML, and load_fcd_columns prefers it over the XML, memory-mapping the columns.
+
+Large files are parsed in parallel: SUMO writes the FCD as a flat sequence of <timestep> blocks, so
+the file is split at <timestep byte offsets, the chunks are decoded in a process pool and their
+columns are concatenated with the string tables re-interned. Per-vehicle state that spans chunks
+(first/last samples, lane changes, fuel integrals) is then computed on the merged columns.
+"""
+
+import os
+import re
+import json
+import numpy as np
+from xml.parsers import expat
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# Version of the sidecar layout - bump when the columns change
+SIDECAR_VERSION = 2
+
+# Float columns of the samples: (column, FCD attribute, default when the attribute is missing).
+# Samples are kept whatever attributes they miss, and readers that need an attribute drop its nans.
+FLOAT_COLUMNS = (
+    ("pos", "pos", "nan"),
+    ("x", "x", "nan"),
+    ("y", "y", "nan"),
+    ("speed", "speed", "nan"),
+    ("accel", "acceleration", "nan"),
+    ("leader_gap", "leaderGap", "0"),
+    ("leader_speed", "leaderSpeed", "-1"),
+    ("angle", "angle", "nan"),
+    ("slope", "slope", "nan"),
+)
+
+# Integer columns of the samples and per vehicle
+INT_COLUMNS = ("step", "veh", "lane", "leader", "veh_type")
+
+# Smallest share of an FCD file [bytes] worth a worker process when parsing in parallel
+MIN_CHUNK_BYTES = 16 << 20
+
+class FcdColumns:
+    """
+    FCD samples as columns.
+
+    Attributes
+    ----------
+    times : float64[n_steps]
+        Time [s] of every <timestep>, including timesteps without vehicles.
+    step : int32[n]
+        Timestep index of each sample.
+    veh, lane : int32[n]
+        Index of each sample's vehicle into veh_ids and lane into lane_ids. Missing lanes are ''.
+    leader : int32[n]
+        Index into veh_ids of each sample's leaderID, -1 without a leader or a leader never sampled.
+    pos, x, y, speed, accel, leader_gap, leader_speed, angle, slope : float64[n]
+        Sample attributes. Missing leaderGap is 0, missing leaderSpeed -1 and other missing attributes nan.
+        Samples with an attribute that is not a number are dropped.
+    veh_ids, lane_ids, type_ids : list of str
+        String tables, in order of first appearance. Missing vehicle types are ''.
+    veh_type : int32[n_veh]
+        Index into type_ids of each vehicle, taken from its first sample.
+    """
+
+    def __init__(self, times, step, veh, lane, leader, columns, veh_ids, lane_ids, type_ids, veh_type):
+        self.times = times
+        self.step = step
+        self.veh = veh
+        self.lane = lane
+        self.leader = leader
+        for name, _, _ in FLOAT_COLUMNS:
+            setattr(self, name, columns[name])
+
+        self.veh_ids = veh_ids
+        self.lane_ids = lane_ids
+        self.type_ids = type_ids
+        self.veh_type = veh_type
+        self._vehicle_groups = None  # group_by_vehicle() of all samples, built on first use
+
+    def __len__(self):
+        return len(self.veh)
+
+    @property
+    def time(self):
+        """Time [s] of each sample"""
+        return self.times[self.step]
+
+    @property
+    def sample_type(self):
+        """Index into type_ids of each sample"""
+        return self.veh_type[self.veh]
+
+    def has(self, *names):
+        """Return the mask of the samples where none of the named float columns is nan"""
+        mask = np.ones(len(self), dtype=bool)
+        for name in names:
+            mask &= ~np.isnan(getattr(self, name))
+        return mask
+
+    def subset(self, idx):
+        """Return the samples idx, in file order, as FcdColumns sharing the timesteps and string tables"""
+        return FcdColumns(
+            times=self.times,
+            step=self.step[idx],
+            veh=self.veh[idx],
+            lane=self.lane[idx],
+            leader=self.leader[idx],
+            columns={name: getattr(self, name)[idx] for name, _, _ in FLOAT_COLUMNS},
+            veh_ids=self.veh_ids,
+            lane_ids=self.lane_ids,
+            type_ids=self.type_ids,
+            veh_type=self.veh_type,
+        )
+
+    def step_bounds(self):
+        """Return (starts, ends) of the samples of each timestep, which are contiguous"""
+        starts = np.searchsorted(self.step, np.arange(len(self.times)), side="left")
+        ends = np.searchsorted(self.step, np.arange(len(self.times)), side="right")
+        return starts, ends
+
+    def to_frame(self):
+        """
+        Return the samples as a pandas DataFrame with columns time, vehicle_id, type, lane, leader_id
+        and the float columns. Missing lanes and types are None, and leader_id is nan without a leader.
+        """
+        import pandas as pd
+
+        def _strings(ids, idx, missing):
+            table = np.array([s if s else missing for s in ids] + [missing], dtype=object)
+            return table[idx]
+
+        df = pd.DataFrame({
+            "time": self.time,
+            "vehicle_id": _strings(self.veh_ids, self.veh, None),
+            "type": _strings(self.type_ids, self.sample_type, None),
+            "lane": _strings(self.lane_ids, self.lane, None),
+            "leader_id": _strings(self.veh_ids, self.leader, np.nan),
+        })
+        for name, _, _ in FLOAT_COLUMNS:
+            df[name] = getattr(self, name)
+
+        return df
+
+    def group_by_vehicle(self, idx=None):
+        """
+        Group samples by vehicle.
+
+        Returns (order, vehs, starts, ends): the sample indices `order`, ordered by vehicle and in
+        file order within a vehicle, and for each vehicle `vehs[k]` its run order[starts[k]:ends[k]].
+        Vehicles are listed in order of their first sample in idx. The grouping of all samples
+        (idx None) is computed once and shared by later calls.
+        """
+        if idx is None:
+            if self._vehicle_groups is None:
+                self._vehicle_groups = self.group_by_vehicle(np.arange(len(self)))
+            return self._vehicle_groups
+
+        order = idx[np.argsort(self.veh[idx], kind="stable")]
+        v = self.veh[order]
+
+        bounds = np.flatnonzero(v[1:] != v[:-1]) + 1
+        starts = np.concatenate(([0], bounds)) if len(order) else bounds
+        ends = np.concatenate((bounds, [len(order)])) if len(order) else bounds
+
+        first = np.argsort(order[starts], kind="stable")
+        return order, v[starts][first], starts[first], ends[first]
+
+    def lane_changes(self, idx=None):
+        """
+        Return (prev, cur) sample indices, in file order of cur, where a vehicle's lane differs from
+        its previous sample in idx.
+        """
+        order, _, _, _ = self.group_by_vehicle(idx)
+        v = self.veh[order]
+        l = self.lane[order]
+
+        k = np.flatnonzero((v[1:] == v[:-1]) & (l[1:] != l[:-1]))
+        prev, cur = order[k], order[k+1]
+
+        o = np.argsort(cur, kind="stable")
+        return prev[o], cur[o]
+
+def _intern(table, ids, key):
+    i = table.get(key)
+    if i is None:
+        i = table[key] = len(ids)
+        ids.append(key)
+    return i
+
+def _parse_fcd_chunk(chunk):
+    """
+    Decode the bytes [start, end) of an FCD file into columns with chunk-local string tables.
+
+    chunk is (fcd_file, start, end, root): end None reads to the end of the file, and chunks that do not
+    hold the start or end of the file are wrapped in the <root> element so expat sees a document.
+    Leaders are kept as indices into the chunk's leader_ids and resolved once chunks are merged.
+    """
+    fcd_file, start, end, root = chunk
+
+    times = array("d")
+    step = array("i")
+    veh = array("i")
+    lane = array("i")
+    columns = {name: array("d") for name, _, _ in FLOAT_COLUMNS}
+    appends = [(columns[name].append, attr, default) for name, attr, default in FLOAT_COLUMNS]
+
+    leader = array("i")
+
+    veh_index, veh_ids = {}, []
+    lane_index, lane_ids = {}, []
+    type_index, type_ids = {}, []
+    leader_index, leader_ids = {}, []
+    veh_type = array("i")
+
+    def start_element(tag, attrs):
+        if tag == "vehicle" and times:
+            try:
+                values = [float(attrs.get(attr, default)) for _, attr, default in appends]
+            except Exception:
+                return
+
+            vid = attrs.get("id")
+            i = veh_index.get(vid)
+            if i is None:
+                i = veh_index[vid] = len(veh_ids)
+                veh_ids.append(vid)
+                veh_type.append(_intern(type_index, type_ids, attrs.get("type") or ""))
+
+            step.append(len(times) - 1)
+            veh.append(i)
+            lane.append(_intern(lane_index, lane_ids, attrs.get("lane") or ""))
+            leader.append(_intern(leader_index, leader_ids, attrs.get("leaderID") or ""))
+            for (append, _, _), value in zip(appends, values):
+                append(value)
+
+        elif tag == "timestep":
+            times.append(float(attrs.get("time")))
+
+    # Expat callbacks without building an element tree
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    try:
+        with open(fcd_file, "rb") as f:
+            if start == 0 and end is None:
+                parser.ParseFile(f)
+            else:
+                if start > 0:
+                    parser.Parse(f"<{root}>".encode())
+                f.seek(start)
+                remaining = (end - start) if end is not None else -1
+                while remaining:
+                    block = f.read(1 << 20 if remaining < 0 else min(1 << 20, remaining))
+                    if not block:
+                        break
+                    parser.Parse(block)
+                    remaining -= len(block) if remaining > 0 else 0
+                parser.Parse(f"</{root}>".encode() if end is not None else b"", True)
+    except expat.ExpatError as ex:
+        raise RuntimeError(f"Empty or invalid FCD XML: {fcd_file} ({ex})")
+
+    def _np(buf, dtype):
+        return np.frombuffer(buf, dtype=dtype) if len(buf) else np.zeros(0, dtype=dtype)
+
+    return {
+        "times": _np(times, np.float64),
+        "step": _np(step, np.int32),
+        "veh": _np(veh, np.int32),
+        "lane": _np(lane, np.int32),
+        "leader": _np(leader, np.int32),
+        "columns": {name: _np(col, np.float64) for name, col in columns.items()},
+        "veh_ids": veh_ids,
+        "lane_ids": lane_ids,
+        "type_ids": type_ids,
+        "leader_ids": leader_ids,
+        "veh_type": _np(veh_type, np.int32),
+    }
+
+def _merge_chunks(chunks):
+    """
+    Merge the columns of consecutive chunks into FcdColumns, as if the file was read in one pass:
+    timestep indices are offset by the timesteps of earlier chunks and the chunk-local vehicle, lane,
+    type and leader indices are re-interned into global tables in order of first appearance.
+    """
+    veh_index, veh_ids = {}, []
+    lane_index, lane_ids = {}, []
+    type_index, type_ids = {}, []
+    leader_index, leader_ids = {}, []
+    veh_type = []
+
+    times, step, veh, lane, leader = [], [], [], [], []
+    columns = {name: [] for name, _, _ in FLOAT_COLUMNS}
+    n_steps = 0
+
+    for c in chunks:
+        veh_map = np.empty(len(c["veh_ids"]), dtype=np.int32)
+        for j, (vid, vt) in enumerate(zip(c["veh_ids"], c["veh_type"].tolist())):
+            i = veh_index.get(vid)
+            if i is None:
+                # The type of a vehicle is taken from its first sample in the file
+                i = veh_index[vid] = len(veh_ids)
+                veh_ids.append(vid)
+                veh_type.append(_intern(type_index, type_ids, c["type_ids"][vt]))
+            veh_map[j] = i
+
+        lane_map = np.array([_intern(lane_index, lane_ids, l) for l in c["lane_ids"]], dtype=np.int32)
+        leader_map = np.array([_intern(leader_index, leader_ids, l) for l in c["leader_ids"]], dtype=np.int32)
+
+        times.append(c["times"])
+        step.append(c["step"] + np.int32(n_steps))
+        veh.append(veh_map[c["veh"]])
+        lane.append(lane_map[c["lane"]])
+        leader.append(leader_map[c["leader"]])
+        for name in columns:
+            columns[name].append(c["columns"][name])
+        n_steps += len(c["times"])
+
+    def _cat(parts, dtype):
+        return np.concatenate(parts).astype(dtype, copy=False) if parts else np.zeros(0, dtype=dtype)
+
+    # Leaders are vehicles, so resolve them into the vehicle table
+    leader_veh = np.array([veh_index.get(vid, -1) if vid else -1 for vid in leader_ids] + [-1], dtype=np.int32)
+
+    return FcdColumns(
+        times=_cat(times, np.float64),
+        step=_cat(step, np.int32),
+        veh=_cat(veh, np.int32),
+        lane=_cat(lane, np.int32),
+        leader=leader_veh[_cat(leader, np.int32)],
+        columns={name: _cat(col, np.float64) for name, col in columns.items()},
+        veh_ids=veh_ids,
+        lane_ids=lane_ids,
+        type_ids=type_ids,
+        veh_type=np.array(veh_type, dtype=np.int32),
+    )
+
+def split_fcd_chunks(fcd_file, n_chunks):
+    """
+    Split an FCD file into at most n_chunks byte ranges of similar size that each start at a
+    <timestep element. Returns a list of (fcd_file, start, end, root) for _parse_fcd_chunk.
+    """
+    size = os.path.getsize(fcd_file)
+
+    with open(fcd_file, "rb") as f:
+        # Name of the root element, skipping the declaration and the configuration comment SUMO writes
+        head = re.sub(rb"<!--.*?-->", b"", f.read(1 << 20), flags=re.DOTALL)
+        match = re.search(rb"<([A-Za-z_][\w.\-]*)", head)
+        root = match.group(1).decode() if match else "fcd-export"
+
+        bounds = [0]
+        for k in range(1, n_chunks):
+            target = max(size * k // n_chunks, bounds[-1] + 1)
+            f.seek(target)
+            # Search forward for the next timestep, overlapping reads by the tag length
+            offset, tail = target, b""
+            while True:
+                block = f.read(1 << 16)
+                if not block:
+                    offset = None
+                    break
+                buf = tail + block
+                i = buf.find(b"<timestep")
+                if i >= 0:
+                    offset += i - len(tail)
+                    break
+                offset += len(block)
+                tail = buf[-8:]
+
+            if offset is None:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+
+    ends = bounds[1:] + [None]
+    return [(fcd_file, start, end, root) for start, end in zip(bounds, ends)]
+
+def read_fcd_columns(fcd_file, workers=None):
+    """
+    Decode a SUMO FCD XML file into FcdColumns.
+
+    Files of at least MIN_CHUNK_BYTES per worker are split at <timestep boundaries and the chunks are
+    parsed in a pool of `workers` processes (default: all cores), then merged. Smaller files, or
+    workers=1, are read in one streaming pass. Vehicle samples with missing or malformed
+    pos/x/speed/acceleration are skipped.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_chunks = min(workers, os.path.getsize(fcd_file) // MIN_CHUNK_BYTES)
+
+    if n_chunks <= 1:
+        return _merge_chunks([_parse_fcd_chunk((fcd_file, 0, None, None))])
+
+    chunks = split_fcd_chunks(fcd_file, n_chunks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        return _merge_chunks(list(pool.map(_parse_fcd_chunk, chunks)))
+
+def get_sidecar_dir(fcd_file):
+    """Return the path of the columnar sidecar stored next to an FCD file."""
+    return fcd_file + ".cols"
+
+def _file_key(fcd_file):
+    st = os.stat(fcd_file)
+    return {"version": SIDECAR_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _save_array(npy_file, arr):
+    """Save arr to a temporary file next to npy_file then move it in place, so readers that memory-map the old file keep a valid mapping."""
+    tmp_file = f"{npy_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp_file, npy_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def write_fcd_sidecar(fcd_file, fcd):
+    """Save the columns of an FCD file to its sidecar directory."""
+    sidecar = get_sidecar_dir(fcd_file)
+    meta_file = os.path.join(sidecar, "meta.json")
+    os.makedirs(sidecar, exist_ok=True)
+
+    # Invalidate first so a partially written sidecar is never loaded
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    _save_array(os.path.join(sidecar, "times.npy"), np.asarray(fcd.times))
+    for name in INT_COLUMNS + tuple(name for name, _, _ in FLOAT_COLUMNS):
+        _save_array(os.path.join(sidecar, f"{name}.npy"), np.asarray(getattr(fcd, name)))
+
+    meta = dict(_file_key(fcd_file), n=len(fcd), veh_ids=fcd.veh_ids, lane_ids=fcd.lane_ids, type_ids=fcd.type_ids)
+    with open(meta_file + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_file + ".tmp", meta_file)
+
+def read_fcd_sidecar(fcd_file, mmap_mode="r"):
+    """
+    Load the columns of an FCD file from its sidecar, memory-mapped by default. Returns None if there
+    is no sidecar or it is stale: written by another version or for an FCD of another size or mtime.
+    """
+    meta_file = os.path.join(get_sidecar_dir(fcd_file), "meta.json")
+    try:
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if any(meta.get(k) != v for k, v in _file_key(fcd_file).items()):
+        return None
+
+    def _load(name):
+        return np.load(os.path.join(get_sidecar_dir(fcd_file), f"{name}.npy"), mmap_mode=mmap_mode)
+
+    try:
+        ints = {name: _load(name) for name in INT_COLUMNS}
+        columns = {name: _load(name) for name, _, _ in FLOAT_COLUMNS}
+        times = _load("times")
+    except (OSError, ValueError):
+        return None
+
+    if any(len(col) != meta["n"] for col in columns.values()):
+        return None
+
+    return FcdColumns(
+        times=times,
+        columns=columns,
+        veh_ids=meta["veh_ids"],
+        lane_ids=meta["lane_ids"],
+        type_ids=meta["type_ids"],
+        **ints,
+    )
+
+def load_fcd_columns(fcd_file, use_sidecar=True, workers=None):
+    """
+    Return the FcdColumns of an FCD file, from its sidecar when it is up to date. Otherwise the XML is
+    parsed with `workers` processes (see read_fcd_columns) and, if use_sidecar, the sidecar is
+    (re)written so later loads skip the XML.
+    """
+    if use_sidecar:
+        fcd = read_fcd_sidecar(fcd_file)
+        if fcd is not None:
+            return fcd
+
+    fcd = read_fcd_columns(fcd_file, workers=workers)
+
+    if use_sidecar:
+        try:
+            write_fcd_sidecar(fcd_file, fcd)
+        except OSError as e:
+            print(f"[FCD] Could not write the sidecar of {fcd_file}: {e}")
+
+    return fcd
@@ -6,6 +6,7 @@ import os
 import pandas as pd
 import xml.etree.ElementTree as ET
 import scripts.utils_data_read as reader
+from scripts.utils_fcd import load_fcd_columns
 import numpy as np
 from collections import OrderedDict
 from matplotlib.ticker import FuncFormatter
@@ -484,29 +485,11 @@ def visualize_fcd(fcd_file, lanes=None, direction=None, color_by_type=False, ax=
     matplotlib.axes.Axes
         The Axes object containing the plot.
     """
-    # Parse the FCD XML file
-    tree = ET.parse(fcd_file)
-    root = tree.getroot()
-    
-    # Extract vehicle data
-    data = []
-
-    for timestep in root.findall('timestep'):
-        time = float(timestep.get('time'))
-
-        for vehicle in timestep.findall('vehicle'):
-            vehicle_id = vehicle.get('id')
-            type = vehicle.get('type')
-            lane = vehicle.get('lane')
-            x = float(vehicle.get('x'))
-            y = float(vehicle.get('y'))
-            speed = float(vehicle.get('speed'))
-            angle = float(vehicle.get('angle'))
-            
-            data.append([time, vehicle_id, type, lane, x, y, speed, angle])
+    # Load the FCD columns, from the sidecar next to the XML when it is up to date
+    fcd = load_fcd_columns(fcd_file)
     
     # Create a DataFrame
-    df = pd.DataFrame(data, columns=['time', 'vehicle_id', 'type', 'lane', 'x', 'y', 'speed','angle'])
+    df = fcd.to_frame()[['time', 'vehicle_id', 'type', 'lane', 'x', 'y', 'speed','angle']]
     
     # Filter data for specific lanes if provided
     if lanes is not None:
@@ -643,40 +626,23 @@ def scatter_fcd(fcd_file):
     Returns: None
     """
     # works on I-24 new only
-    # Parse the FCD XML file
-    tree = ET.parse(fcd_file)
-    root = tree.getroot()
+    # Load the FCD columns, from the sidecar next to the XML when it is up to date
+    fcd = load_fcd_columns(fcd_file)
     dt = 30 # time batch size for scatter
     start_time = 0
 
     # Extract vehicle data
-    time_arr = []
-    x_arr = []
-    y_arr = []
-    v_arr = []
     x0, y0 = 4048.27, 8091.19
     exclude_edges = ["19447013", "19440938", "27925488", "782177974", "782177973", "19446904"]
     
-    for timestep in root.findall('timestep'):
-        time = float(timestep.get('time'))
-        if time > 10800:
-            break
-        if time % 20 == 0:
-            for vehicle in timestep.findall('vehicle'):
-                if vehicle.get("lane").split("_")[0] not in exclude_edges:
-                    x = float(vehicle.get('x'))
-                    y = float(vehicle.get('y'))  # y is parsed but not used in this plot
-                    speed = float(vehicle.get('speed'))
-                    time_arr.append(time)
-                    x_arr.append(x)
-                    y_arr.append(y)
-                    v_arr.append(speed)
+    time_arr = fcd.time
+    keep_lane = np.array([lane.split("_")[0] not in exclude_edges for lane in fcd.lane_ids], dtype=bool)[fcd.lane]
+    keep = keep_lane & (time_arr <= 10800) & (time_arr % 20 == 0)
             
-    # Convert lists to numpy arrays for faster plotting
-    time_arr = np.array(time_arr)
-    x_arr = np.array(x_arr)
-    y_arr = np.array(y_arr)
-    v_arr = np.array(v_arr)
+    time_arr = time_arr[keep]
+    x_arr = fcd.x[keep]
+    y_arr = fcd.y[keep]
+    v_arr = fcd.speed[keep]
     distances = np.sqrt((x_arr - x0)**2 + (y_arr - y0)**2)
     
     # Plot time-space diagrams
@@ -708,36 +674,21 @@ def scatter_fcd_i24(fcd_file):
 
     Returns: None
     """
-    # Parse the FCD XML file
-    tree = ET.parse(fcd_file)
-    root = tree.getroot()
+    # Load the FCD columns, from the sidecar next to the XML when it is up to date
+    fcd = load_fcd_columns(fcd_file)
     x_offset = -1000
 
     # Extract vehicle data
-    time_arr = []
-    x_arr = []
-    # y_arr = []
-    v_arr = []
     # x0, y0 = 4048.27, 8091.19
     exclude_edges = ["E2", "E4", "E6"]
     
-    for timestep in root.findall('timestep'):
-        time = float(timestep.get('time'))
-        if time > 10800:
-            break
-        # if time % 20 == 0:
-        for vehicle in timestep.findall('vehicle'):
-            if vehicle.get("lane").split("_")[0] not in exclude_edges:
-                x = float(vehicle.get('x'))
-                # y = float(vehicle.get('y'))  # y is parsed but not used in this plot
-                speed = float(vehicle.get('speed'))
-                time_arr.append(time)
-                x_arr.append(x)
-                # y_arr.append(y)
-                v_arr.append(speed)
-            
-    # Convert lists to numpy arrays for faster plotting
-    time_arr = np.array(time_arr) 
+    time_arr = fcd.time
+    keep_lane = np.array([lane.split("_")[0] not in exclude_edges for lane in fcd.lane_ids], dtype=bool)[fcd.lane]
+    keep = keep_lane & (time_arr <= 10800)
+
+    time_arr = time_arr[keep]
+    x_arr = fcd.x[keep]
+    v_arr = fcd.speed[keep]
     start_time = pd.Timestamp('2023-11-13 05:00:00')
     time_arr = pd.to_datetime(start_time) + pd.to_timedelta(time_arr, unit='s')
     x_arr = 57.6 - (np.array(x_arr) - x_offset)/1609.34 # start at 0
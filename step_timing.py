@@ -0,0 +1,202 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Low-overhead timing of the phases of a simulation step.
+
+Each phase accumulates its wall time over a step, and the per-step totals are binned into
+fixed log-spaced histograms so that p50/p95/p99 can be reported at shutdown without storing
+every sample. Phases that only run in some steps are binned in the steps they ran, so their
+count is the number of those steps and their percentiles are not diluted by zeros.
+Optionally, cProfile is enabled around a window of N steps only.
+'''
+
+import os
+import csv
+import json
+import cProfile
+from math import log10
+from time import perf_counter as counter
+
+# Phases of simulation.step() in execution order
+PHASES = (
+    'simulationStep',
+    'bookkeeping',
+    'lane_queries',
+    'tl_queries',
+    'leader_queries',
+    'controller',
+    'comms_update',
+    'setters',
+    'other',
+    'total',
+)
+
+# Log-spaced histogram bins from 0.1 us to 100 s
+LOG_MIN = -7.
+LOG_MAX = 2.
+BINS_PER_DECADE = 20
+N_BINS = int((LOG_MAX - LOG_MIN) * BINS_PER_DECADE)
+
+class PhaseHistogram:
+    '''Fixed log-spaced histogram of durations [s] with count, sum and max.'''
+
+    def __init__(self):
+        self.counts = [0] * N_BINS
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, dt):
+        if dt > 0.:
+            i = int((log10(dt) - LOG_MIN) * BINS_PER_DECADE)
+            i = min(max(i, 0), N_BINS - 1)
+        else:
+            i = 0
+
+        self.counts[i] += 1
+        self.n += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+
+    def percentile(self, q):
+        '''Return the upper edge of the bin holding the q-th percentile [s], q in [0, 100].'''
+        if self.n == 0:
+            return 0.
+
+        target = q / 100. * self.n
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target and count > 0:
+                return min(10 ** (LOG_MIN + (i + 1) / BINS_PER_DECADE), self.max)
+
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.n,
+            'total_s': self.total,
+            'mean_ms': 1e3 * self.total / self.n if self.n else 0.,
+            'p50_ms': 1e3 * self.percentile(50),
+            'p95_ms': 1e3 * self.percentile(95),
+            'p99_ms': 1e3 * self.percentile(99),
+            'max_ms': 1e3 * self.max,
+        }
+
+class StepTimer:
+    '''
+    Accumulates the wall time of each step phase and bins the per-step totals.
+
+    Usage within a step:
+
+        timer.start_step()
+        ...                      # work of the first phase
+        timer.lap('simulationStep')
+        ...                      # work of the next phase
+        timer.lap('bookkeeping')
+        timer.end_step()
+
+    Time between two laps is attributed to the phase named by the second lap. All calls
+    return immediately when timing and profiling are disabled.
+    '''
+
+    def __init__(self, enabled=False, cprofile_start=0, cprofile_steps=0):
+        self.enabled = enabled
+
+        self.histograms = {phase: PhaseHistogram() for phase in PHASES}
+        self.step_totals = dict.fromkeys(PHASES, 0.)
+        self.step_lapped = set()  # Phases lapped during the current step
+        self.n_steps = 0
+
+        self._t_step = 0.
+        self._t_lap = 0.
+
+        # Optional cProfile window of steps [cprofile_start, cprofile_start + cprofile_steps)
+        self.cprofile_start = cprofile_start
+        self.cprofile_end = cprofile_start + cprofile_steps
+        self.profiler = cProfile.Profile() if cprofile_steps > 0 else None
+        self.profile_file = None
+
+    def start_step(self):
+        if self.profiler is not None and self.n_steps == self.cprofile_start:
+            self.profiler.enable()
+
+        if self.enabled:
+            self._t_step = self._t_lap = counter()
+
+    def lap(self, phase):
+        if self.enabled:
+            t = counter()
+            self.step_totals[phase] += t - self._t_lap
+            self.step_lapped.add(phase)
+            self._t_lap = t
+
+    def end_step(self):
+        if self.enabled:
+            t = counter()
+            self.step_totals['other'] += t - self._t_lap
+            self.step_totals['total'] = t - self._t_step
+
+            self.step_lapped.update(('other', 'total'))
+            for phase in self.step_lapped:
+                self.histograms[phase].add(self.step_totals[phase])
+                self.step_totals[phase] = 0.
+            self.step_lapped.clear()
+
+        self.n_steps += 1
+
+        if self.profiler is not None and self.n_steps == self.cprofile_end:
+            self.profiler.disable()
+            if self.profile_file:
+                self.profiler.dump_stats(self.profile_file)
+                print(f'Wrote cProfile of steps {self.cprofile_start}-{self.cprofile_end} to {self.profile_file}.')
+            self.profiler = None
+
+    def summary(self):
+        '''Return {phase: {count, total_s, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}'''
+        return {phase: hist.summary() for phase, hist in self.histograms.items()}
+
+    def write_report(self, output_dir, tag):
+        '''Write the phase timing summary to step_timing_<tag>.json and step_timing_<tag>.csv and return the json path.'''
+        # Flush a cProfile window cut short by the end of the run
+        if self.profiler is not None and self.n_steps > self.cprofile_start:
+            self.profiler.disable()
+            if self.profile_file:
+                self.profiler.dump_stats(self.profile_file)
+            self.profiler = None
+
+        if not self.enabled or self.n_steps == 0:
+            return None
+
+        summary = self.summary()
+
+        json_file = os.path.join(output_dir, f'step_timing_{tag}.json')
+        with open(json_file, 'w') as f:
+            json.dump({
+                'n_steps': self.n_steps,
+                'phases': summary,
+                'histogram': {
+                    'log10_min_s': LOG_MIN,
+                    'bins_per_decade': BINS_PER_DECADE,
+                    'counts': {phase: hist.counts for phase, hist in self.histograms.items()},
+                },
+            }, f, indent=4)
+
+        csv_file = os.path.join(output_dir, f'step_timing_{tag}.csv')
+        with open(csv_file, 'w', newline='') as f:
+            fields = ['phase', 'count', 'total_s', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for phase, row in summary.items():
+                writer.writerow({'phase': phase, **row})
+
+        print(f'Wrote step timing report to {json_file}.')
+        for phase, row in summary.items():
+            print(f"  {phase:<16} mean={row['mean_ms']:8.3f} ms | p50={row['p50_ms']:8.3f} | p95={row['p95_ms']:8.3f} | p99={row['p99_ms']:8.3f} ms")
+
+        return json_file
@@ -0,0 +1,112 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Facade over the SUMO Python APIs.
+
+libsumo runs SUMO in-process and avoids the TCP socket round trip of every TraCI call, but it has
+no GUI support and only one simulation per process. The facade selects libsumo for headless runs
+when it is installed, and falls back to traci otherwise, so callers use a single
+
+    from sumo_backend import traci
+
+import regardless of the backend in use.
+'''
+
+import warnings
+from time import perf_counter as counter
+
+import traci as _traci
+
+try:
+    import libsumo as _libsumo
+except ImportError:
+    _libsumo = None
+
+BACKENDS = ('auto', 'libsumo', 'traci')
+
+class SumoBackend:
+    '''Forwards the TraCI API (domains, start/close, exceptions) to the selected backend module.'''
+
+    def __init__(self):
+        self.name = None
+        self.module = None
+        self._bound = []
+        self._bind(_traci, 'traci')
+
+    def _bind(self, module, name):
+        '''Bind the public API of `module` onto this facade so calls skip any forwarding overhead.'''
+        # Drop the previously bound API
+        for attr in self._bound:
+            del self.__dict__[attr]
+        self._bound = []
+
+        self.module = module
+        self.name = name
+
+        for attr in dir(module):
+            # Keep the facade's own attributes and methods, e.g. start()
+            if attr.startswith('_') or attr in self.__dict__ or hasattr(type(self), attr):
+                continue
+
+            self.__dict__[attr] = getattr(module, attr)
+            self._bound.append(attr)
+
+    def select(self, backend='auto', gui=False):
+        '''
+        Select the backend before starting SUMO.
+
+        Parameters
+        ----------
+        backend : str
+            One of 'auto', 'libsumo' or 'traci'. 'auto' uses libsumo for headless runs when installed.
+        gui : bool
+            Whether sumo-gui is requested, which requires traci.
+
+        Returns
+        -------
+        str
+            The name of the selected backend.
+        '''
+        assert backend in BACKENDS, f'Unknown SUMO backend {backend}. Expected one of {BACKENDS}.'
+
+        use_libsumo = backend in ('auto', 'libsumo') and not gui and _libsumo is not None
+
+        if backend == 'libsumo' and not use_libsumo:
+            reason = 'the GUI is requested' if gui else 'libsumo is not installed'
+            warnings.warn(f'Cannot use libsumo since {reason}. Falling back to traci.')
+
+        if use_libsumo:
+            self._bind(_libsumo, 'libsumo')
+        else:
+            self._bind(_traci, 'traci')
+
+        return self.name
+
+    def start(self, cmd, **kwargs):
+        '''Start SUMO with the selected backend, falling back to traci if libsumo fails to launch.'''
+        if self.name == 'libsumo':
+            try:
+                return self.module.start(cmd, **kwargs)
+
+            except Exception as e:
+                warnings.warn(f'libsumo failed to start SUMO ({e}). Falling back to traci.')
+                self._bind(_traci, 'traci')
+
+        return self.module.start(cmd, **kwargs)
+
+    def report(self, n_calls=1000):
+        '''Print the selected backend with a short benchmark of the per-call API overhead. Requires a started simulation.'''
+        t_start = counter()
+        for _ in range(n_calls):
+            self.module.simulation.getTime()
+        per_call = (counter() - t_start) / n_calls
+
+        print(f'Using {self.name} backend: {1e6*per_call:.1f} us per API call ({n_calls} calls).')
+
+        return per_call
+
+traci = SumoBackend()
@@ -0,0 +1,202 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import socket
+import json
+import time
+from xil_async_server import AsyncUDPServer, CLIENT_PORTS, WAITING, OFFLINE, client_address
+from xil_wire import encode_bsm, decode_bsm, NeighborPublisher, NeighborTable
+
+SERVER_PORT = 12346
+CLIENT_IP = "127.0.0.2"
+
+class TestAsyncUDPServer(unittest.TestCase):
+    def setUp(self):
+        """Set up the asyncio server and a client bound to its own loopback address."""
+        self.server = AsyncUDPServer(server_ip="127.0.0.1", server_port=SERVER_PORT, framerate=10, timeout=10)
+
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client_socket.bind((CLIENT_IP, 0))
+
+        self.bsm_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.bsm_socket.bind((CLIENT_IP, CLIENT_PORTS["bsm"]))
+        self.bsm_socket.settimeout(2)
+
+        self.sim_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sim_socket.bind((CLIENT_IP, CLIENT_PORTS["sim"]))
+        self.sim_socket.settimeout(2)
+
+    def send(self, data):
+        self.client_socket.sendto(data, ("127.0.0.1", SERVER_PORT))
+
+    def wait_for(self, condition, timeout=2):
+        t = time.time()
+        while not condition() and time.time() - t < timeout:
+            time.sleep(0.005)
+        return condition()
+
+    def test_latest_value_slots(self):
+        """Ensure a burst of BSMs leaves only the latest one in the client slot."""
+        for i in range(20):
+            self.send(json.dumps({"msg_type": "bsm", "id": "ego", "speed": float(i)}).encode("utf-8"))
+
+        self.assertTrue(self.wait_for(lambda: self.server.n_received == 20))
+        self.assertEqual(self.server.get_all_data("bsm")[CLIENT_IP]["speed"], 19.0)
+
+    def test_status(self):
+        """Ensure client SIM statuses drive the simming state."""
+        self.send(json.dumps({"msg_type": "sim", "id": "ego", "sim_status": WAITING}).encode("utf-8"))
+        self.assertTrue(self.wait_for(lambda: self.server.is_simming()))
+        self.assertTrue(self.server.is_connected(1))
+
+        self.send(json.dumps({"msg_type": "sim", "id": "ego", "sim_status": OFFLINE}).encode("utf-8"))
+        self.assertTrue(self.wait_for(lambda: not self.server.is_simming()))
+
+    def test_clear_data(self):
+        """Ensure a reset drops the latest-value slots and statuses but keeps the clients connected."""
+        self.send(json.dumps({"msg_type": "sim", "id": "ego", "sim_status": WAITING}).encode("utf-8"))
+        self.assertTrue(self.wait_for(lambda: self.server.is_simming()))
+
+        self.server.clear_data()
+        self.assertEqual(self.server.get_all_data("sim"), {})
+        self.assertFalse(self.server.is_simming())
+        self.assertTrue(self.server.is_connected(1))
+
+    def test_lockstep_acks(self):
+        """Ensure waiting for a lockstep frame returns once the client acknowledged it."""
+        self.send(json.dumps({"msg_type": "bsm", "id": "ego", "frame": 0}).encode("utf-8"))
+        self.assertTrue(self.server.wait_for_acks(0, timeout=2))
+        self.assertFalse(self.server.wait_for_acks(1, timeout=0.05))
+
+        self.send(json.dumps({"msg_type": "bsm", "id": "ego", "frame": 1}).encode("utf-8"))
+        self.assertTrue(self.server.wait_for_acks(1, timeout=2))
+
+    def test_send_in_client_format(self):
+        """Ensure updates reach the client in the wire format it sends with."""
+        self.send(encode_bsm({"id": "ego", "speed": 1.0}))
+        self.assertTrue(self.wait_for(lambda: CLIENT_IP in self.server.get_all_data("bsm")))
+
+        self.server.send_updates([(CLIENT_IP, {"id": "nv_1", "speed": 2.0})])
+        data, _ = self.bsm_socket.recvfrom(65535)
+        self.assertEqual(decode_bsm(data)["id"], "nv_1")
+
+    def test_fleet_slots(self):
+        """Ensure the vehicles of a fleet client get one slot each, keyed by client IP and vehicle ID."""
+        bsms = [{"msg_type": "bsm", "id": f"veh_{k}", "speed": float(k), "fleet": True} for k in range(3)]
+        self.send(json.dumps({"msg_type": "bsm_batch", "bsms": bsms}).encode("utf-8"))
+        self.assertTrue(self.wait_for(lambda: len(self.server.get_all_data("bsm")) == 3))
+
+        slots = self.server.get_all_data("bsm")
+        self.assertEqual(sorted(slots), [f"{CLIENT_IP}/veh_{k}" for k in range(3)])
+        self.assertEqual(slots[f"{CLIENT_IP}/veh_2"]["speed"], 2.0)
+        self.assertEqual(self.server.get_clients(), [CLIENT_IP])
+        self.assertTrue(self.server.accepts_batches(f"{CLIENT_IP}/veh_0"))
+
+    def test_client_address_routing(self):
+        """Ensure updates to a fleet vehicle slot are sent to the IP of its client."""
+        self.assertEqual(client_address(f"{CLIENT_IP}/veh_0"), CLIENT_IP)
+        self.assertEqual(client_address(CLIENT_IP), CLIENT_IP)
+
+        self.server.send_update({"msg_type": "bsm", "id": "nv_1"}, f"{CLIENT_IP}/veh_0")
+        data, _ = self.bsm_socket.recvfrom(65535)
+        self.assertEqual(json.loads(data)["id"], "nv_1")
+
+        self.server.send_update({"msg_type": "sim", "id": "SUMO-XIL", "sim_status": WAITING}, f"{CLIENT_IP}/veh_0")
+        data, _ = self.sim_socket.recvfrom(65535)
+        self.assertEqual(json.loads(data)["sim_status"], WAITING)
+
+        self.server.send_datagrams([(f"{CLIENT_IP}/veh_0", b'{"id": "nv_2"}'), (f"{CLIENT_IP}/veh_1", b'{"id": "nv_3"}')])
+        received = [json.loads(self.bsm_socket.recvfrom(65535)[0])["id"] for _ in range(2)]
+        self.assertEqual(received, ["nv_2", "nv_3"])
+
+    def test_fleet_ego_header(self):
+        """Ensure each vehicle of a fleet client gets its own neighbor batch naming it as the ego."""
+        bsms = [{"msg_type": "bsm", "id": f"veh_{k}", "fleet": True} for k in range(2)]
+        self.send(json.dumps({"msg_type": "bsm_batch", "bsms": bsms}).encode("utf-8"))
+        self.assertTrue(self.wait_for(lambda: len(self.server.get_all_data("bsm")) == 2))
+
+        neighbors = {"nv_1": {"msg_type": "bsm", "id": "nv_1", "rel_long_gap": 10.0}}
+        counts = self.server.send_neighbors(
+            [(f"{CLIENT_IP}/veh_{k}", neighbors, {"ego": f"veh_{k}"}) for k in range(2)], NeighborPublisher(self.server.wire)
+        )
+        self.assertEqual(counts, {CLIENT_IP: 2})
+
+        tables = {}
+        for _ in range(2):
+            message = json.loads(self.bsm_socket.recvfrom(65535)[0])
+            tables[message["ego"]] = NeighborTable().apply(message)
+        self.assertEqual(tables, {"veh_0": neighbors, "veh_1": neighbors})
+
+    def test_send_neighbors(self):
+        """Ensure standard clients get one BSM per neighbor and only opted-in clients get batches."""
+        batch_ip = "127.0.0.3"
+        batch_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        batch_socket.bind((batch_ip, 0))
+        batch_bsm_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        batch_bsm_socket.bind((batch_ip, CLIENT_PORTS["bsm"]))
+        batch_bsm_socket.settimeout(2)
+
+        try:
+            # A standard client as ext/vehicle_sim.py and a client opted in to batches
+            self.send(json.dumps({"msg_type": "bsm", "id": "ego"}).encode("utf-8"))
+            batch_socket.sendto(json.dumps({"msg_type": "bsm", "id": "ego_b", "batch": True}).encode("utf-8"), ("127.0.0.1", SERVER_PORT))
+            self.assertTrue(self.wait_for(lambda: self.server.n_received == 2))
+            self.assertFalse(self.server.accepts_batches(CLIENT_IP))
+            self.assertTrue(self.server.accepts_batches(batch_ip))
+
+            neighbors = {
+                "nv_1": {"msg_type": "bsm", "id": "nv_1", "speed": 1.0, "rel_long_gap": 10.0},
+                "nv_2": {"msg_type": "bsm", "id": "nv_2", "speed": 2.0, "rel_long_gap": -5.0},
+            }
+            publisher = NeighborPublisher(self.server.wire)
+            self.server.send_neighbors([
+                (CLIENT_IP, neighbors, {"ego": "ego"}),
+                (batch_ip, neighbors, {"ego": "ego_b"}),
+            ], publisher)
+
+            # Standard client - one BSM per datagram, as the client keys them by ID
+            received = {}
+            for _ in neighbors:
+                data, _ = self.bsm_socket.recvfrom(65535)
+                bsm = json.loads(data)
+                received[bsm["id"]] = bsm
+            self.assertEqual(received, neighbors)
+
+            # Batching client - one datagram merged into its neighbor table
+            data, _ = batch_bsm_socket.recvfrom(65535)
+            message = json.loads(data)
+            self.assertEqual(message["msg_type"], "bsm_batch")
+            self.assertEqual(message["ego"], "ego_b")
+            self.assertEqual(NeighborTable().apply(message), neighbors)
+
+            # Lockstep - every datagram is marked with the frame, and the counts tell the clients how many to wait for
+            counts = self.server.send_neighbors([
+                (CLIENT_IP, neighbors, {"ego": "ego"}),
+                (batch_ip, neighbors, {"ego": "ego_b"}),
+            ], publisher, frame=3)
+            self.assertEqual(counts, {CLIENT_IP: 2, batch_ip: 1})
+
+            for _ in neighbors:
+                data, _ = self.bsm_socket.recvfrom(65535)
+                self.assertEqual(json.loads(data)["frame"], 3)
+
+            data, _ = batch_bsm_socket.recvfrom(65535)
+            self.assertEqual(json.loads(data)["frame"], 3)
+
+        finally:
+            batch_socket.close()
+            batch_bsm_socket.close()
+
+    def tearDown(self):
+        """Stop the server and close client sockets."""
+        self.server.stop()
+        self.client_socket.close()
+        self.bsm_socket.close()
+        self.sim_socket.close()
+
+if __name__ == "__main__":
+    unittest.main()
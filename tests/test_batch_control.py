@@ -0,0 +1,66 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import numpy as np
+from batch_control import EGO_STATES, LEADER_STATES, ScalarCommands, batched, dependency_levels, evaluate_commands
+from comms_buffer import RingCommunications
+
+class FollowLeaderPlan:
+    """Scalar controller that plans one point ahead of the leader's broadcast, or at its own position without one."""
+    def __init__(self):
+        self.calls = 0
+
+    def getCommand(self, sim_time, ego_accel, ego_speed, ego_distance, s_max, v_max, lead_accel, lead_speed, lead_rel_distance, lead_t, lead_s, lead_v):
+        self.calls += 1
+        s = lead_s[0] - 1.0 if lead_s else ego_distance
+        return 0.1*ego_speed, [sim_time], [s], [ego_speed], [0.0]
+
+class TestBatchControl(unittest.TestCase):
+    def test_scalar_adapter(self):
+        """Ensure scalar controllers are evaluated per vehicle and return arrays in ego order."""
+        controller = FollowLeaderPlan()
+        adapter = batched(controller)
+        self.assertIsInstance(adapter, ScalarCommands)
+        self.assertIs(batched(adapter), adapter)
+
+        ego_states = np.array([[0., 10., 0., 100., 30.], [0., 20., 5., 100., 30.]])
+        leader_states = np.zeros((2, len(LEADER_STATES)))
+        accels, times, positions, velocities, _ = adapter.getCommands(1.0, ["a", "b"], ego_states, leader_states, [([], [], [])]*2)
+
+        self.assertEqual(controller.calls, 2)
+        np.testing.assert_allclose(accels, [1.0, 2.0])
+        self.assertEqual(positions, [[0.0], [5.0]])
+        self.assertEqual(velocities, [[10.0], [20.0]])
+
+    def test_dependency_levels(self):
+        """Ensure CAVs are levelled behind their CAV leaders and cycles are cut."""
+        levels = dependency_levels(["c", "b", "a", "x"], ["b", "a", "hdv_1", "-1"])
+        np.testing.assert_array_equal(levels, [2, 1, 0, 0])
+
+        levels = dependency_levels(["a", "b", "c"], ["c", "a", "b"])
+        self.assertEqual(sorted(levels.tolist()), [0, 1, 2])
+
+    def test_same_step_broadcasts(self):
+        """Ensure followers read the broadcast of their leader from the same step whatever the CAV order."""
+        comms = RingCommunications()
+        controller = FollowLeaderPlan()
+
+        # Follower first in the loop order
+        ego_ids, lead_ids = ["follower", "leader"], ["leader", "-1"]
+        ego_states = np.array([[0., 10., 0., 100., 30.], [0., 10., 50., 100., 30.]])
+        leader_states = np.array([[0., 10., 20.], [0., 0., 2000.]])
+        self.assertEqual(ego_states.shape[1], len(EGO_STATES))
+
+        accels, times, positions, _, _ = evaluate_commands(controller, 3.0, ego_ids, lead_ids, ego_states, leader_states, comms)
+
+        self.assertEqual(positions[1], [50.0])
+        self.assertEqual(positions[0], [50.0 + 20.0 - 1.0])
+        self.assertEqual(comms.get_veh_comms("follower", 3.0)[1], [69.0])
+        np.testing.assert_allclose(accels, [1.0, 1.0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import os
+import pickle
+import tempfile
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+import main
+from comms_buffer import RingCommunications
+
+class Controller:
+    """Controller that records the restored state."""
+    def __init__(self):
+        self.state = None
+
+    def get_state(self):
+        return self.state
+
+    def set_state(self, state):
+        self.state = state
+
+class TestLoadCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "checkpoint")
+
+        comms = RingCommunications()
+        comms.update_veh_comms("cav_0", [0.0, 0.1], [10.0, 11.0], sim_time=0.0)
+        with open(self.path + ".pkl", "wb") as f:
+            pickle.dump({
+                'version': main.CHECKPOINT_VERSION, 'sim_time': 100.0, 'scenario': 'onramp', 'penetration': 0.5, 'seed': 0,
+                'spawned_vehs': {"cav_0": 'cav', "hdv_0": 'hdv'}, 'has_set_vehs': {"cav_0"},
+                'active_vehs': {'hdv': {"hdv_0": None}, 'cav': {"cav_0": None}, 'ext': {}},
+                'comms': comms, 'controller': {'horizon': 5},
+            }, f)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_sim(self, penetration):
+        """Return a simulation with the attributes that load_checkpoint reads, without starting SUMO."""
+        sim = main.simulation.__new__(main.simulation)
+        sim.args = Namespace(scenario='onramp', penetration=penetration, comms_latency=0.0, comms_jitter=0.0, comms_loss=0.0)
+        sim.dt = 0.1
+        sim.ext_type_id = 'ext'
+        sim.active_vehs = {'hdv': {}, 'cav': {}, 'ext': {}}
+        sim.colors = {'hdv': (0, 0, 255), 'cav': (255, 0, 0)}
+        sim.use_subscriptions = False
+        sim.use_context_subscriptions = False
+        return sim
+
+    def test_restored_cavs_without_penetration(self):
+        """Ensure the CAVs of a checkpoint are still controlled when the run has a penetration of 0."""
+        sim = self.make_sim(penetration=0.0)
+        with mock.patch.object(main, "traci") as traci, mock.patch.object(main, "PCC", Controller):
+            traci.simulation.getTime.return_value = 100.0
+            traci.vehicle.getIDList.return_value = ["cav_0", "hdv_0"]
+            sim.load_checkpoint(self.path)
+
+        self.assertEqual(list(sim.active_vehs['cav']), ["cav_0"])
+        self.assertIsInstance(sim.ego, Controller)
+        self.assertEqual(sim.ego.state, {'horizon': 5})
+        traci.vehicle.setSpeedMode.assert_called_once_with("cav_0", int('1100000', 2))
+
+    def test_no_restored_cavs(self):
+        """Ensure no controller is created when no CAV is restored."""
+        sim = self.make_sim(penetration=0.0)
+        with mock.patch.object(main, "traci") as traci, mock.patch.object(main, "PCC", Controller):
+            traci.simulation.getTime.return_value = 100.0
+            traci.vehicle.getIDList.return_value = ["hdv_0"]
+            sim.load_checkpoint(self.path)
+
+        self.assertEqual(sim.active_vehs['cav'], {})
+        self.assertFalse(hasattr(sim, 'ego'))
+
+if __name__ == "__main__":
+    unittest.main()
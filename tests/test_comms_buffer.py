@@ -0,0 +1,101 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+from comms_buffer import RingCommunications, min_history
+
+class TestRingCommunications(unittest.TestCase):
+    def setUp(self):
+        """Set up a store with room for two vehicles."""
+        self.comms = RingCommunications(capacity=2, history=3, traj_len=4)
+
+    def test_latest_message(self):
+        """Ensure the newest trajectory is returned, shifted by the distance from the subject vehicle."""
+        self.comms.update_veh_comms("cav_1", [0.0, 0.1], [0.0, 1.0], [10.0, 10.0], sim_time=0.0)
+        self.comms.update_veh_comms("cav_1", [0.1, 0.2], [1.0, 2.0], sim_time=0.1)
+
+        t, s, v = self.comms.get_veh_comms("cav_1", 0.1, distance_from_sv=20.0)
+        self.assertEqual(t, [0.1, 0.2])
+        self.assertEqual(s, [21.0, 22.0])
+        self.assertEqual(v, [])
+        self.assertEqual(self.comms.get_veh_comms("-1", 0.1), ([], [], []))
+
+    def test_eviction_reuses_slots(self):
+        """Ensure departed vehicles free their slots so memory stays constant."""
+        nbytes = self.comms.nbytes
+        for k in range(100):
+            self.comms.update_veh_comms(f"cav_{k}", [0.0], [0.0], sim_time=0.1*k)
+            self.comms.remove_veh(f"cav_{k}")
+
+        self.assertEqual(len(self.comms), 0)
+        self.assertEqual(self.comms.nbytes, nbytes)
+
+    def test_growth(self):
+        """Ensure more vehicles and longer trajectories than allocated keep their messages."""
+        for k in range(5):
+            self.comms.update_veh_comms(f"cav_{k}", [0.0], [float(k)])
+        self.comms.update_veh_comms("cav_9", list(range(10)), list(range(10)))
+
+        self.assertEqual(self.comms.get_veh_comms("cav_3", 0.0)[1], [3.0])
+        self.assertEqual(len(self.comms.get_veh_comms("cav_9", 0.0)[0]), 10)
+
+    def test_latency(self):
+        """Ensure messages are only seen once delivered, falling back to the last delivered one."""
+        comms = RingCommunications(history=4, latency=0.25)
+        comms.update_veh_comms("cav_1", [0.0], [1.0], sim_time=0.0)
+        self.assertEqual(comms.get_veh_comms("cav_1", 0.1), ([], [], []))
+
+        comms.update_veh_comms("cav_1", [0.3], [2.0], sim_time=0.3)
+        self.assertEqual(comms.get_veh_comms("cav_1", 0.4)[1], [1.0])
+        self.assertEqual(comms.get_veh_comms("cav_1", 0.6)[1], [2.0])
+
+    def test_long_latency(self):
+        """Ensure a delay longer than the default history still delivers with the history sized for it."""
+        dt, latency, jitter = 0.1, 0.55, 0.1
+        history = min_history(latency, jitter, dt)
+        self.assertTrue(latency > 4*dt)
+        self.assertEqual(history, 8)
+
+        comms = RingCommunications(history=history, latency=latency, jitter=jitter, seed=0)
+        short = RingCommunications(history=4, latency=latency, jitter=jitter, seed=0)
+        for k in range(50):
+            comms.update_veh_comms("cav_1", [k*dt], [float(k)], sim_time=k*dt)
+            short.update_veh_comms("cav_1", [k*dt], [float(k)], sim_time=k*dt)
+
+            # The oldest message kept was sent at least latency + jitter ago, so it or a newer one is delivered
+            if k >= history - 1:
+                sent = comms.get_veh_comms("cav_1", k*dt)[1]
+                self.assertTrue(sent and sent[0] >= k - history + 1)
+
+            # Messages in flight overwrite each other in the default history
+            self.assertEqual(short.get_veh_comms("cav_1", k*dt), ([], [], []))
+
+    def test_set_history(self):
+        """Ensure growing the history keeps the stored messages in order."""
+        comms = RingCommunications(history=3, latency=0.25)
+        for k in range(5):
+            comms.update_veh_comms("cav_1", [0.1*k], [float(k)], sim_time=0.1*k)
+
+        comms.set_history(6)
+        self.assertEqual(comms.get_veh_comms("cav_1", 0.5)[1], [2.0])
+        self.assertEqual(comms.get_veh_comms("cav_1", 1.0)[1], [4.0])
+
+        for k in range(5, 8):
+            comms.update_veh_comms("cav_1", [0.1*k], [float(k)], sim_time=0.1*k)
+        self.assertEqual(comms.get_veh_comms("cav_1", 0.7)[1], [4.0])
+        self.assertEqual(comms.count[comms.slots["cav_1"]], 6)
+
+    def test_loss(self):
+        """Ensure lost messages are counted and never delivered."""
+        comms = RingCommunications(loss=0.5, seed=0)
+        for k in range(1000):
+            comms.update_veh_comms("cav_1", [0.0], [0.0], sim_time=0.1*k)
+
+        self.assertEqual(comms.n_sent, 1000)
+        self.assertTrue(400 < comms.n_lost < 600)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import numpy as np
+import ext.dynamics as dynamics
+from ext.dynamics import step_dyn, step_dyn_batch
+
+DT = 0.1
+
+class TestBatchDynamics(unittest.TestCase):
+    def setUp(self):
+        """Set up a fleet with random states and controls."""
+        rng = np.random.default_rng(0)
+        n = 20
+
+        self.X = np.column_stack([
+            rng.normal(size=n), rng.normal(size=n), rng.uniform(0., 20., n), rng.normal(size=n), rng.normal(size=n)
+        ])
+        self.U = np.column_stack([3.*rng.normal(size=n), 0.1*rng.normal(size=n)])
+
+    def step_scalar(self, X, U):
+        return np.array([step_dyn(DT, 0., *x, *u)[1:] for x, u in zip(X, U)])
+
+    def test_matches_scalar(self):
+        """Ensure a batched step matches one scalar step per vehicle."""
+        expected = self.step_scalar(self.X, self.U)
+        X = step_dyn_batch(DT, self.X.copy(), self.U)
+        np.testing.assert_allclose(X, expected, rtol=0, atol=1e-12)
+
+    def test_no_reverse(self):
+        """Ensure a vehicle braking to a stop keeps its position and heading at zero speed."""
+        self.X[0, 2] = 0.01
+        self.U[0, 0] = -9.
+
+        expected = self.step_scalar(self.X, self.U)
+        X = step_dyn_batch(DT, self.X.copy(), self.U)
+
+        np.testing.assert_array_equal(X[0], [self.X[0, 0], self.X[0, 1], 0., 0., self.X[0, 4]])
+        np.testing.assert_allclose(X, expected, rtol=0, atol=1e-12)
+
+    def test_repeated_steps(self):
+        """Ensure reused work buffers give the same trajectory as the scalar path."""
+        X = self.X.copy()
+        expected = self.X.copy()
+        for _ in range(10):
+            step_dyn_batch(DT, X, self.U)
+            expected = self.step_scalar(expected, self.U)
+
+        np.testing.assert_allclose(X, expected, rtol=0, atol=1e-9)
+
+    def test_fleet_sizes(self):
+        """Ensure fleets of varying sizes share one set of work buffers sized for the largest."""
+        for n in (20, 5, 12, 5, 20):
+            X = step_dyn_batch(DT, self.X[:n].copy(), self.U[:n])
+            np.testing.assert_allclose(X, self.step_scalar(self.X[:n], self.U[:n]), rtol=0, atol=1e-12)
+
+        self.assertGreaterEqual(dynamics._BATCH_WORK.n, 20)
+        self.assertTrue(np.shares_memory(dynamics._BATCH_WORK.view(5).k, dynamics._BATCH_WORK.k))
+
+if __name__ == "__main__":
+    unittest.main()
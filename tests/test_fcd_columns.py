@@ -0,0 +1,167 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from scripts.utils_fcd import read_fcd_columns, load_fcd_columns, read_fcd_sidecar, write_fcd_sidecar, get_sidecar_dir, split_fcd_chunks, _parse_fcd_chunk, _merge_chunks, INT_COLUMNS, FLOAT_COLUMNS
+
+FCD = '''<?xml version="1.0" encoding="UTF-8"?>
+<!-- generated by Eclipse SUMO
+<configuration>
+    <fcd-output value="fcd.xml"/>
+</configuration>
+-->
+<fcd-export xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+    <timestep time="0.00">
+        <vehicle id="a" x="1.00" y="2.00" type="HDV" speed="10.00" pos="90.00" lane="main_0" acceleration="0.50" leaderSpeed="-1.00" leaderGap="0.00"/>
+        <vehicle id="b" x="3.00" type="cav" speed="12.00" pos="50.00" lane="main_1" acceleration="-0.50" leaderID="a" leaderSpeed="10.00" leaderGap="40.00"/>
+    </timestep>
+    <timestep time="0.10"/>
+    <timestep time="0.20">
+        <vehicle id="b" x="4.00" y="0.00" type="cav" speed="12.00" pos="52.40" lane="main_0" acceleration="0.00"/>
+        <vehicle id="a" x="2.00" y="2.00" type="hdv" speed="10.00" pos="92.00" acceleration="0.50"/>
+        <vehicle id="c" x="5.00" y="0.00" type="hdv" speed="bad" pos="1.00" lane="main_0" acceleration="0.00"/>
+    </timestep>
+</fcd-export>
+'''
+
+class TestFcdColumns(unittest.TestCase):
+    def setUp(self):
+        """Set up a small FCD file."""
+        fd, self.path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write(FCD)
+
+        self.fcd = read_fcd_columns(self.path)
+
+    def tearDown(self):
+        sidecar = get_sidecar_dir(self.path)
+        if os.path.isdir(sidecar):
+            for name in os.listdir(sidecar):
+                os.remove(os.path.join(sidecar, name))
+            os.rmdir(sidecar)
+        os.remove(self.path)
+
+    def test_columns(self):
+        """Ensure samples are decoded in file order with interned IDs and defaults for missing attributes."""
+        fcd = self.fcd
+        self.assertEqual(len(fcd), 4)
+        np.testing.assert_array_equal(fcd.times, [0.0, 0.1, 0.2])
+        np.testing.assert_array_equal(fcd.step, [0, 0, 2, 2])
+        np.testing.assert_array_equal(fcd.time, [0.0, 0.0, 0.2, 0.2])
+
+        self.assertEqual(fcd.veh_ids, ["a", "b"])
+        self.assertEqual(fcd.type_ids, ["HDV", "cav"])
+        self.assertEqual([fcd.lane_ids[l] for l in fcd.lane], ["main_0", "main_1", "main_0", ""])
+        np.testing.assert_array_equal(fcd.sample_type, [0, 1, 1, 0])
+
+        self.assertTrue(np.isnan(fcd.y[1]))
+        np.testing.assert_array_equal(fcd.leader_gap, [0.0, 40.0, 0.0, 0.0])
+        np.testing.assert_array_equal(fcd.leader_speed, [-1.0, 10.0, -1.0, -1.0])
+        np.testing.assert_array_equal(fcd.leader, [-1, 0, -1, -1])
+
+    def test_groups(self):
+        """Ensure samples group by vehicle in file order and lane changes pair consecutive samples."""
+        order, vehs, starts, ends = self.fcd.group_by_vehicle()
+        np.testing.assert_array_equal(vehs, [0, 1])
+        np.testing.assert_array_equal(order[starts[1]:ends[1]], [1, 2])
+
+        prev, cur = self.fcd.lane_changes()
+        np.testing.assert_array_equal(prev, [1, 0])
+        np.testing.assert_array_equal(cur, [2, 3])
+
+    def test_chunks(self):
+        """Ensure parsing the file in chunks split at timesteps and merging them matches one pass."""
+        for n_chunks in (2, 3, 8):
+            chunks = split_fcd_chunks(self.path, n_chunks)
+            self.assertTrue(all(c[3] == "fcd-export" for c in chunks))
+
+            fcd = _merge_chunks([_parse_fcd_chunk(c) for c in chunks])
+            self.assertEqual(fcd.veh_ids, self.fcd.veh_ids)
+            self.assertEqual(fcd.lane_ids, self.fcd.lane_ids)
+            self.assertEqual(fcd.type_ids, self.fcd.type_ids)
+            for name in ("times",) + INT_COLUMNS + tuple(name for name, _, _ in FLOAT_COLUMNS):
+                np.testing.assert_array_equal(getattr(fcd, name), getattr(self.fcd, name))
+
+    def test_missing_attributes(self):
+        """Ensure samples without acceleration or position are kept with nan, and can be selected out."""
+        fd, path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write('<fcd-export>\n    <timestep time="0.00">\n')
+            f.write('        <vehicle id="a" x="1.00" y="2.00" type="hdv" speed="10.00" pos="5.00" lane="main_0"/>\n')
+            f.write('        <vehicle id="b" x="3.00" y="2.00" type="hdv" speed="12.00" lane="main_0"/>\n')
+            f.write('    </timestep>\n</fcd-export>\n')
+
+        try:
+            for fcd in (read_fcd_columns(path), _merge_chunks([_parse_fcd_chunk(c) for c in split_fcd_chunks(path, 2)])):
+                self.assertEqual(len(fcd), 2)
+                self.assertTrue(np.isnan(fcd.accel).all())
+                np.testing.assert_array_equal(fcd.speed, [10.0, 12.0])
+                np.testing.assert_array_equal(fcd.has("pos"), [True, False])
+
+            fcd = read_fcd_columns(path)
+            sub = fcd.subset(np.flatnonzero(fcd.has("pos")))
+            self.assertEqual([sub.veh_ids[v] for v in sub.veh], ["a"])
+            np.testing.assert_array_equal(sub.pos, [5.0])
+            self.assertEqual(len(fcd.has("pos", "accel").nonzero()[0]), 0)
+        finally:
+            os.remove(path)
+
+    def test_many_types(self):
+        """Ensure more vehicle types than fit in a byte are indexed in one pass and in chunks."""
+        n = 300
+        fd, path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write('<fcd-export>\n')
+            for k in range(3):
+                f.write(f'    <timestep time="{k}.00">\n')
+                for v in range(k*n//3, (k+1)*n//3):
+                    f.write(f'        <vehicle id="v{v}" x="0.00" y="0.00" type="t{v}" speed="1.00" pos="0.00" lane="main_0" acceleration="0.00"/>\n')
+                f.write('    </timestep>\n')
+            f.write('</fcd-export>\n')
+
+        try:
+            fcd = read_fcd_columns(path)
+            self.assertEqual(len(fcd.type_ids), n)
+            self.assertEqual([fcd.type_ids[t] for t in fcd.veh_type], [f"t{v}" for v in range(n)])
+
+            merged = _merge_chunks([_parse_fcd_chunk(c) for c in split_fcd_chunks(path, 3)])
+            np.testing.assert_array_equal(merged.veh_type, fcd.veh_type)
+        finally:
+            os.remove(path)
+
+    def test_sidecar(self):
+        """Ensure the sidecar is written on first load, preferred while fresh and ignored once the FCD changes."""
+        self.assertIsNone(read_fcd_sidecar(self.path))
+
+        load_fcd_columns(self.path)
+        fcd = read_fcd_sidecar(self.path)
+        self.assertIsNotNone(fcd)
+        self.assertEqual(fcd.veh_ids, self.fcd.veh_ids)
+        for name in ("times", "step", "veh", "lane", "leader", "veh_type", "pos", "y", "leader_speed"):
+            np.testing.assert_array_equal(getattr(fcd, name), getattr(self.fcd, name))
+
+        with open(self.path, "a") as f:
+            f.write("\n")
+        self.assertIsNone(read_fcd_sidecar(self.path))
+
+        df = load_fcd_columns(self.path).to_frame()
+        self.assertEqual(df["vehicle_id"].tolist(), ["a", "b", "b", "a"])
+        self.assertEqual(df["leader_id"].iloc[1], "a")
+        self.assertIsNotNone(read_fcd_sidecar(self.path))
+
+        # Rewriting the sidecar replaces its files, so arrays already memory-mapped keep their content
+        mapped = read_fcd_sidecar(self.path)
+        pos = np.array(mapped.pos)
+        write_fcd_sidecar(self.path, self.fcd.subset(np.arange(1)))
+        np.testing.assert_array_equal(mapped.pos, pos)
+        self.assertEqual(len(read_fcd_sidecar(self.path)), 1)
+        self.assertFalse([name for name in os.listdir(get_sidecar_dir(self.path)) if name.endswith(".tmp")])
+
+if __name__ == "__main__":
+    unittest.main()
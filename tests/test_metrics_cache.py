@@ -0,0 +1,137 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from collections import defaultdict
+from unittest import mock
+from analysis import _encode_metric, _decode_metric, _write_metric_families, _read_metrics_index, CachedMetrics, TrafficMetrics, load_or_build_metrics
+
+FCD = '''<fcd-export>
+    <timestep time="0.00">
+        <vehicle id="a" x="1.00" y="2.00" type="hdv" speed="10.00" pos="90.00" lane="main_0" acceleration="0.50"/>
+        <vehicle id="b" x="3.00" y="0.00" type="cav" speed="12.00" pos="50.00" lane="main_0" acceleration="0.00" leaderID="a" leaderGap="40.00"/>
+    </timestep>
+    <timestep time="0.10">
+        <vehicle id="a" x="2.00" y="2.00" type="hdv" speed="10.00" pos="91.00" lane="main_0" acceleration="0.50"/>
+        <vehicle id="b" x="4.00" y="0.00" type="cav" speed="12.00" pos="51.20" lane="main_0" acceleration="0.00" leaderID="a" leaderGap="39.80"/>
+    </timestep>
+</fcd-export>
+'''
+
+class TestMetricsCache(unittest.TestCase):
+    def setUp(self):
+        """Set up a few metrics of each shape."""
+        grid = defaultdict(lambda: defaultdict(dict))
+        grid[0.0]["main_0"] = {"a": 1.5, "b": 20.0}
+        grid[0.1] = {}
+
+        self.m = SimpleNamespace(
+            speeds={"hdv": [1.0, 2.5], "cav": []},
+            travel_times={"hdv": {"a": 12.0}, "cav": {}},
+            positions={"hdv": {"a": [(0.0, 1.5), (0.1, 2.0)]}, "cav": {}},
+            vehicle_lane_history={"hdv": defaultdict(list, {"a": [(0.1, "main_0", "main_1")]}), "cav": defaultdict(list)},
+            timestep_lane_positions_all=grid,
+            timestep_lane_occupancy={0.0: {"main_0": {"a", "b"}}},
+            gor_type={"all_green_time": 0.0, "cav": None, "hdv": None},
+            simulation_stats={"fuel": {"hdv_fuel_efficiency_mpg": 30.0}},
+            num_cavs=0,
+            fcd=object(),
+        )
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_codecs(self):
+        """Ensure each codec decodes to the value it encoded."""
+        for attr, codec in (("speeds", "lists"), ("travel_times", "keyed"), ("positions", "ragged"),
+                            ("vehicle_lane_history", "ragged"), ("timestep_lane_positions_all", "grid"),
+                            ("timestep_lane_occupancy", "grid"), ("gor_type", "pickle")):
+            value = getattr(self.m, attr)
+            self.assertEqual(_decode_metric(_encode_metric(value, codec), codec), value, attr)
+
+        with self.assertRaises(TypeError):
+            _encode_metric({"hdv": [None]}, "lists")
+
+    def test_grid_missing_keys(self):
+        """Ensure decoded grids are nested defaultdicts, so missing times and lanes read as empty cells."""
+        grid = _decode_metric(_encode_metric(self.m.timestep_lane_positions_all, "grid"), "grid")
+        self.assertEqual(grid[0.1]["main_0"], {})
+        self.assertEqual(grid[9.9]["main_0"], {})
+        self.assertEqual(grid[0.0]["main_0"], {"a": 1.5, "b": 20.0})
+
+        occupancy = _decode_metric(_encode_metric(self.m.timestep_lane_occupancy, "grid"), "grid")
+        self.assertEqual(occupancy[0.0]["main_1"], set())
+
+    def test_lazy_load(self):
+        """Ensure families are written per signature and attributes are decoded on first access."""
+        sigs = {"distributions": "d1", "trajectories": "t1", "raw": "r1", "lane_grid": "l1", "urban": "u1", "summary": "s1"}
+        _write_metric_families(self.cache_dir, self.m, sigs, _read_metrics_index(self.cache_dir))
+
+        index = _read_metrics_index(self.cache_dir)
+        self.assertEqual({f: e["sig"] for f, e in index["families"].items()}, sigs)
+        self.assertNotIn("fcd", index["families"]["summary"]["attrs"])
+
+        c = CachedMetrics(self.cache_dir, index)
+        self.assertNotIn("speeds", vars(c))
+        self.assertEqual(c.speeds, self.m.speeds)
+        self.assertIn("speeds", vars(c))
+        self.assertEqual(c.simulation_stats, self.m.simulation_stats)
+        self.assertEqual(getattr(c, "EPS_PET", 0.1), 0.1)
+
+        # Rewriting one family keeps the others
+        _write_metric_families(self.cache_dir, self.m, {"distributions": "d2"}, index)
+        index = _read_metrics_index(self.cache_dir)
+        self.assertEqual(index["families"]["distributions"]["sig"], "d2")
+        self.assertEqual(index["families"]["raw"]["sig"], "r1")
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, "raw.npz")))
+
+    def test_many_types(self):
+        """Ensure vehicles keep their type when the FCD has more than 127 vehicle types."""
+        with open(os.path.join(self.cache_dir, "fcd_p0.xml"), "w") as f:
+            f.write('<fcd-export>\n')
+            for k in range(2):
+                f.write(f'    <timestep time="{0.1*k:.2f}">\n')
+                for i in range(130):
+                    f.write(f'        <vehicle id="v{i}" x="{i}.00" y="0.00" type="{"cav" if i == 129 else f"t{i}"}" '
+                            f'speed="{10.0 + 0.1*i:.2f}" pos="{100.0 + k}" lane="lane{i}_0" acceleration="0.00"/>\n')
+                f.write('    </timestep>\n')
+            f.write('</fcd-export>\n')
+
+        m = TrafficMetrics(self.cache_dir, save_metrics=False, penetration_tag="p0")
+        self.assertEqual(m.speeds["cav"], [22.9, 22.9])
+
+    def test_stale_summary(self):
+        """Ensure a changed stats file only reparses the stats on top of the cached FCD metrics."""
+        with open(os.path.join(self.cache_dir, "fcd_p0.xml"), "w") as f:
+            f.write(FCD)
+        stats_file = os.path.join(self.cache_dir, "stats_p0.xml")
+        with open(stats_file, "w") as f:
+            f.write('<statistics><vehicles loaded="2"/></statistics>')
+
+        m = load_or_build_metrics(self.cache_dir, urban_mode=False, penetration_tag="p0")
+        self.assertIsInstance(m, TrafficMetrics)
+
+        with open(stats_file, "w") as f:
+            f.write('<statistics><vehicles loaded="3" running="1"/></statistics>')
+        with mock.patch.object(TrafficMetrics, "compute_fcd_metrics", side_effect=AssertionError("FCD metrics recomputed")):
+            c = load_or_build_metrics(self.cache_dir, urban_mode=False, penetration_tag="p0")
+
+        self.assertIsInstance(c, CachedMetrics)
+        self.assertEqual(c.simulation_stats["vehicles"], {"loaded": 3, "running": 1})
+        self.assertEqual(c.simulation_stats["fuel"], m.simulation_stats["fuel"])
+        self.assertEqual(c.speeds, m.speeds)
+
+        c = load_or_build_metrics(self.cache_dir, urban_mode=False, penetration_tag="p0")
+        self.assertEqual(c.simulation_stats["vehicles"], {"loaded": 3, "running": 1})
+        self.assertEqual(c.timesteps, m.timesteps)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+from step_timing import PhaseHistogram, StepTimer
+
+class TestPhaseHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        """Ensure percentiles land in the bin of the sample and never exceed the max."""
+        hist = PhaseHistogram()
+        for _ in range(90):
+            hist.add(1e-3)
+        for _ in range(10):
+            hist.add(1e-1)
+
+        self.assertEqual(hist.n, 100)
+        self.assertAlmostEqual(hist.total, 90*1e-3 + 10*1e-1)
+        self.assertTrue(1e-3 <= hist.percentile(50) <= 1e-3 * 10**(1/20))
+        self.assertTrue(1e-3 <= hist.percentile(90) <= 1e-3 * 10**(1/20))
+        self.assertEqual(hist.percentile(95), 1e-1)
+        self.assertEqual(hist.percentile(100), 1e-1)
+        self.assertEqual(PhaseHistogram().percentile(50), 0.)
+
+class TestStepTimer(unittest.TestCase):
+    def test_conditional_phases(self):
+        """Ensure a phase is only binned in the steps it was lapped."""
+        timer = StepTimer(enabled=True)
+        for k in range(10):
+            timer.start_step()
+            timer.lap('simulationStep')
+            if k % 5 == 0:
+                timer.lap('comms_update')
+            timer.end_step()
+
+        summary = timer.summary()
+        self.assertEqual(timer.n_steps, 10)
+        self.assertEqual(summary['simulationStep']['count'], 10)
+        self.assertEqual(summary['comms_update']['count'], 2)
+        self.assertEqual(summary['controller']['count'], 0)
+        self.assertEqual(summary['total']['count'], 10)
+        self.assertEqual(summary['other']['count'], 10)
+
+    def test_disabled(self):
+        """Ensure a disabled timer only counts steps."""
+        timer = StepTimer()
+        timer.start_step()
+        timer.lap('simulationStep')
+        timer.end_step()
+
+        self.assertEqual(timer.n_steps, 1)
+        self.assertEqual(timer.summary()['total']['count'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
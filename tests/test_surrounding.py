@@ -0,0 +1,61 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+from unittest import mock
+
+import main
+import traci.constants as tc
+
+def vehicle(x, y, length=5.0):
+    return {tc.VAR_POSITION: (x, y), tc.VAR_ANGLE: 90.0, tc.VAR_SPEED: 20.0, tc.VAR_LENGTH: length}
+
+class TestSurroundingVehicles(unittest.TestCase):
+    def setUp(self):
+        """Set up an ego heading east on a three-lane road, with its neighbors in its context."""
+        self.sim = main.simulation.__new__(main.simulation)
+        self.sim.use_subscriptions = True
+        self.sim.veh_states = {"ego": vehicle(100.0, 0.0)}
+        self.sim.neighbor_states = {"ego": {
+            "ego": vehicle(100.0, 0.0),
+            "lead": vehicle(130.0, 0.0),
+            "follow": vehicle(80.0, 0.0, length=4.0),
+            "left_lead": vehicle(110.0, main.LANEWIDTH),
+            "right_follow": vehicle(90.0, -main.LANEWIDTH),
+        }}
+
+    def test_context(self):
+        """Ensure neighbors are read from the context subscription without the TraCI getters."""
+        with mock.patch.object(main, "traci") as traci:
+            surrounding = self.sim.get_surrounding_vehicles("ego")
+
+        self.assertEqual(sorted(surrounding), sorted([
+            ("follow", -15.0, 0.0),
+            ("left_lead", 5.0, main.LANEWIDTH),
+            ("right_follow", -5.0, -main.LANEWIDTH),
+        ]))
+        traci.vehicle.getFollower.assert_not_called()
+        traci.vehicle.getLeftLeaders.assert_not_called()
+
+    def test_getters(self):
+        """Ensure the TraCI getters are used when the ego has no context subscription."""
+        self.sim.neighbor_states = {}
+        with mock.patch.object(main, "traci") as traci:
+            traci.vehicle.getFollower.return_value = ("follow", 15.0)
+            traci.vehicle.getLeftLeaders.return_value = [("left_lead", 5.0)]
+            traci.vehicle.getRightLeaders.return_value = []
+            traci.vehicle.getLeftFollowers.return_value = []
+            traci.vehicle.getRightFollowers.return_value = [("right_follow", 5.0)]
+            surrounding = self.sim.get_surrounding_vehicles("ego")
+
+        self.assertEqual(surrounding, [
+            ("follow", -15.0, 0.0),
+            ("left_lead", 5.0, main.LANEWIDTH),
+            ("right_follow", -5.0, -main.LANEWIDTH),
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import json
+import tempfile
+import os
+from xil_telemetry import XILTelemetry
+
+class TestXILTelemetry(unittest.TestCase):
+    def setUp(self):
+        """Set up telemetry of a 10 Hz loop."""
+        self.telemetry = XILTelemetry(period=0.1)
+
+    def test_latency_and_loss(self):
+        """Ensure latency, drops, duplicates and out-of-order messages are counted."""
+        for sent_time in (0.0, 0.1, 0.2, 0.5, 0.5, 0.4, 0.6):
+            self.telemetry.record_message("client", sent_time, recv_time=sent_time + 0.01)
+
+        link = self.telemetry.links["client"]
+        self.assertEqual(link.n_received, 6)
+        self.assertEqual(link.n_dropped, 2)
+        self.assertEqual(link.n_out_of_order, 1)
+        self.assertAlmostEqual(link.latency.total / link.latency.n, 0.01)
+        self.assertAlmostEqual(link.jitter, 0.0)
+
+    def test_frames_and_export(self):
+        """Ensure frame-deadline misses are counted and exported."""
+        self.telemetry.record_frame(0.05)
+        self.assertTrue(self.telemetry.record_frame(0.15))
+        self.telemetry.record_rtt("client", 1.0, recv_time=1.2)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.telemetry.export(output_dir, "xil_telemetry_test")
+
+            with open(os.path.join(output_dir, "xil_telemetry_test_summary.json")) as f:
+                summary = json.load(f)
+            self.assertTrue(os.path.isfile(os.path.join(output_dir, "xil_telemetry_test_series.csv")))
+
+        self.assertEqual(summary["n_deadline_misses"], 1)
+        self.assertEqual(summary["links"]["client"]["rtt"]["count"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
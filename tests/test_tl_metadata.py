@@ -0,0 +1,47 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import main
+
+def logic(program_id, states):
+    phases = [SimpleNamespace(state=state, duration=30.0, minDur=5.0, maxDur=60.0, name=str(i)) for i, state in enumerate(states)]
+    return SimpleNamespace(programID=program_id, phases=phases, getParameter=lambda key: "")
+
+class TestTrafficLightMetadata(unittest.TestCase):
+    def setUp(self):
+        self.sim = main.simulation.__new__(main.simulation)
+        self.sim.tl_metadata = {}
+        self.sim.tl_route_link_index = {}
+
+    def build(self, program):
+        with mock.patch.object(main, "traci") as traci:
+            traci.trafficlight.getAllProgramLogics.return_value = [logic("0", ["Gr", "yr", "rG"]), logic("night", ["rr", "GG"])]
+            traci.trafficlight.getProgram.return_value = program
+            traci.trafficlight.getControlledLanes.return_value = ["in_0", "side_0"]
+            return self.sim.build_tl_metadata("tl")
+
+    def test_running_program(self):
+        """Ensure the metadata is built from the logic of the running program."""
+        metadata = self.build("night")
+        self.assertEqual(metadata["program"], "night")
+        self.assertEqual(len(metadata["next_states_by_phase"]), 2)
+        self.assertEqual(metadata["next_states_by_phase"][1][1]["phase_state"], "rr")
+
+        metadata = self.build("0")
+        self.assertEqual(len(metadata["next_states_by_phase"]), 3)
+
+    def test_phase_out_of_range(self):
+        """Ensure a phase index beyond the cached program wraps instead of raising IndexError."""
+        metadata = self.build("night")
+        self.assertEqual(self.sim.get_tl_next_states(metadata, 2)[0]["phase_state"], "rr")
+        self.assertEqual(self.sim.get_tl_next_states(dict(metadata, next_states_by_phase=[]), 2), {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import json
+import numpy as np
+from xil_wire import (BSM_SIZE, SIM_SIZE, TRAJ_N, WireFormat, WireNegotiator, NeighborPublisher, NeighborTable,
+    encode_bsm, decode_bsm, decode_bsm_batch, encode_bsm_columns, encode_sim, decode_sim, detect_format)
+
+class TestWireFormat(unittest.TestCase):
+    def setUp(self):
+        """Set up a sample BSM."""
+        self.bsm = {
+            "msg_type": "bsm",
+            "id": "python_ego_1",
+            "current_utc_time": 1.5,
+            "latitude": 20.3,
+            "longitude": 10.5,
+            "speed": 5.6,
+            "acceleration": 0.8,
+            "heading": 1.57,
+            "heading_rate_change": 0.1,
+            "error_flag": 0,
+            "length": 5.0,
+            "width": 2.0,
+            "path_intentions_time": [0.0, 0.1, 0.2],
+            "path_intentions_rel_long_pos": [0.0, 0.5, 1.1],
+            "path_intentions_rel_lat_pos": [0.0, 0.0, 0.0],
+        }
+
+    def test_struct_sizes(self):
+        """Ensure the layouts match sizeof(BSM) and sizeof(SIM) of matlab/serial_utils.h on x86-64."""
+        self.assertEqual(BSM_SIZE, 688)
+        self.assertEqual(SIM_SIZE, 66)
+
+    def test_bsm_round_trip(self):
+        """Ensure a BSM survives encoding and decoding."""
+        data = encode_bsm(self.bsm)
+        self.assertEqual(len(data), BSM_SIZE)
+
+        bsm = decode_bsm(data)
+        self.assertEqual(bsm["id"], self.bsm["id"])
+        self.assertEqual(bsm["speed"], self.bsm["speed"])
+        self.assertEqual(bsm["path_intentions_n"], 3)
+        self.assertEqual(bsm["path_intentions_rel_long_pos"], self.bsm["path_intentions_rel_long_pos"])
+        self.assertEqual(bsm["path_history_time"], [])
+
+    def test_long_path_truncated(self):
+        """Ensure paths longer than the fixed layout are truncated."""
+        self.bsm["path_intentions_time"] = list(range(2*TRAJ_N))
+        bsm = decode_bsm(encode_bsm(self.bsm))
+        self.assertEqual(bsm["path_intentions_n"], TRAJ_N)
+        self.assertEqual(len(bsm["path_intentions_time"]), TRAJ_N)
+
+    def test_batch(self):
+        """Ensure columns of BSMs pack into one datagram that decodes without copies."""
+        ids = ["nv_1", "nv_2", "nv_3"]
+        speeds = np.array([1.0, 2.0, 3.0])
+        data = encode_bsm_columns(ids, speed=speeds)
+        self.assertEqual(len(data), 3*BSM_SIZE)
+
+        batch = decode_bsm_batch(data)
+        np.testing.assert_array_equal(batch["speed"], speeds)
+        self.assertEqual(decode_bsm(data, 2*BSM_SIZE)["id"], "nv_3")
+
+    def test_sim_round_trip(self):
+        """Ensure a SIM message survives encoding and decoding."""
+        sim = decode_sim(encode_sim({"id": "SUMO-XIL", "sim_status": -3, "error_flag": 0}))
+        self.assertEqual(sim["id"], "SUMO-XIL")
+        self.assertEqual(sim["sim_status"], -3)
+
+    def test_negotiation(self):
+        """Ensure each client is answered in the format it sends with."""
+        wire = WireNegotiator()
+        binary_client = ("127.0.0.1", 10001)
+        json_client = ("127.0.0.2", 10001)
+
+        wire.decode(binary_client, encode_bsm(self.bsm))
+        wire.decode(json_client, json.dumps(self.bsm).encode("utf-8"))
+
+        self.assertEqual(wire.get_format(binary_client), WireFormat.BINARY)
+        self.assertEqual(wire.get_format(json_client), WireFormat.JSON)
+        self.assertEqual(detect_format(wire.encode(binary_client, self.bsm)), WireFormat.BINARY)
+        self.assertEqual(json.loads(wire.encode(json_client, self.bsm))["id"], self.bsm["id"])
+
+        data = wire.encode_batch(binary_client, {"nv_1": self.bsm, "nv_2": self.bsm})
+        self.assertEqual([bsm["id"] for bsm in wire.decode(binary_client, data)], [self.bsm["id"]]*2)
+
+    def test_neighbor_batch(self):
+        """Ensure all neighbors of a JSON client are sent in one datagram."""
+        wire = WireNegotiator()
+        publisher = NeighborPublisher(wire)
+        bsms = {"nv_1": dict(self.bsm, id="nv_1"), "nv_2": dict(self.bsm, id="nv_2")}
+
+        data = publisher.build("127.0.0.2", bsms)
+        self.assertEqual(json.loads(data)["msg_type"], "bsm_batch")
+        self.assertEqual([bsm["id"] for bsm in wire.decode("127.0.0.2", data)], ["nv_1", "nv_2"])
+
+    def test_neighbor_batch_ego(self):
+        """Ensure the header names the ego vehicle of a fleet client in keyframes and deltas."""
+        client = "127.0.0.2/python_fleet_1_0"
+        publisher = NeighborPublisher(WireNegotiator(), delta=True)
+        nv_1 = dict(self.bsm, id="nv_1")
+
+        message = json.loads(publisher.build(client, {"nv_1": nv_1}, ego="python_fleet_1_0"))
+        self.assertTrue(message["keyframe"])
+        self.assertEqual(message["ego"], "python_fleet_1_0")
+        self.assertEqual(NeighborTable().apply(message), {"nv_1": nv_1})
+
+        message = json.loads(publisher.build(client, {"nv_1": dict(nv_1, speed=6.0)}, ego="python_fleet_1_0"))
+        self.assertFalse(message["keyframe"])
+        self.assertEqual(message["ego"], "python_fleet_1_0")
+
+    def test_neighbor_delta(self):
+        """Ensure unchanged neighbors are suppressed and deltas merge back into the full state."""
+        client = "127.0.0.2"
+        publisher = NeighborPublisher(WireNegotiator(), delta=True, keyframe_interval=3)
+        table = NeighborTable()
+        nv_1, nv_2 = dict(self.bsm, id="nv_1"), dict(self.bsm, id="nv_2")
+
+        # Keyframe
+        table.apply(json.loads(publisher.build(client, {"nv_1": nv_1, "nv_2": nv_2})))
+
+        # Only the send time changed
+        self.assertIsNone(publisher.build(client, {"nv_1": dict(nv_1, current_utc_time=1.6), "nv_2": dict(nv_2, current_utc_time=1.6)}))
+
+        # One neighbor moved and the other departed
+        message = json.loads(publisher.build(client, {"nv_1": dict(nv_1, speed=6.0)}))
+        self.assertFalse(message["keyframe"])
+        self.assertEqual(message["removed"], ["nv_2"])
+        self.assertEqual(set(message["bsms"][0]), {"id", "delta", "speed", "current_utc_time"})
+
+        neighbors = table.apply(message)
+        self.assertEqual(list(neighbors), ["nv_1"])
+        self.assertEqual(neighbors["nv_1"]["speed"], 6.0)
+        self.assertEqual(neighbors["nv_1"]["latitude"], nv_1["latitude"])
+
+        # Keyframe interval reached
+        self.assertTrue(json.loads(publisher.build(client, {"nv_1": dict(nv_1, speed=6.0)}))["keyframe"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+import unittest
+import warnings
+from unittest import mock
+
+import main_xil
+
+class StubServer:
+    """Server that returns the queued BSMs of each client address."""
+    def __init__(self):
+        self.bsms = {}
+
+    def get_all_data(self, msg_type):
+        bsms, self.bsms = self.bsms, {}
+        return bsms
+
+class StubEXT:
+    """External vehicle that records its latest state."""
+    route_id = "mainlane"
+    type_id = "ext"
+
+    def __init__(self):
+        self.veh_id = None
+        self.speed = None
+
+    def update_states(self, latitude, longitude, speed, acceleration, heading, heading_rate_change, times=None, rel_long_pos=None):
+        self.speed = speed
+
+def bsm(id, speed):
+    return {
+        'id': id, 'current_utc_time': 0.0, 'longitude': 0.0, 'latitude': 0.0, 'speed': speed, 'acceleration': 0.0,
+        'heading': 0.0, 'heading_rate_change': 0.0, 'error_flag': main_xil.BSM.Error.OK.value,
+        'path_intentions_time': [], 'path_intentions_rel_long_pos': [], 'path_intentions_rel_lat_pos': [],
+    }
+
+class TestUpdateExts(unittest.TestCase):
+    def setUp(self):
+        self.wrapper = main_xil.sumoWrapper.__new__(main_xil.sumoWrapper)
+        self.wrapper.server = StubServer()
+        self.wrapper.microsim = mock.Mock()
+        self.wrapper.telemetry = None
+        self.wrapper.exts = {}
+        self.wrapper.ext_clients = {}
+        self.wrapper.client_utc_times = {}
+
+        patcher = mock.patch.object(main_xil, "EXT", StubEXT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, bsms):
+        self.wrapper.server.bsms = bsms
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.wrapper.update_exts()
+        return caught
+
+    def test_routing(self):
+        """Ensure each BSM updates the vehicle of the client address it came from."""
+        self.update({("10.0.0.1", 5000): bsm("ego", 10.0), ("10.0.0.2", 5000): bsm("car", 20.0)})
+        self.update({("10.0.0.2", 5000): bsm("car", 21.0)})
+
+        exts = self.wrapper.exts
+        self.assertEqual(exts[("10.0.0.1", 5000)].veh_id, "ego")
+        self.assertEqual(exts[("10.0.0.1", 5000)].speed, 10.0)
+        self.assertEqual(exts[("10.0.0.2", 5000)].speed, 21.0)
+        self.assertEqual(self.wrapper.microsim.init_vehicle.call_count, 2)
+
+    def test_duplicate_ids(self):
+        """Ensure clients reusing an ID get unique suffixed IDs, also when a suffixed ID is taken."""
+        self.update({("10.0.0.1", 5000): bsm("ego", 10.0), ("10.0.0.2", 5000): bsm("ego_2", 10.0)})
+        caught = self.update({("10.0.0.3", 5000): bsm("ego", 10.0)})
+        self.update({("10.0.0.4", 5000): bsm("ego", 10.0)})
+
+        ids = {client: ext.veh_id for client, ext in self.wrapper.exts.items()}
+        self.assertEqual(ids, {
+            ("10.0.0.1", 5000): "ego",
+            ("10.0.0.2", 5000): "ego_2",
+            ("10.0.0.3", 5000): "ego_3",
+            ("10.0.0.4", 5000): "ego_4",
+        })
+        self.assertEqual(len(set(ids.values())), len(ids))
+        self.assertEqual({id: client for client, id in ids.items()}, self.wrapper.ext_clients)
+        self.assertTrue(any("Renaming to ego_3" in str(w.message) for w in caught))
+
+        # Later BSMs of a renamed client keep routing to its vehicle
+        self.update({("10.0.0.3", 5000): bsm("ego", 30.0)})
+        self.assertEqual(self.wrapper.exts[("10.0.0.3", 5000)].speed, 30.0)
+        self.assertEqual(self.wrapper.microsim.init_vehicle.call_count, 4)
+
+if __name__ == "__main__":
+    unittest.main()
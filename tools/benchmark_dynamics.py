@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Micro-benchmark of the vehicle dynamics integrators of ext/dynamics.py, comparing one scalar
+step_dyn call per vehicle with one step_dyn_batch call for all vehicles.
+
+Run from the parent cav_sumo directory, e.g.
+
+    python -m tools.benchmark_dynamics --sizes 1 10 1000 --steps 200
+'''
+
+import argparse
+from time import perf_counter as counter
+import numpy as np
+
+from ext.dynamics import step_dyn, step_dyn_batch
+
+DT = 0.1 # [s]
+
+def make_fleet(n, seed=0):
+    '''Return states X[N, 5] and controls U[N, 2] of a fleet driving along the road'''
+    rng = np.random.default_rng(seed)
+
+    X = np.zeros((n, 5))
+    X[:, 0] = 20. * np.arange(n)
+    X[:, 2] = rng.uniform(5., 30., n)
+    X[:, 4] = 0.5*np.pi
+
+    U = np.zeros((n, 2))
+    U[:, 0] = rng.uniform(-2., 2., n)
+    U[:, 1] = rng.uniform(-0.05, 0.05, n)
+
+    return X, U
+
+def run_scalar(X, U, steps):
+    '''Step each vehicle with step_dyn and return the wall time [s]'''
+    states = [list(x) for x in X]
+    controls = [tuple(u) for u in U]
+
+    t_start = counter()
+    for _ in range(steps):
+        for i, (ua, usteer) in enumerate(controls):
+            x, y, v, a, heading = states[i]
+            _, *states[i] = step_dyn(DT, 0., x, y, v, a, heading, ua, usteer)
+
+    return counter() - t_start
+
+def run_batch(X, U, steps):
+    '''Step all vehicles with step_dyn_batch and return the wall time [s]'''
+    X = X.copy()
+
+    step_dyn_batch(DT, X, U) # Allocate the work buffers outside the timing
+
+    t_start = counter()
+    for _ in range(steps):
+        step_dyn_batch(DT, X, U)
+
+    return counter() - t_start
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark the scalar and batched vehicle dynamics integrators')
+    parser.add_argument('--sizes', default=[1, 10, 1000], nargs='+', type=int, help='Numbers of vehicles. Default 1 10 1000')
+    parser.add_argument('--steps', default=200, type=int, help='Number of integration steps per case. Default 200')
+    args = parser.parse_args()
+
+    print(f"{'vehicles':>10}{'scalar [us/step]':>20}{'batch [us/step]':>20}{'speedup':>10}")
+    for n in args.sizes:
+        X, U = make_fleet(n)
+
+        scalar = run_scalar(X, U, args.steps) / args.steps
+        batch = run_batch(X, U, args.steps) / args.steps
+
+        print(f"{n:>10d}{1e6*scalar:>20.1f}{1e6*batch:>20.1f}{scalar/max(batch, 1e-12):>10.1f}")
+
+if __name__ == '__main__':
+    main()
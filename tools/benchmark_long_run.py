@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Regression benchmark of simulation.step() over a long run. Step time is reported in windows
+together with the active and cumulative vehicle counts, so it can be checked that the per-step
+bookkeeping cost follows the vehicles in the network and not the total fleet seen so far.
+
+Run from the parent cav_sumo directory, e.g.
+
+    python -m tools.benchmark_long_run --scenario i24 --penetration 0.3 --sim_time 21600
+'''
+
+import argparse
+from time import perf_counter as counter
+
+from sumo_backend import traci # The backend the simulation started, libsumo for headless runs when installed
+
+from main import simulation
+import parsers.sumo
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark simulation.step() time over a long run')
+    parser.add_argument('--scenario_folder', default='sumo_scenarios', type=str, help='Scenarios folder. Default "sumo_scenarios"')
+    parser.add_argument('--scenario', default='i24', type=str, help='Scenario to benchmark. Default i24')
+    parser.add_argument('--penetration', default=0.3, type=float, help='CAV penetration rate. Default 0.3')
+    parser.add_argument('--seed', default=23423, type=int, help='SUMO random seed. Default 23423')
+    parser.add_argument('--sim_time', default=21600., type=float, help='Simulation time to run [s]. Default 21600')
+    parser.add_argument('--window', default=600., type=float, help='Reporting window of simulation time [s]. Default 600')
+    args = parser.parse_args()
+
+    sim_parser = argparse.ArgumentParser()
+    parsers.sumo.register_parser(sim_parser)
+    sim_args = sim_parser.parse_args([
+        '--scenario_folder', args.scenario_folder,
+        '--scenario', args.scenario,
+        '--penetration', str(args.penetration),
+        '--seed', str(args.seed),
+    ])
+
+    sumo = simulation(args=sim_args)
+
+    rows = []
+    n_departed = 0
+    try:
+        window_end = args.window
+        window_steps = 0
+        window_wall = 0.
+
+        while sumo.sim_time < args.sim_time and sumo.is_running():
+            t_start = counter()
+            sumo.step()
+            window_wall += counter() - t_start
+            window_steps += 1
+
+            n_departed += traci.simulation.getDepartedNumber()
+
+            if sumo.sim_time >= window_end:
+                rows.append((sumo.sim_time, n_departed, len(sumo.spawned_vehs), 1e3*window_wall/window_steps))
+                print(f't={sumo.sim_time:.0f}s | cumulative={n_departed} | active={len(sumo.spawned_vehs)} | step={rows[-1][3]:.3f} ms')
+
+                window_end += args.window
+                window_steps = 0
+                window_wall = 0.
+    finally:
+        sumo.stop()
+
+    if not rows:
+        return
+
+    print('')
+    print(f"{'t [s]':>10}{'cumulative':>12}{'active':>10}{'step [ms]':>12}{'ms/active veh':>16}")
+    for t, cumulative, active, step_ms in rows:
+        print(f"{t:>10.0f}{cumulative:>12d}{active:>10d}{step_ms:>12.3f}{step_ms/max(active, 1):>16.5f}")
+
+    # Per-vehicle step cost should stay flat while the cumulative count grows
+    per_veh = [step_ms/max(active, 1) for _, _, active, step_ms in rows if active > 0]
+    if len(per_veh) > 1:
+        print(f'\nPer-active-vehicle step cost, last/first window: {per_veh[-1]/per_veh[0]:.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Benchmark of the PET (post-encroachment time) computation of analysis.TrafficMetrics.compute_pet
+on synthetic runs, sweeping the run length at a fixed number of lane changes and the number of
+lane changes at a fixed run length. The one-off grouping of the samples by vehicle, shared with
+parse_xml, is timed separately from the PET pass.
+
+Run from the parent cav_sumo directory, e.g.
+
+    python -m tools.benchmark_pet --vehicles 200 --steps 1000 10000 --changes 100 1000 10000
+'''
+
+import argparse
+from time import perf_counter as counter
+import numpy as np
+
+from analysis import TrafficMetrics
+from scripts.utils_fcd import FcdColumns, FLOAT_COLUMNS
+
+DT = 0.1 # [s]
+N_LANES = 3
+
+def make_run(n_veh, n_steps, n_changes, seed=0):
+    '''Return the FcdColumns of n_veh vehicles driving for n_steps with about n_changes lane changes'''
+    rng = np.random.default_rng(seed)
+    times = DT * np.arange(n_steps)
+
+    # Every vehicle is sampled at every step
+    step = np.repeat(np.arange(n_steps, dtype=np.int32), n_veh)
+    veh = np.tile(np.arange(n_veh, dtype=np.int32), n_steps)
+
+    speed = rng.uniform(10., 30., n_veh)
+    pos = 5. * np.arange(n_veh)[veh] + speed[veh] * times[step]
+
+    # Lane changes at random (step, vehicle), each moving the vehicle by one or two lanes
+    shift = np.zeros((n_steps, n_veh), dtype=np.int32)
+    np.add.at(shift, (rng.integers(1, n_steps, n_changes), rng.integers(0, n_veh, n_changes)), rng.integers(1, N_LANES, n_changes))
+    lane = (rng.integers(0, N_LANES, n_veh) + np.cumsum(shift, axis=0)) % N_LANES
+
+    columns = {name: np.zeros(len(step)) for name, _, _ in FLOAT_COLUMNS}
+    columns['pos'] = pos
+    columns['x'] = pos
+    columns['speed'] = speed[veh]
+
+    return FcdColumns(
+        times=times,
+        step=step,
+        veh=veh,
+        lane=lane.reshape(-1).astype(np.int32),
+        leader=np.full(len(step), -1, dtype=np.int32),
+        columns=columns,
+        veh_ids=[f'veh_{i}' for i in range(n_veh)],
+        lane_ids=[f'main_{l}' for l in range(N_LANES)],
+        type_ids=['hdv', 'cav'],
+        veh_type=(np.arange(n_veh) % 2).astype(np.int32),
+    )
+
+def make_metrics(fcd):
+    '''Return a TrafficMetrics holding the inputs compute_pet reads, without parsing an FCD file'''
+    m = TrafficMetrics.__new__(TrafficMetrics)
+    m.fcd = fcd
+    m.timesteps = fcd.times.tolist()
+    m.is_sanitizing = False
+
+    # RAW lane changes and lane grid timesteps, as built by parse_xml
+    m.vehicle_lane_history_all = {'hdv': {}, 'cav': {}}
+    prev, cur = fcd.lane_changes()
+    for p, c in zip(prev.tolist(), cur.tolist()):
+        vid = fcd.veh_ids[fcd.veh[c]]
+        vt = fcd.type_ids[fcd.veh_type[fcd.veh[c]]]
+        m.vehicle_lane_history_all[vt].setdefault(vid, []).append((m.timesteps[fcd.step[c]], fcd.lane_ids[fcd.lane[p]], fcd.lane_ids[fcd.lane[c]]))
+    m.timestep_lane_positions_all = dict.fromkeys(m.timesteps)
+
+    return m, len(cur)
+
+def run(m, repeats):
+    '''Run compute_pet and return the best wall time [s]'''
+    best = np.inf
+    for _ in range(repeats):
+        t_start = counter()
+        m.compute_pet()
+        best = min(best, counter() - t_start)
+
+    return best
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark the PET computation against run length and lane changes')
+    parser.add_argument('--vehicles', default=200, type=int, help='Number of vehicles. Default 200')
+    parser.add_argument('--steps', default=[1000, 4000, 16000], nargs='+', type=int, help='Run lengths [steps], at the first number of lane changes. Default 1000 4000 16000')
+    parser.add_argument('--changes', default=[250, 1000, 4000], nargs='+', type=int, help='Numbers of lane changes, at the first run length. Default 250 1000 4000')
+    parser.add_argument('--repeats', default=3, type=int, help='Runs per case, the best is reported. Default 3')
+    args = parser.parse_args()
+
+    cases = [(n_steps, args.changes[0]) for n_steps in args.steps] + [(args.steps[0], n) for n in args.changes[1:]]
+
+    print(f"{'samples':>12}{'lane changes':>15}{'PETs':>8}{'grouping [ms]':>15}{'PET [ms]':>10}{'per change [us]':>18}")
+    for n_steps, n_changes in cases:
+        fcd = make_run(args.vehicles, n_steps, n_changes)
+
+        t_start = counter()
+        fcd.group_by_vehicle()
+        grouping = counter() - t_start
+
+        m, n_changes = make_metrics(fcd)
+        wall = run(m, args.repeats)
+        n_pet = sum(len(v) for v in m.pet_list.values())
+
+        print(f"{len(fcd):>12d}{n_changes:>15d}{n_pet:>8d}{1e3*grouping:>15.1f}{1e3*wall:>10.1f}{1e6*wall/max(n_changes, 1):>18.1f}")
+
+if __name__ == '__main__':
+    main()
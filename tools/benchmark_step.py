@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Benchmark of simulation.step() throughput, comparing batched TraCI variable subscriptions,
+context subscriptions around CAVs (--context_subscriptions) and the per-vehicle getter path (--no_subscriptions).
+
+Run from the parent cav_sumo directory, e.g.
+
+    python -m tools.benchmark_step --scenarios onramp i24 --penetration 0.3 --steps 3000
+'''
+
+import argparse
+from time import perf_counter as counter
+
+from main import simulation
+import parsers.sumo
+
+# Benchmarked state-query paths and the command-line flags that select them
+MODES = {
+    'getters': ['--no_subscriptions'],
+    'subscriptions': [],
+    'context': ['--context_subscriptions'],
+}
+
+def run_case(scenario_folder, scenario, penetration, seed, steps, mode_flags):
+    '''Run a fixed number of simulation steps and return (steps executed, wall time [s])'''
+    sim_args = [
+        '--scenario_folder', scenario_folder,
+        '--scenario', scenario,
+        '--penetration', str(penetration),
+        '--seed', str(seed),
+    ]
+    sim_args += mode_flags
+
+    parser = argparse.ArgumentParser()
+    parsers.sumo.register_parser(parser)
+    args = parser.parse_args(sim_args)
+
+    sumo = simulation(args=args)
+
+    n = 0
+    try:
+        t_start = counter()
+        while n < steps and sumo.is_running():
+            sumo.step()
+            n += 1
+        wall = counter() - t_start
+    finally:
+        sumo.stop()
+
+    return n, wall
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark simulation.step() across TraCI state-query paths')
+    parser.add_argument('--scenario_folder', default='sumo_scenarios', type=str, help='Scenarios folder. Default "sumo_scenarios"')
+    parser.add_argument('--scenarios', default=['onramp', 'i24'], nargs='+', type=str, help='Scenarios to benchmark. Default onramp i24')
+    parser.add_argument('--penetration', default=0.3, type=float, help='CAV penetration rate. Default 0.3')
+    parser.add_argument('--seed', default=23423, type=int, help='SUMO random seed. Default 23423')
+    parser.add_argument('--steps', default=3000, type=int, help='Number of simulation steps per case. Default 3000')
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.scenarios:
+        for mode, mode_flags in MODES.items():
+            n, wall = run_case(args.scenario_folder, scenario, args.penetration, args.seed, args.steps, mode_flags)
+            results.append((scenario, mode, n, wall))
+
+    print('')
+    print(f"{'scenario':<12}{'path':<16}{'steps':>8}{'wall [s]':>12}{'steps/s':>12}")
+    for scenario, path, n, wall in results:
+        print(f"{scenario:<12}{path:<16}{n:>8d}{wall:>12.2f}{n/max(wall, 1e-9):>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,6 @@ import argparse
 import traceback
 from math import atan2, pi, fmod
 from time import perf_counter as counter, sleep
-import xml.etree.ElementTree as ET
 
 from main import simulation
 
@@ -24,9 +23,9 @@ from src.agents import EXT
 from src.settings import *
 
 import parsers.sumo
+from scripts.utils_fcd import load_fcd_columns
 
-import traci # traci has full API options
-from traci import TraCIException
+from sumo_backend import traci # The replay always uses the GUI, so this resolves to traci
 
 class sumoWrapper():
     ''' 
@@ -131,27 +130,29 @@ class sumoWrapper():
             ### Simulation
             t_start = counter()
 
-            tree = ET.parse(self.fcd_path)
-            root = tree.getroot()
+            # Load the FCD columns, from the sidecar next to the XML when it is up to date
+            fcd = load_fcd_columns(self.fcd_path)
+
+            # Samples without a pose or speed cannot be replayed, and a missing acceleration is replayed as 0
+            fcd = fcd.subset(fcd.has("x", "y", "speed", "angle").nonzero()[0])
+            accels = [accel if accel == accel else 0. for accel in fcd.accel.tolist()]
+            starts, ends = fcd.step_bounds()
+            type_ids = [type if type else None for type in fcd.type_ids]
 
             seen_vehicles = set()
    
-            for timestep in root.iter('timestep'):
-                sim_time = float(timestep.get('time'))
+            for k, sim_time in enumerate(fcd.times.tolist()):
         
                 ### Step microsim
                 self.microsim.step()
 
                 vehicle_ids = traci.vehicle.getIDList()
 
-                for vehicle in timestep.iter('vehicle'):
-                    veh_id = vehicle.get('id')
-                    veh_type = vehicle.get('type')
-                    x = float(vehicle.get('x'))
-                    y = float(vehicle.get('y'))
-                    speed = float(vehicle.get('speed'))
-                    accel = float(vehicle.get('acceleration'))
-                    angle = float(vehicle.get('angle'))
+                samples = slice(starts[k], ends[k])
+                for veh, type, x, y, speed, accel, angle in zip(fcd.veh[samples].tolist(), fcd.sample_type[samples].tolist(),
+                        fcd.x[samples].tolist(), fcd.y[samples].tolist(), fcd.speed[samples].tolist(), accels[samples], fcd.angle[samples].tolist()):
+                    veh_id = fcd.veh_ids[veh]
+                    veh_type = type_ids[type]
 
                     # Inject vehicle only if it's new
                     if veh_id not in seen_vehicles and veh_id not in vehicle_ids and veh_type == EXT().type_id:
@@ -188,7 +189,7 @@ class sumoWrapper():
         except AssertionError as e:
             print(f'An assertion error occurred: {e}')
 
-        except TraCIException as e:
+        except traci.TraCIException as e:
             print(f'SUMO exception occurred: {e}')
 
         except IndexError as e:
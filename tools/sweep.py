@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Parallel sweep over scenarios x CAV penetration rates x seeds, with one SUMO process per worker.
+
+Each run gets its own TraCI port/label and its own output folder
+<scenario_folder>/<scenario>/<sweep_name>/p<penetration>_s<seed>/, which also holds the generated
+route file and the run log. A manifest with the wall time, real-time factor (RTF) and termination
+reason of every run is written to <scenario_folder>/<sweep_name>_manifest.json. The status of a run
+is 'ok' when it ended naturally, 'stopped' when a wall-clock or simulation-time guard (or an
+interrupt) ended it and 'error' when it raised.
+
+Run from the parent cav_sumo directory, e.g.
+
+    python -m tools.sweep --scenarios onramp i24 --penetrations 0 0.1 0.2 0.3 --seeds 1 2 3 --jobs 32
+'''
+
+import os
+import sys
+import json
+import argparse
+import traceback
+import itertools
+import contextlib
+from datetime import datetime
+from time import perf_counter as counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import parsers.sumo
+
+CONFIG_FILE = os.path.join('sumo_scenarios', 'config.json')
+
+def run_case(case):
+    '''Run a single microsimulation of the sweep in the current worker process and return its manifest entry'''
+    from main import simulation # Import in the worker so each process holds its own TraCI state
+
+    output_name = os.path.join(case['sweep_name'], f"p{case['penetration']:g}_s{case['seed']}")
+    output_dir = os.path.join(case['scenario_folder'], case['scenario'], output_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    entry = {
+        'scenario': case['scenario'],
+        'penetration': case['penetration'],
+        'seed': case['seed'],
+        'output_dir': output_dir,
+        'traci_port': case['traci_port'],
+        'status': 'ok',
+        'termination': None,
+        'error': None,
+        'startup_time': None,
+        'wall_time': None,
+        'sim_time': None,
+        'rtf': None,
+    }
+
+    parser = argparse.ArgumentParser()
+    parsers.sumo.register_parser(parser)
+    args = parser.parse_args([
+        '--scenario_folder', case['scenario_folder'],
+        '--scenario', case['scenario'],
+        '--penetration', str(case['penetration']),
+        '--seed', str(case['seed']),
+        '--output_name', output_name,
+        '--traci_port', str(case['traci_port']),
+        '--traci_label', f"sweep_{case['index']}",
+    ] + case['extra_args'])
+
+    # Keep worker console output in the run folder
+    with open(os.path.join(output_dir, 'run.log'), 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        t_start = counter()
+        try:
+            sumo = simulation(args=args)
+
+            # Time the simulation loop only, excluding the SUMO startup
+            entry['startup_time'] = counter() - t_start
+            t_start = counter()
+
+            entry['termination'] = sumo.sim(max_wall_time=case['max_wall_time'])
+            entry['sim_time'] = sumo.sim_time
+
+            if entry['termination'] == 'error':
+                entry['status'] = 'error'
+                entry['error'] = sumo.termination_error
+            elif entry['termination'] != 'natural':
+                entry['status'] = 'stopped'
+
+        except Exception as e:
+            print(traceback.format_exc())
+            entry['status'] = 'error'
+            entry['termination'] = 'error'
+            entry['error'] = str(e)
+
+        entry['wall_time'] = counter() - t_start
+
+    if entry['sim_time'] is not None:
+        entry['rtf'] = entry['sim_time'] / max(entry['wall_time'], 1e-9)
+
+    return entry
+
+def main():
+    # Default worker count from the shared scenario configuration
+    n_jobs = os.cpu_count() or 1
+    if os.path.isfile(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            n_jobs = min(n_jobs, int(json.load(f).get('N_JOBS', n_jobs)))
+
+    parser = argparse.ArgumentParser('Parallel sweep of SUMO microsimulations over scenarios, penetration rates and seeds',
+        epilog='Arguments after -- are passed to every run, e.g. -- --context_subscriptions')
+    parser.add_argument('--scenario_folder', default='sumo_scenarios', type=str, help='Scenarios folder. Default "sumo_scenarios"')
+    parser.add_argument('--scenarios', default=['onramp'], nargs='+', type=str, help='Scenarios to run. Default onramp')
+    parser.add_argument('--penetrations', default=[0.0], nargs='+', type=float, help='CAV penetration rates to run. Default 0.0')
+    parser.add_argument('--seeds', default=[23423], nargs='+', type=int, help='SUMO random seeds to run. Default 23423')
+    parser.add_argument('--jobs', default=n_jobs, type=int, help=f'Number of parallel workers. Default {n_jobs} from N_JOBS in {CONFIG_FILE} and the CPU count')
+    parser.add_argument('--base_port', default=30000, type=int, help='First TraCI port - each run uses base_port + run index. Default 30000')
+    parser.add_argument('--max_wall_time', default=None, type=float, help='Wall-clock guard per run [s]. Default None')
+    parser.add_argument('--sweep_name', default=None, type=str, help='Name of the sweep output folders. Default sweep_<timestamp>')
+
+    argv = sys.argv[1:]
+    extra_args = []
+    if '--' in argv:
+        extra_args = argv[argv.index('--')+1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    sweep_name = args.sweep_name or datetime.now().strftime("sweep_%Y-%m-%d_%H-%M-%S")
+
+    cases = []
+    for i, (scenario, penetration, seed) in enumerate(itertools.product(args.scenarios, args.penetrations, args.seeds)):
+        assert 0 <= penetration <= 1, 'Penetration arguments must be in interval [0, 1].'
+        cases.append({
+            'index': i,
+            'sweep_name': sweep_name,
+            'scenario_folder': args.scenario_folder,
+            'scenario': scenario,
+            'penetration': penetration,
+            'seed': seed,
+            'traci_port': args.base_port + i,
+            'max_wall_time': args.max_wall_time,
+            'extra_args': extra_args,
+        })
+
+    print(f'Running {len(cases)} microsimulations on {args.jobs} workers.')
+
+    manifest = {
+        'sweep_name': sweep_name,
+        'started': datetime.now().isoformat(),
+        'jobs': args.jobs,
+        'extra_args': extra_args,
+        'runs': [],
+    }
+
+    t_start = counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_case, case) for case in cases]
+
+        for future in as_completed(futures):
+            entry = future.result()
+            manifest['runs'].append(entry)
+
+            rtf = f"{entry['rtf']:.2f}" if entry['rtf'] is not None else '-'
+            print(f"[{len(manifest['runs'])}/{len(cases)}] {entry['scenario']} p={entry['penetration']:g} seed={entry['seed']} | "
+                  f"{entry['status']} ({entry['termination']}) | wall={entry['wall_time']:.1f}s | RTF={rtf}")
+
+    manifest['wall_time'] = counter() - t_start
+    manifest['runs'].sort(key=lambda entry: (entry['scenario'], entry['penetration'], entry['seed']))
+
+    manifest_file = os.path.join(args.scenario_folder, f'{sweep_name}_manifest.json')
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    print(f'Wrote sweep manifest to {manifest_file}.')
+
+if __name__ == '__main__':
+    main()
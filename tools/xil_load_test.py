@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Load test of the XIL server with many lightweight external vehicle clients on localhost.
+
+Each client binds its own loopback address 127.0.0.<k+1>, so the server tells the clients apart by
+IP while every client still listens on the standard bsm/sim ports. Clients stream BSMs and
+RUNNING statuses at the framerate and count the datagrams they receive. The server publishes a
+RUNNING status every simulated second, so its mean wall-clock interval shows whether the server
+keeps the lockstep rate under load (1.0 s when real-time).
+
+Start the server, then the clients, from the parent cav_sumo directory, e.g.
+
+    python main_xil.py --num_clients 50
+    python -m tools.xil_load_test --num_clients 50 --duration 60
+
+Loopback addresses other than 127.0.0.1 are available by default on Linux. On other systems
+they may need to be added to the loopback interface first.
+'''
+
+import json
+import socket
+import argparse
+import threading
+from time import perf_counter as counter, sleep
+
+from src.settings import LANEWIDTH
+
+# Ports that the server publishes each message type to, see README_XIL.md
+BSM_PORT = 10001
+SIM_PORT = 10004
+
+# SIM.SimStatus values, see README_XIL.md
+RUNNING = 1
+OFFLINE = -2
+
+class LoadClient:
+    '''Minimal external vehicle client that drives at constant speed and counts server updates'''
+
+    def __init__(self, k, server_ip, server_port, framerate, n_lanes=3, spacing=15.):
+        self.ip = f'127.0.0.{k+1}'
+        self.server = (server_ip, server_port)
+        self.dt = 1. / framerate
+        self.id = f'load_ego_{k+1}'
+
+        # Stagger the vehicles over lanes and along the road
+        self.x = 20. + spacing * (k // n_lanes)
+        self.y = -(k % n_lanes + 0.5) * LANEWIDTH
+        self.speed = 10.
+
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.send_socket.bind((self.ip, 0))
+
+        self.recv_sockets = {}
+        for msg_type, port in (('bsm', BSM_PORT), ('sim', SIM_PORT)):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind((self.ip, port))
+            s.setblocking(False)
+            self.recv_sockets[msg_type] = s
+
+        self.n_sent = 0
+        self.n_received = {'bsm': 0, 'sim': 0}
+        self.running_times = []  # Arrival times of RUNNING statuses [s]
+
+    def send(self, message):
+        self.send_socket.sendto(json.dumps(message).encode('utf-8'), self.server)
+        self.n_sent += 1
+
+    def send_bsm(self, t):
+        self.send({
+            'msg_type': 'bsm', 'id': self.id, 'current_utc_time': t,
+            'latitude': self.y, 'longitude': self.x, 'speed': self.speed, 'acceleration': 0.,
+            'heading': 0.5*3.141592653589793, 'heading_rate_change': 0., 'error_flag': 0,
+            'path_intentions_time': [], 'path_intentions_rel_long_pos': [], 'path_intentions_rel_lat_pos': [],
+        })
+
+    def send_status(self, sim_status):
+        self.send({'msg_type': 'sim', 'id': self.id, 'sim_status': sim_status, 'error_flag': 0})
+
+    def receive(self):
+        for msg_type, s in self.recv_sockets.items():
+            while True:
+                try:
+                    data = s.recv(65535)
+                except BlockingIOError:
+                    break
+
+                self.n_received[msg_type] += 1
+                if msg_type == 'sim' and data[:1] == b'{' and json.loads(data).get('sim_status') == RUNNING:
+                    self.running_times.append(counter())
+
+    def run(self, duration, stop):
+        t_start = counter()
+        i = 0
+        while not stop.is_set() and counter() - t_start < duration:
+            i += 1
+            self.x += self.speed * self.dt
+
+            self.send_bsm(counter() - t_start)
+            self.send_status(RUNNING)
+            self.receive()
+
+            # Hold the framerate
+            sleep_duration = i * self.dt - (counter() - t_start)
+            if sleep_duration > 0:
+                sleep(sleep_duration)
+
+    def close(self):
+        self.send_socket.close()
+        for s in self.recv_sockets.values():
+            s.close()
+
+def main():
+    parser = argparse.ArgumentParser('Load test of the XIL server with many external vehicle clients')
+    parser.add_argument('--num_clients', default=50, type=int, help='Number of clients. Default 50')
+    parser.add_argument('--server_ip', default='127.0.0.1', type=str, help='Server IP address. Default LOCALHOST')
+    parser.add_argument('--server_port', default=12345, type=int, help='Server port. Default 12345')
+    parser.add_argument('--framerate', default=10, type=int, help='Client send frequency [Hz]. Default 10')
+    parser.add_argument('--duration', default=60., type=float, help='Test duration [s]. Default 60')
+    parser.add_argument('--stop_server', default=False, action='store_true', help='Flag to send an OFFLINE status at the end to stop the server. Default false.')
+    args = parser.parse_args()
+
+    clients = [LoadClient(k, args.server_ip, args.server_port, args.framerate) for k in range(args.num_clients)]
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=client.run, args=(args.duration, stop), daemon=True) for client in clients]
+
+    print(f'Running {args.num_clients} clients at {args.framerate} Hz for {args.duration:.0f} s.')
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop.set()
+
+    if args.stop_server:
+        clients[0].send_status(OFFLINE)
+
+    # Report
+    intervals = []
+    for client in clients:
+        intervals += [b - a for a, b in zip(client.running_times, client.running_times[1:])]
+
+    print('')
+    print(f"{'client':<16}{'sent':>8}{'bsm recv':>10}{'sim recv':>10}")
+    for client in clients:
+        print(f"{client.id:<16}{client.n_sent:>8d}{client.n_received['bsm']:>10d}{client.n_received['sim']:>10d}")
+
+    if intervals:
+        intervals.sort()
+        mean = sum(intervals) / len(intervals)
+        p95 = intervals[min(int(0.95 * len(intervals)), len(intervals) - 1)]
+        print(f'\nServer RUNNING status interval over {len(intervals)} samples: mean={mean:.3f} s | p95={p95:.3f} s (1.000 s when keeping real time)')
+    else:
+        print('\nNo RUNNING statuses received - check that the server is running with --num_clients', args.num_clients)
+
+    for client in clients:
+        client.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Asyncio implementation of the XIL UDP server.
+
+Datagrams are received and decoded by an asyncio DatagramProtocol on an event loop running in a
+background thread, and stored in per-client latest-value slots. The microsim steps on the calling
+thread and only reads the slots, so a client that bursts datagrams overwrites its own slot instead
+of delaying the step. Outbound updates are handed to the event loop and sent without blocking the
+step.
+
+The public API matches the threaded src.xil_server.UDPServer used by main_xil.py, so either server
+can be selected with --async_server.
+
+Neighbor BSMs are sent as one batch datagram per client only to clients that opted in with BSMs
+marked "batch": true (or "fleet": true), e.g. with xil_wire.NeighborTable on the receiving side.
+Other clients receive one datagram per neighbor BSM, as from the threaded server.
+
+In lockstep mode, clients acknowledge each frame published by the server with the `frame` field
+of their next BSM, and `wait_for_acks` blocks until every connected client acknowledged the frame.
+'''
+
+import asyncio
+import threading
+import warnings
+from time import perf_counter as counter, sleep
+
+from xil_wire import WireFormat, WireNegotiator
+
+# Ports that each message type is published to on the client, see README_XIL.md
+CLIENT_PORTS = {
+    'bsm': 10001,
+    'sim': 10004,
+    'spat': 10007,
+}
+
+# SIM.SimStatus values, see README_XIL.md
+NOT_READY = -1
+WAITING = 0
+RUNNING = 1
+OFFLINE = -2
+RESET = -3
+
+def client_address(client):
+    '''Return the IP of a client slot key. Vehicles of fleet clients are keyed "<ip>/<veh_id>".'''
+    return client.partition('/')[0]
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    '''Decodes received datagrams on the event loop into the latest-value slots of the server'''
+
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.on_datagram(data, addr)
+
+    def error_received(self, exc):
+        if self.server.is_debugging:
+            warnings.warn(f'UDP server error: {exc}')
+
+class AsyncUDPServer:
+    '''
+    UDP server for XIL clients on an asyncio event loop.
+
+    Clients are identified by IP address, as in the threaded server, and answered on the ports of
+    CLIENT_PORTS in the wire format they send with (see xil_wire.WireNegotiator). BSMs marked
+    "fleet": true come from a client simulating several vehicles (see ext/fleet_sim.py) and get a
+    slot per vehicle keyed "<ip>/<veh_id>". Updates sent to such a key go to the client IP.
+    '''
+
+    def __init__(self, server_ip='127.0.0.1', server_port=12345, framerate=10, timeout=10., is_debugging=False, wire_format='json'):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.framerate = framerate
+        self.dt = 1. / framerate
+        self.timeout = timeout  # [s] Clients silent for longer are no longer counted as connected
+        self.is_debugging = is_debugging
+
+        # Latest-value slots, only written on the event loop thread
+        self.data = {msg_type: {} for msg_type in CLIENT_PORTS}  # {msg_type: {client_ip: message}}
+        self.client_last_active = {}  # {client_ip: receive time [s]}
+        self.client_status = {}  # {client_ip: last SIM status}
+        self.batch_clients = set()  # Client IPs that receive neighbor BSMs as one batch datagram
+        self.n_received = 0
+        self.n_dropped = 0  # Undecodable datagrams
+
+        # Lockstep frames acknowledged by each client, notified on the event loop thread
+        self.client_frames = {}  # {client_ip: frame}
+        self.ack_condition = threading.Condition()
+
+        self.wire = WireNegotiator(default=WireFormat(wire_format))
+
+        # Optional xil_telemetry.XILTelemetry recording the receive latency of client BSMs
+        self.telemetry = None
+
+        # Real-time rate keeping
+        self.rt_start_time = counter()
+        self.rt_iter = 0
+
+        # Event loop in a background thread
+        self.transport = None
+        self.loop = asyncio.new_event_loop()
+        self.running = threading.Event()
+        self.thread = threading.Thread(target=self._run_loop, name='xil_async_server', daemon=True)
+        self.thread.start()
+
+        if not self.running.wait(timeout=5.):
+            raise RuntimeError(f'Could not start UDP server on {server_ip}:{server_port}.')
+
+    ### Event loop
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+                lambda: ServerProtocol(self), local_addr=(self.server_ip, self.server_port)
+            ))
+        except OSError as e:
+            warnings.warn(f'Could not bind UDP server to {self.server_ip}:{self.server_port} ({e}).')
+            return
+
+        self.running.set()
+        self.loop.run_forever()
+
+        # Shutdown
+        if self.transport is not None:
+            self.transport.close()
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    def on_datagram(self, data, addr):
+        '''Decode a datagram into the latest-value slot of its client. Runs on the event loop.'''
+        client_ip = addr[0]
+
+        try:
+            messages = self.wire.decode(client_ip, data)
+        except ValueError as e:
+            self.n_dropped += 1
+            if self.is_debugging:
+                warnings.warn(f'Dropped datagram from {addr}: {e}')
+            return
+
+        self.n_received += 1
+        self.client_last_active[client_ip] = counter()
+
+        for message in messages:
+            msg_type = message.get('msg_type', 'bsm')
+            if msg_type not in self.data:
+                continue
+
+            # Vehicles of a fleet client share its address and are told apart by ID
+            if msg_type == 'bsm' and message.get('fleet'):
+                self.data[msg_type][f"{client_ip}/{message['id']}"] = message
+            else:
+                self.data[msg_type][client_ip] = message
+
+            if msg_type == 'bsm' and (message.get('batch') or message.get('fleet')):
+                self.batch_clients.add(client_ip)
+
+            if self.telemetry is not None and msg_type == 'bsm' and 'current_utc_time' in message:
+                self.telemetry.record_message(f'{client_ip}:recv', message['current_utc_time'])
+
+            if msg_type == 'sim':
+                self.client_status[client_ip] = message.get('sim_status', NOT_READY)
+
+            elif 'frame' in message:
+                with self.ack_condition:
+                    self.client_frames[client_ip] = message['frame']
+                    self.ack_condition.notify_all()
+
+    def _send(self, data, addr):
+        if self.transport is not None:
+            self.transport.sendto(data, addr)
+
+    ### Server API
+    def is_running(self):
+        return self.running.is_set()
+
+    def get_clients(self):
+        '''Return the IPs of clients heard from within the timeout'''
+        t = counter()
+        return [client_ip for client_ip, t_active in list(self.client_last_active.items()) if t - t_active < self.timeout]
+
+    def is_connected(self, num_clients=1):
+        return len(self.get_clients()) >= num_clients
+
+    def is_simming(self):
+        '''True while every connected client is ready (WAITING or RUNNING) and none requested OFFLINE/RESET'''
+        statuses = [self.client_status.get(client_ip, NOT_READY) for client_ip in self.get_clients()]
+        return bool(statuses) and all(status in (WAITING, RUNNING) for status in statuses)
+
+    def is_resetting(self):
+        return any(status == RESET for status in list(self.client_status.values()))
+
+    def get_all_data(self, msg_type):
+        '''Return a snapshot {client_ip: latest message} of a message type'''
+        return dict(self.data[msg_type])
+
+    def get_data(self, msg_type, client_ip):
+        return self.data[msg_type].get(client_ip)
+
+    def clear_data(self):
+        '''Empty the latest-value slots and client statuses, e.g. after a reset. Clients stay registered.'''
+        for slots in self.data.values():
+            slots.clear()
+        self.client_status.clear()
+
+        with self.ack_condition:
+            self.client_frames.clear()
+
+    def accepts_batches(self, client):
+        '''True if a client opted in to receive its neighbor BSMs as one batch datagram'''
+        return client_address(client) in self.batch_clients
+
+    def is_acked(self, frame):
+        '''True once every connected client acknowledged a lockstep frame'''
+        clients = self.get_clients()
+        return bool(clients) and all(self.client_frames.get(client_ip, -1) >= frame for client_ip in clients)
+
+    def wait_for_acks(self, frame, timeout=None):
+        '''Block until every connected client acknowledged a lockstep frame. Returns False on timeout.'''
+        with self.ack_condition:
+            return self.ack_condition.wait_for(lambda: self.is_acked(frame), timeout=timeout)
+
+    def send_update(self, message, client, msg_type=None):
+        '''Queue a message to a client without blocking the caller'''
+        client_ip = client_address(client)
+        msg_type = msg_type or message.get('msg_type', 'bsm')
+        data = self.wire.encode(client_ip, message, msg_type=msg_type)
+        self.loop.call_soon_threadsafe(self._send, data, (client_ip, CLIENT_PORTS[msg_type]))
+
+    def send_updates(self, updates, msg_type='bsm'):
+        '''Queue [(client, message)] updates with one event loop wake-up'''
+        datagrams = []
+        for client, message in updates:
+            client_ip = client_address(client)
+            datagrams.append((self.wire.encode(client_ip, message, msg_type=msg_type), (client_ip, CLIENT_PORTS[msg_type])))
+
+        def send_all():
+            for data, addr in datagrams:
+                self._send(data, addr)
+
+        self.loop.call_soon_threadsafe(send_all)
+
+    def send_datagrams(self, datagrams, msg_type='bsm'):
+        '''Queue pre-encoded [(client, data)] datagrams with one event loop wake-up'''
+        port = CLIENT_PORTS[msg_type]
+
+        def send_all():
+            for client, data in datagrams:
+                self._send(data, (client_address(client), port))
+
+        self.loop.call_soon_threadsafe(send_all)
+
+    def send_neighbors(self, updates, publisher, frame=None, msg_type='bsm'):
+        '''
+        Queue the neighbor BSMs [(client, {nv_id: bsm}, header)] of each client with one event loop
+        wake-up. Clients that accept batches get one datagram built by the xil_wire.NeighborPublisher
+        with the header fields, other clients one datagram per neighbor BSM. In lockstep, `frame` is
+        added to each datagram so clients can tell the neighbors of a frame apart.
+
+        Returns the number of datagrams queued to each client IP {client_ip: n}.
+        '''
+        port = CLIENT_PORTS[msg_type]
+        datagrams = []
+        counts = {}
+        for client, bsms, header in updates:
+            client_ip = client_address(client)
+            counts.setdefault(client_ip, 0)
+
+            if self.accepts_batches(client):
+                if frame is not None:
+                    header = {**header, 'frame': frame}
+
+                data = publisher.build(client, bsms, **header)
+                if data is not None:
+                    datagrams.append((data, (client_ip, port)))
+                    counts[client_ip] += 1
+            else:
+                for message in bsms.values():
+                    if frame is not None:
+                        message = {**message, 'frame': frame}
+
+                    datagrams.append((self.wire.encode(client_ip, message, msg_type=msg_type), (client_ip, port)))
+                    counts[client_ip] += 1
+
+        def send_all():
+            for data, addr in datagrams:
+                self._send(data, addr)
+
+        self.loop.call_soon_threadsafe(send_all)
+
+        return counts
+
+    def broadcast_update_to_all(self, message, msg_type=None):
+        msg_type = msg_type or message.get('msg_type', 'sim')
+        self.send_updates([(client_ip, message) for client_ip in self.get_clients()], msg_type=msg_type)
+
+    def rate(self):
+        '''Sleep the remainder of the frame to keep the framerate'''
+        self.rt_iter += 1
+        sleep_duration = self.dt * self.rt_iter - (counter() - self.rt_start_time)
+        if sleep_duration > 0:
+            sleep(sleep_duration)
+        elif sleep_duration < -self.dt:
+            # Too far behind to catch up - restart the frame clock instead of bursting steps
+            self.rt_start_time = counter()
+            self.rt_iter = 0
+
+    def stop(self):
+        if self.running.is_set():
+            self.running.clear()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5.)
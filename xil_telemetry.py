@@ -0,0 +1,159 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+End-to-end latency and jitter telemetry of the XIL loop.
+
+Each message carries the UTC send time of its sender (`current_utc_time` of a BSM). Receivers record
+per peer:
+    - one-way latency: receive time - send time (requires synchronized clocks across hosts)
+    - inter-arrival jitter: RFC 3550 running estimate of the variation of the transit time
+    - out-of-order and dropped datagrams: send times going backwards, or gaps of more than one period
+    - round-trip latency: the server echoes the latest send time of a client in the updates it
+      sends back (`echo_utc_time`), so the client measures send -> integration -> update received
+Frame-deadline misses count loop iterations that took longer than the period.
+
+Results are exported at shutdown as a time series CSV and a JSON summary with p50/p95/p99.
+'''
+
+import os
+import csv
+import json
+from time import time
+
+from step_timing import PhaseHistogram
+
+class LinkStats:
+    '''Latency, jitter and loss statistics of the messages received from one peer'''
+
+    def __init__(self, period):
+        self.period = period  # [s] Expected send period of the peer
+
+        self.latency = PhaseHistogram()
+        self.rtt = PhaseHistogram()
+        self.n_received = 0
+        self.n_out_of_order = 0
+        self.n_dropped = 0
+        self.jitter = 0.  # [s]
+
+        self.last_sent = None
+        self.last_transit = None
+
+    def on_message(self, sent_time, recv_time):
+        '''Record a message sent at sent_time [UTC s] and received at recv_time [UTC s]. Returns the one-way latency [s].'''
+        self.n_received += 1
+
+        if self.last_sent is not None:
+            if sent_time < self.last_sent:
+                self.n_out_of_order += 1
+                return None
+
+            if sent_time == self.last_sent:
+                # Duplicate of the previous message, e.g. re-read from a latest-value slot
+                self.n_received -= 1
+                return None
+
+            # Messages missing from the gap since the previous one
+            self.n_dropped += max(int(round((sent_time - self.last_sent) / self.period)) - 1, 0)
+
+        transit = recv_time - sent_time
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16.
+
+        self.last_sent = sent_time
+        self.last_transit = transit
+        self.latency.add(max(transit, 0.))
+
+        return transit
+
+    def summary(self):
+        return {
+            'n_received': self.n_received,
+            'n_out_of_order': self.n_out_of_order,
+            'n_dropped': self.n_dropped,
+            'jitter_ms': 1e3 * self.jitter,
+            'latency': self.latency.summary(),
+            'rtt': self.rtt.summary(),
+        }
+
+class XILTelemetry:
+    '''Per-peer link statistics, frame-deadline misses and a time series of every sample'''
+
+    def __init__(self, period, keep_series=True):
+        self.period = period  # [s] Frame period
+        self.keep_series = keep_series
+
+        self.links = {}  # {peer: LinkStats}
+        self.frames = PhaseHistogram()
+        self.n_deadline_misses = 0
+
+        self.series = []  # [(utc time, peer, kind, value [s])]
+
+    def get_link(self, peer):
+        link = self.links.get(peer)
+        if link is None:
+            link = self.links[peer] = LinkStats(self.period)
+        return link
+
+    def record_message(self, peer, sent_time, recv_time=None, kind='latency'):
+        '''Record a message from a peer by its send time [UTC s]'''
+        recv_time = time() if recv_time is None else recv_time
+
+        latency = self.get_link(peer).on_message(sent_time, recv_time)
+        if latency is not None and self.keep_series:
+            self.series.append((recv_time, peer, kind, latency))
+
+    def record_rtt(self, peer, echo_time, recv_time=None):
+        '''Record the round trip of a message whose send time [UTC s] was echoed back by a peer'''
+        recv_time = time() if recv_time is None else recv_time
+        rtt = recv_time - echo_time
+
+        self.get_link(peer).rtt.add(max(rtt, 0.))
+        if self.keep_series:
+            self.series.append((recv_time, peer, 'rtt', rtt))
+
+    def record_frame(self, frame_time):
+        '''Record the duration [s] of one loop iteration. Returns True on a frame-deadline miss.'''
+        self.frames.add(frame_time)
+
+        missed = frame_time > self.period
+        if missed:
+            self.n_deadline_misses += 1
+            if self.keep_series:
+                self.series.append((time(), '', 'deadline_miss', frame_time))
+
+        return missed
+
+    def summary(self):
+        return {
+            'period_s': self.period,
+            'frames': self.frames.summary(),
+            'n_deadline_misses': self.n_deadline_misses,
+            'links': {str(peer): link.summary() for peer, link in self.links.items()},
+        }
+
+    def export(self, output_dir, name):
+        '''Write <name>_series.csv and <name>_summary.json to output_dir and return the summary'''
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(os.path.join(output_dir, f'{name}_series.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['utc_time', 'peer', 'kind', 'value_s'])
+            writer.writerows(self.series)
+
+        summary = self.summary()
+        summary_file = os.path.join(output_dir, f'{name}_summary.json')
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+        frames = summary['frames']
+        print(f"XIL telemetry: {frames['count']} frames | p99 frame={frames['p99_ms']:.2f} ms | {self.n_deadline_misses} deadline misses. Wrote {summary_file}.")
+        for peer, link in summary['links'].items():
+            print(f"  {peer}: latency p50={link['latency']['p50_ms']:.2f} p99={link['latency']['p99_ms']:.2f} ms | "
+                  f"rtt p50={link['rtt']['p50_ms']:.2f} ms | jitter={link['jitter_ms']:.2f} ms | "
+                  f"dropped={link['n_dropped']} | out-of-order={link['n_out_of_order']}")
+
+        return summary
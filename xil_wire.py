@@ -0,0 +1,403 @@
+#######################################
+### Tyler Ard                       ###
+### Vehicle Mobility Systems Group  ###
+### tard(at)anl(dot)gov             ###
+#######################################
+
+'''
+Fixed-layout binary wire format of the XIL `bsm` and `sim` messages.
+
+The layouts mirror the BSM and SIM C structs of matlab/serial_utils.h, which the Simulink
+S-functions memcpy onto the wire, so Python and MATLAB clients share one encoding. The BSM field
+order and types are read from msgs/BSM-like.json. Each message is packed with a precompiled
+struct.Struct, and batches of BSMs can be decoded without copies through a NumPy structured dtype.
+
+The encoding is negotiated per client alongside the JSON encoding: a JSON datagram starts with '{'
+while a binary datagram has the size of a whole number of structs, so the format a client sends
+with is the format it is answered with. See WireNegotiator.
+'''
+
+import os
+import json
+import struct
+from enum import Enum
+
+import numpy as np
+
+LAYOUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'msgs', 'BSM-like.json')
+
+MSG_N = 31  # Number of msg type chars
+ID_N = 31  # Number of ID chars
+TRAJ_N = 10  # Number of trajectory points in BSM
+
+# struct codes of the C types with their size and alignment, and the matching NumPy types
+C_TYPES = {
+    's': (1, 1, 'S'),     # uint8_T[]
+    'd': (8, 8, '<f8'),   # real_T
+    'h': (2, 2, '<i2'),   # int16_T
+    'H': (2, 2, '<u2'),   # uint16_T
+}
+
+class WireFormat(Enum):
+    """ Encodings of XIL messages on the wire """
+    JSON = 'json'
+    BINARY = 'binary'
+
+def read_layout(layout_file=LAYOUT_FILE):
+    '''Return the BSM fields [(name, code, count)] in struct order, including the msg_type and id headers'''
+    with open(layout_file, 'r') as f:
+        layout = json.load(f)
+
+    fields = [('msg_type', 's', MSG_N), ('id', 's', ID_N)]
+    for name, fmt in layout.items():
+        count = int(fmt[:-1]) if len(fmt) > 1 else 1
+        fields.append((name, fmt[-1], count))
+
+    return fields
+
+def make_struct(fields):
+    '''
+    Compile little-endian struct and NumPy dtype layouts with the natural alignment and padding of
+    a C compiler, matching sizeof() of the corresponding C struct.
+    '''
+    fmt = '<'
+    offset = 0
+    max_align = 1
+    names, formats, offsets = [], [], []
+
+    for name, code, count in fields:
+        size, align, np_type = C_TYPES[code]
+        max_align = max(max_align, align)
+
+        pad = -offset % align
+        if pad:
+            fmt += f'{pad}x'
+            offset += pad
+
+        names.append(name)
+        offsets.append(offset)
+        if code == 's':
+            fmt += f'{count}s'
+            formats.append(f'S{count}')
+        else:
+            fmt += f'{count}{code}' if count > 1 else code
+            formats.append((np_type, (count,)) if count > 1 else np_type)
+
+        offset += size * count
+
+    pad = -offset % max_align
+    if pad:
+        fmt += f'{pad}x'
+        offset += pad
+
+    packer = struct.Struct(fmt)
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset})
+
+    assert packer.size == dtype.itemsize == offset, 'Mismatched struct and dtype wire layouts.'
+
+    return packer, dtype
+
+BSM_FIELDS = read_layout()
+BSM_STRUCT, BSM_DTYPE = make_struct(BSM_FIELDS)
+BSM_SIZE = BSM_STRUCT.size  # sizeof(BSM) in matlab/serial_utils.h
+
+SIM_FIELDS = [('msg_type', 's', MSG_N), ('id', 's', ID_N), ('sim_status', 'h', 1), ('error_flag', 'h', 1)]
+SIM_STRUCT, SIM_DTYPE = make_struct(SIM_FIELDS)
+SIM_SIZE = SIM_STRUCT.size  # sizeof(SIM) in matlab/serial_utils.h
+
+# Precompiled field plans of encode_bsm/decode_bsm: (name, kind, first value index, count)
+_TEXT, _FLOAT, _INT, _COUNT, _PATH = range(5)
+
+def _make_plan(fields):
+    plan = []
+    i = 0
+    for name, code, count in fields:
+        if code == 's':
+            kind, n_values = _TEXT, 1
+        elif name.endswith('_n'):
+            kind, n_values = _COUNT, 1
+        elif count > 1:
+            kind, n_values = _PATH, count
+        else:
+            kind, n_values = (_FLOAT if code == 'd' else _INT), 1
+        plan.append((name, kind, i, n_values))
+        i += n_values
+
+    return plan
+
+BSM_PLAN = _make_plan(BSM_FIELDS)
+
+def _text(value):
+    '''Return a NUL-padded char array field as str'''
+    return value.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+
+def _pad_path(values):
+    '''Return the first TRAJ_N points of a path, zero-padded to TRAJ_N'''
+    values = list(values[:TRAJ_N])
+    return values + [0.] * (TRAJ_N - len(values))
+
+_EMPTY_PATH = (0.,) * TRAJ_N
+
+def encode_bsm(bsm):
+    '''Pack a BSM dict into BSM_SIZE bytes. Path arrays longer than TRAJ_N are truncated'''
+    get = bsm.get
+    args = []
+    append = args.append
+
+    for name, kind, _, _ in BSM_PLAN:
+        if kind == _FLOAT:
+            append(float(get(name, 0.)))
+
+        elif kind == _PATH:
+            path = get(name)
+            if path is None or len(path) == 0:
+                args.extend(_EMPTY_PATH)
+            else:
+                args.extend(_pad_path(path))
+
+        elif kind == _INT:
+            append(int(get(name, 0)))
+
+        elif kind == _COUNT:
+            # Number of valid path points, from the path arrays when not given
+            path = get(name[:-2] + '_time')
+            n = get(name, 0 if path is None else len(path))
+            append(min(int(n), TRAJ_N))
+
+        else:
+            append(str(get(name, 'bsm' if name == 'msg_type' else '')).encode('utf-8'))
+
+    return BSM_STRUCT.pack(*args)
+
+def pack_bsm_into(buffer, offset, bsm):
+    '''Pack a BSM dict into a writable buffer at offset, e.g. to batch neighbor BSMs into one datagram'''
+    buffer[offset:offset+BSM_SIZE] = encode_bsm(bsm)
+
+def decode_bsm(data, offset=0):
+    '''Unpack one BSM at offset into a dict with the field names of msgs/BSM-like.json'''
+    values = BSM_STRUCT.unpack_from(data, offset)
+
+    bsm = {}
+    n = 0
+    for name, kind, i, count in BSM_PLAN:
+        if kind == _PATH:
+            # Only the valid path points are kept, given by the preceding _n field
+            bsm[name] = list(values[i:i+n])
+        elif kind == _TEXT:
+            bsm[name] = _text(values[i])
+        else:
+            bsm[name] = values[i]
+            if kind == _COUNT:
+                n = min(values[i], TRAJ_N)
+
+    return bsm
+
+def decode_bsm_batch(data):
+    '''Return a zero-copy structured array view of the concatenated BSMs in a datagram'''
+    assert len(data) % BSM_SIZE == 0, f'Datagram of {len(data)} bytes is not a whole number of {BSM_SIZE} byte BSMs.'
+
+    return np.frombuffer(data, dtype=BSM_DTYPE)
+
+def encode_bsm_columns(ids, **columns):
+    '''
+    Pack N BSMs given as columns into one datagram without per-message dicts, e.g.
+
+        encode_bsm_columns(nv_ids, speed=speeds, acceleration=accels, rel_long_gap=gaps)
+
+    Scalar fields take arrays of length N, path fields arrays of shape (N, TRAJ_N) together with
+    their _n field. Fields that are not given are zero.
+    '''
+    batch = np.zeros(len(ids), dtype=BSM_DTYPE)
+    batch['msg_type'] = b'bsm'
+    batch['id'] = [str(id).encode('utf-8') for id in ids]
+
+    for name, values in columns.items():
+        batch[name] = values
+
+    return batch.tobytes()
+
+def encode_sim(sim):
+    '''Pack a SIM dict into SIM_SIZE bytes'''
+    return SIM_STRUCT.pack(
+        str(sim.get('msg_type', 'sim')).encode('utf-8')[:MSG_N],
+        str(sim.get('id', '')).encode('utf-8')[:ID_N],
+        int(sim.get('sim_status', 0)),
+        int(sim.get('error_flag', 0))
+    )
+
+def decode_sim(data, offset=0):
+    '''Unpack one SIM at offset into a dict'''
+    msg_type, id, sim_status, error_flag = SIM_STRUCT.unpack_from(data, offset)
+
+    return {'msg_type': _text(msg_type), 'id': _text(id), 'sim_status': sim_status, 'error_flag': error_flag}
+
+def detect_format(data):
+    '''Return the WireFormat of a received datagram, or None if it matches neither encoding'''
+    if data[:1] == b'{':
+        return WireFormat.JSON
+
+    if len(data) == SIM_SIZE or (len(data) > 0 and len(data) % BSM_SIZE == 0):
+        return WireFormat.BINARY
+
+    return None
+
+class WireNegotiator:
+    '''
+    Tracks the wire format of each client from the datagrams it sends, and encodes/decodes
+    messages for that client accordingly. Clients that have not sent yet use the default format.
+    '''
+
+    def __init__(self, default=WireFormat.JSON):
+        self.default = WireFormat(default)
+        self.formats = {}  # {client: WireFormat}
+
+    def get_format(self, client):
+        return self.formats.get(client, self.default)
+
+    def decode(self, client, data):
+        '''Decode a datagram from a client into a list of message dicts and record its wire format'''
+        wire_format = detect_format(data)
+        if wire_format is None:
+            raise ValueError(f'Unrecognized {len(data)} byte datagram from client {client}.')
+
+        self.formats[client] = wire_format
+
+        if wire_format == WireFormat.JSON:
+            message = json.loads(data.decode('utf-8'))
+            if message.get('msg_type') == 'bsm_batch':
+                return message['bsms']
+            return [message]
+
+        if len(data) == SIM_SIZE:
+            return [decode_sim(data)]
+
+        return [decode_bsm(data, offset) for offset in range(0, len(data), BSM_SIZE)]
+
+    def encode(self, client, message, msg_type='bsm'):
+        '''Encode a message dict in the format negotiated with a client'''
+        if self.get_format(client) == WireFormat.JSON:
+            return json.dumps(message).encode('utf-8')
+
+        if msg_type == 'sim':
+            return encode_sim(message)
+
+        return encode_bsm(message)
+
+    def encode_batch(self, client, messages, msg_type='bsm', **header):
+        '''
+        Encode several BSMs {id: bsm} for a client into one datagram: a JSON object
+        {"msg_type": "bsm_batch", "bsms": [bsm, ...], **header} or the concatenated binary structs.
+        '''
+        if self.get_format(client) == WireFormat.JSON:
+            return _json_encoder.encode({'msg_type': 'bsm_batch', **header, 'bsms': list(messages.values())}).encode('utf-8')
+
+        buffer = bytearray(BSM_SIZE * len(messages))
+        for i, message in enumerate(messages.values()):
+            pack_bsm_into(buffer, i*BSM_SIZE, message)
+
+        return bytes(buffer)
+
+# Compact JSON encoder reused for every batch
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+# BSM fields that change every frame and do not by themselves make a neighbor worth re-sending
+VOLATILE_FIELDS = ('current_utc_time', 'echo_utc_time')
+
+class NeighborPublisher:
+    '''
+    Builds one datagram per client per frame holding the BSMs of all its neighbors.
+
+    In delta mode, neighbors whose fields are unchanged since the last frame are skipped. JSON
+    clients receive only the changed fields of the remaining neighbors, marked "delta": true,
+    with the IDs of departed neighbors listed in "removed". A keyframe with the full neighbor set
+    is sent every keyframe_interval frames, and receivers replace their neighbor table on it
+    (see NeighborTable). Binary clients receive whole structs of the changed neighbors.
+    '''
+
+    def __init__(self, wire, delta=False, keyframe_interval=10):
+        self.wire = wire
+        self.delta = delta
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+
+        self.last_sent = {}  # {client: {nv_id: bsm}} neighbor states known to each client
+        self.frames_since_keyframe = {}  # {client: frames}
+
+    def build(self, client, bsms, **header):
+        '''
+        Return the datagram of neighbor BSMs {nv_id: bsm} for a client, or None when there is nothing
+        to send. JSON batches carry the header fields, e.g. the ego vehicle the neighbors are for.
+        '''
+        frames = self.frames_since_keyframe.get(client, self.keyframe_interval)
+        last = self.last_sent.get(client)
+        self.last_sent[client] = bsms
+
+        if not self.delta or last is None or frames >= self.keyframe_interval:
+            self.frames_since_keyframe[client] = 1
+            if not bsms:
+                return None
+            return self.wire.encode_batch(client, bsms, keyframe=True, **header)
+
+        self.frames_since_keyframe[client] = frames + 1
+
+        is_json = self.wire.get_format(client) == WireFormat.JSON
+        changed = {}
+        for nv_id, bsm in bsms.items():
+            prev = last.get(nv_id)
+            if prev is None:
+                changed[nv_id] = bsm # New neighbor
+                continue
+
+            fields = {key: value for key, value in bsm.items() if prev.get(key) != value and key not in VOLATILE_FIELDS}
+            if not fields:
+                continue
+
+            if is_json:
+                fields['id'] = bsm['id']
+                fields['delta'] = True
+                for key in VOLATILE_FIELDS:
+                    if key in bsm:
+                        fields[key] = bsm[key]
+                changed[nv_id] = fields
+            else:
+                changed[nv_id] = bsm
+
+        removed = [nv_id for nv_id in last if nv_id not in bsms]
+
+        if not changed and not removed:
+            return None
+
+        if is_json:
+            return self.wire.encode_batch(client, changed, keyframe=False, removed=removed, **header)
+
+        # Binary structs carry no removals - departed neighbors are dropped at the next keyframe
+        return self.wire.encode_batch(client, changed) if changed else None
+
+    def forget(self, client):
+        '''Drop the state of a client, e.g. after a reset, so its next frame is a keyframe'''
+        self.last_sent.pop(client, None)
+        self.frames_since_keyframe.pop(client, None)
+
+class NeighborTable:
+    '''Receiver-side neighbor states {nv_id: bsm} merged from keyframes and delta batches'''
+
+    def __init__(self):
+        self.bsms = {}
+
+    def apply(self, message):
+        '''Merge a decoded JSON "bsm_batch" message and return the neighbor states'''
+        if message.get('keyframe', True):
+            self.bsms = {}
+
+        for nv_id in message.get('removed', []):
+            self.bsms.pop(nv_id, None)
+
+        for bsm in message['bsms']:
+            if bsm.get('delta') and bsm['id'] in self.bsms:
+                merged = dict(self.bsms[bsm['id']])
+                merged.update(bsm)
+                merged.pop('delta')
+                self.bsms[bsm['id']] = merged
+            else:
+                self.bsms[bsm['id']] = bsm
+
+        return self.bsms